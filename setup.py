@@ -27,12 +27,18 @@ setup(
     long_description=open('README.md').read(),
     packages=find_packages(exclude=['*tests*']),
     license='MIT',
+    python_requires='>=3.4',
     install_requires=required,
+    extras_require={
+        'async': ['websockets==6.0'],
+        'fast': ['orjson'],
+    },
     tests_require=['httpretty==0.8.14'],
     entry_points={
         'console_scripts': [
             'voysis-vtc = voysis.cmd.vtc:main',
             'record-ma = voysis.cmd.record_ma:main',
+            'voysis-mock-server = voysis.mock.server:main',
         ],
     },
 )
@@ -0,0 +1,22 @@
+import pytest
+
+from voysis.mock.server import MockQueryServer
+
+
+@pytest.fixture
+def audio_frames():
+    """
+    A factory of frame generators holding +seconds+ of 16kHz 16-bit PCM,
+    in chunks of +chunk_size+ bytes filled with +fill+.
+    """
+    def frames(seconds, chunk_size=3200, fill=b'\x00'):
+        return iter([fill * chunk_size] * int(seconds * 32000 // chunk_size))
+    return frames
+
+
+@pytest.fixture
+def mock_server():
+    server = MockQueryServer()
+    server.vad_after = 0.5
+    with server:
+        yield server
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from voysis.client.client import ClientError
+
+websockets = pytest.importorskip('websockets')
+
+from voysis.client.async_ws_client import AsyncWSClient  # noqa: E402
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _client(server):
+    async_client = AsyncWSClient(server.url('ws'), timeout=5)
+    async_client.auth_token = 'token'
+    return async_client
+
+
+def test_streams_one_query(mock_server, audio_frames):
+    async_client = _client(mock_server)
+    notifications = []
+
+    async def stream():
+        try:
+            return await async_client.stream_audio(audio_frames(1), notification_handler=notifications.append)
+        finally:
+            await async_client.close()
+
+    query = _run(stream())
+    assert query['context']['audioBytes'] == 16000
+    assert async_client.current_conversation_id == query['conversationId']
+    assert notifications == ['vad_stop', 'query_complete']
+
+
+def test_concurrent_queries_share_one_connection(mock_server, audio_frames):
+    mock_server.completion_delay = 0.1
+    async_client = _client(mock_server)
+
+    async def stream(count):
+        try:
+            return await asyncio.gather(*[async_client.stream_audio(audio_frames(1)) for _ in range(count)])
+        finally:
+            await async_client.close()
+
+    queries = _run(stream(5))
+    assert len(set(query['id'] for query in queries)) == 5
+    assert all(query['context']['audioBytes'] == 16000 for query in queries)
+    assert mock_server.stats['connections'] == 1
+    assert mock_server.stats['queries'] == 5
+
+
+def test_late_vad_stop_reaches_the_query_that_finalised(mock_server, audio_frames):
+    # Each vad_stop arrives after its query has finalised its audio, while
+    # the next query would be streaming.
+    mock_server.vad_delay = 0.3
+    async_client = _client(mock_server)
+    notifications = [[] for _ in range(3)]
+
+    async def paced_frames():
+        for frame in audio_frames(1):
+            await asyncio.sleep(0.03)
+            yield frame
+
+    async def stream():
+        try:
+            return await asyncio.gather(*[async_client.stream_audio(paced_frames(), received.append)
+                                          for received in notifications])
+        finally:
+            await async_client.close()
+
+    _run(stream())
+    assert notifications == [['vad_stop', 'query_complete']] * 3
+
+
+def test_connection_loss_fails_queries_and_reconnects(mock_server, audio_frames):
+    async_client = _client(mock_server)
+    notifications = []
+
+    async def frames():
+        for index, frame in enumerate(audio_frames(1)):
+            if index == 2:
+                for session in list(mock_server._sessions):
+                    session.drop()
+                await asyncio.sleep(0.2)
+            yield frame
+
+    async def stream():
+        try:
+            with pytest.raises(ClientError) as error_info:
+                await async_client.stream_audio(frames(), notification_handler=notifications.append)
+            # The next query opens a new connection.
+            return error_info.value, await async_client.stream_audio(audio_frames(1))
+        finally:
+            await async_client.close()
+
+    error, query = _run(stream())
+    assert 'connection_closed' in str(error)
+    assert notifications == ['connection_closed']
+    assert query['context']['audioBytes'] == 16000
+    assert mock_server.stats['connections'] == 2
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from voysis.cmd.batch import BatchRunner
+
+
+class _FakeClient(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _FlakyTask(object):
+    """
+    Fails each item its first +failures[item]+ attempts, and finishes items
+    in the reverse of their order.
+    """
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, batch_client, item):
+        with self._lock:
+            self.attempts[item] = self.attempts.get(item, 0) + 1
+            attempt = self.attempts[item]
+        time.sleep(0.02 * (10 - item))
+        if attempt <= self.failures.get(item, 0):
+            raise ValueError('attempt {} of {}'.format(attempt, item))
+        return item * 10
+
+
+def _run(runner, task, items):
+    try:
+        return list(runner.run(items, task))
+    finally:
+        runner.close()
+
+
+def test_retries_and_failure_counting():
+    clients = []
+
+    def new_client():
+        clients.append(_FakeClient())
+        return clients[-1]
+
+    task = _FlakyTask({1: 1, 2: 5})
+    runner = BatchRunner(new_client, concurrency=3, retries=2, retry_delay=0)
+    results = _run(runner, task, range(6))
+    assert [(item, result) for item, result, error in results if not error] == [
+        (0, 0), (1, 10), (3, 30), (4, 40), (5, 50)
+    ]
+    failed = [(item, str(error)) for item, result, error in results if error]
+    assert failed == [(2, 'attempt 3 of 2')]
+    assert task.attempts == {0: 1, 1: 2, 2: 3, 3: 1, 4: 1, 5: 1}
+    assert runner._failed == 1 and runner._completed == 6
+    # One client per worker thread, all closed with the runner.
+    assert 1 <= len(clients) <= 3
+    assert all(batch_client.closed for batch_client in clients)
+
+
+def test_ordered_and_unordered_results():
+    items = list(range(5))
+    ordered = _run(BatchRunner(_FakeClient, concurrency=5), _FlakyTask({}), items)
+    assert [item for item, result, error in ordered] == items
+    unordered = _run(BatchRunner(_FakeClient, concurrency=5, ordered=False), _FlakyTask({}), items)
+    # Later items finish first.
+    assert [item for item, result, error in unordered] == list(reversed(items))
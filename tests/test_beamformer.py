@@ -0,0 +1,44 @@
+import numpy as np
+
+from voysis.device.mic_array.beamformer import SOUND_SPEED
+from voysis.device.mic_array.beamformer import DelayAndSumBeamformer
+from voysis.device.mic_array.beamformer import circular_array
+
+
+def _plane_wave(positions, azimuth, signal, rate):
+    direction = np.array([np.cos(np.radians(azimuth)), np.sin(np.radians(azimuth))])
+    advances = positions.dot(direction) / SOUND_SPEED * rate
+    spectrum = np.fft.rfft(signal)
+    frequencies = np.fft.rfftfreq(len(signal))
+    channels = [np.fft.irfft(spectrum * np.exp(2j * np.pi * frequencies * advance), len(signal))
+                for advance in advances]
+    return (np.stack(channels, axis=1) * 8000).astype('<i2')
+
+
+def _beamform(beamformer, frames, chunk_frames=512):
+    chunks = [beamformer.process(frames[offset:offset + chunk_frames].tobytes())
+              for offset in range(0, len(frames), chunk_frames)]
+    return np.concatenate(chunks)
+
+
+def test_beamformer_passes_steered_direction_and_attenuates_others():
+    rate = 16000
+    positions = circular_array(6, 0.0926, first_angle=30)
+    signal = np.sin(2 * np.pi * 3000 * np.arange(rate) / float(rate))
+    frames = _plane_wave(positions, 90, signal, rate)
+    levels = {}
+    for azimuth in (90, 270):
+        beamformer = DelayAndSumBeamformer(positions, range(6), rate=rate)
+        beamformer.steer(azimuth)
+        output = _beamform(beamformer, frames).astype(float)
+        levels[azimuth] = np.sqrt(np.mean(np.square(output[2000:])))
+    assert abs(levels[90] - 8000 / np.sqrt(2)) < 100
+    assert levels[270] < levels[90] / 2
+
+
+def test_beamformer_decimates_to_16khz():
+    beamformer = DelayAndSumBeamformer(circular_array(4, 0.08127), range(4), rate=48000)
+    frames = np.zeros((48000, 4), dtype='<i2')
+    output = _beamform(beamformer, frames)
+    assert output.dtype == np.dtype('<i2')
+    assert 15800 < len(output) <= 16000
@@ -0,0 +1,63 @@
+import math
+import time
+
+import numpy as np
+
+from voysis.cmd.bench import Benchmark
+from voysis.cmd.bench import LatencyHistogram
+
+
+class _FakeClient(object):
+    def close(self):
+        pass
+
+
+def _nearest_rank(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(1, int(math.ceil(len(ordered) * percentile / 100.0))) - 1]
+
+
+def test_histogram_percentiles_are_within_precision():
+    values = np.random.RandomState(3).lognormal(mean=5, sigma=1, size=20000) + 1
+    histogram = LatencyHistogram(precision=0.01)
+    for value in values:
+        histogram.record(value)
+    for percentile in (1, 50, 90, 99, 99.9):
+        expected = _nearest_rank(values, percentile)
+        assert abs(histogram.percentile(percentile) - expected) <= 0.01 * expected
+    summary = histogram.to_dict()
+    assert summary['count'] == 20000
+    assert summary['min'] == values.min() and summary['max'] == values.max()
+    assert abs(summary['mean'] - values.mean()) < 1e-6 * values.mean()
+    assert histogram.percentile(100) == values.max()
+
+
+def test_histogram_edge_cases():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.to_dict()['p99'] is None
+    histogram.record(250.0)
+    # Percentiles are clamped to the values actually recorded.
+    assert [histogram.percentile(p) for p in (0, 50, 99.9)] == [250.0] * 3
+    histogram.record(-5)
+    assert histogram.min == 0.0
+
+
+def test_open_loop_counts_queueing_against_latency():
+    def slow_task(bench_client, item):
+        time.sleep(0.05)
+        if item == 'bad':
+            raise ValueError(item)
+        return {'vad': 10.0}
+
+    # Queries are due every 10ms but each takes 50ms on a single worker,
+    # so later queries wait behind earlier ones.
+    benchmark = Benchmark(_FakeClient, concurrency=1, qps=100)
+    report = benchmark.run(['good', 'good', 'good', 'bad'], slow_task, requests=8)
+    assert report['mode'] == 'open'
+    assert report['completed'] == 6 and report['failed'] == 2
+    assert report['errors'] == {'ValueError': 2}
+    latency = report['latencyMs']
+    assert latency['vad']['p50'] == 10.0
+    assert latency['service']['max'] < 100
+    assert latency['total']['max'] > 250
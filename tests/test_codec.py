@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from voysis.client import codec
+from voysis.client.ws_client import WSClient
+
+
+def test_get_codec():
+    assert codec.get_codec('json').name == 'json'
+    assert codec.get_codec().name == codec.available_codecs()[0]
+    with pytest.raises(ValueError):
+        codec.get_codec('yaml')
+
+
+def test_encoded_requests_use_cached_headers_until_settings_change():
+    ws_client = WSClient('ws://localhost/websocketapi')
+    ws_client.json_codec = 'json'
+    body = {'type': 'request', 'requestId': 1, 'entity': {'locale': 'en-US'}}
+
+    message = json.loads(ws_client._encode_request(dict(body)))
+    assert message == dict(body, headers=ws_client.create_common_headers())
+    cached = ws_client._get_common_headers()
+    assert ws_client._get_common_headers() is cached
+
+    ws_client._app_token = 'app-token'
+    ws_client.ignore_vad = True
+    message = json.loads(ws_client._encode_request(dict(body)))
+    assert message['headers']['Authorization'] == 'Bearer app-token'
+    assert message['headers']['X-Voysis-Ignore-Vad'] == 'True'
+
+    message = json.loads(ws_client._encode_request(dict(body), {'Accept': 'application/json'}))
+    assert message['headers']['Accept'] == 'application/json'
+    assert ws_client.create_common_headers()['Accept'] == ws_client.api_media_type
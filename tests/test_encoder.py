@@ -0,0 +1,110 @@
+import io
+import warnings
+
+import numpy as np
+import pytest
+
+from voysis.device.encoder import FLAC
+from voysis.device.encoder import FlacEncoder
+from voysis.device.encoder import MULAW
+from voysis.device.encoder import MuLawEncoder
+from voysis.device.encoder import PassThroughEncoder
+from voysis.device.encoder import encoder_factory
+
+# Codes from the G.711 reference implementation, as produced by
+# audioop.lin2ulaw.
+MULAW_VECTORS = [
+    (0, 0xFF), (1, 0xFF), (-1, 0x7E), (4, 0xFE), (-4, 0x7E), (8, 0xFE), (-8, 0x7E),
+    (100, 0xF2), (-100, 0x72), (1000, 0xCE), (-1000, 0x4E), (4000, 0xAF), (-4000, 0x2F),
+    (8000, 0xA0), (-8000, 0x20), (16000, 0x90), (-16000, 0x10), (32124, 0x80), (-32124, 0x00),
+    (32767, 0x80), (-32768, 0x00)
+]
+
+
+def _pcm(samples):
+    return np.asarray(samples, dtype='<i2').tobytes()
+
+
+def _chunks(data, chunk_size):
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)]
+
+
+def _speech_like(sample_count, channels=1, seed=0):
+    generator = np.random.RandomState(seed)
+    t = np.arange(sample_count) / 16000.0
+    signal = 3000 * np.sin(2 * np.pi * 220 * t)[:, None] + generator.normal(0, 300, (sample_count, channels))
+    return np.clip(signal, -32768, 32767).astype('<i2')
+
+
+def _decode_flac(soundfile, encoded):
+    """
+    Decode a FLAC stream with libsndfile.
+    :return: The samples, as an array of shape (frames, channels), and the
+             sample rate.
+    """
+    # The stream header leaves the sample count unset, which SoundFile.read
+    # can't handle, so blocks are read through libsndfile directly.
+    with soundfile.SoundFile(io.BytesIO(encoded)) as flac_file:
+        blocks = []
+        while True:
+            block = np.zeros((4096, flac_file.channels), dtype='<i2')
+            pointer = soundfile._ffi.cast('short *', soundfile._ffi.from_buffer(block))
+            count = soundfile._snd.sf_readf_short(flac_file._file, pointer, len(block))
+            if count <= 0:
+                break
+            blocks.append(block[:count])
+        return np.concatenate(blocks), flac_file.samplerate
+
+
+def test_mulaw_known_vectors():
+    samples = [sample for sample, code in MULAW_VECTORS]
+    encoded = MuLawEncoder().encode(_pcm(samples))
+    assert list(bytearray(encoded)) == [code for sample, code in MULAW_VECTORS]
+
+
+def test_mulaw_matches_audioop_on_every_sample():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        audioop = pytest.importorskip('audioop')
+    every_sample = _pcm(np.arange(-32768, 32768))
+    # Odd-sized chunks split samples across frames.
+    encoded = b''.join(MuLawEncoder().encode_frames(iter(_chunks(every_sample, 1001))))
+    assert encoded == audioop.lin2ulaw(every_sample, 2)
+
+
+@pytest.mark.parametrize('channels,sample_count,chunk_size', [
+    (1, 10, 7),
+    (1, 4097, 1001),
+    (1, 3 * 4096, 4096),
+    (2, 11, 5),
+    (2, 5001, 999),
+])
+def test_flac_round_trips_losslessly(channels, sample_count, chunk_size):
+    soundfile = pytest.importorskip('soundfile')
+    samples = _speech_like(sample_count, channels)
+    samples[:3] = 0
+    audio_encoder = FlacEncoder(rate=16000, channels=channels)
+    encoded = b''.join(audio_encoder.encode_frames(iter(_chunks(samples.tobytes(), chunk_size))))
+    assert encoded.startswith(b'fLaC')
+    decoded, rate = _decode_flac(soundfile, encoded)
+    assert rate == 16000
+    assert decoded.shape == samples.shape
+    assert np.array_equal(decoded, samples)
+
+
+def test_flac_round_trips_constant_and_extreme_blocks():
+    soundfile = pytest.importorskip('soundfile')
+    samples = np.concatenate((
+        np.zeros(4096, dtype='<i2'),
+        np.tile(np.array([32767, -32768], dtype='<i2'), 2048),
+        np.full(100, -5, dtype='<i2')
+    ))
+    encoded = b''.join(FlacEncoder().encode_frames(iter([samples.tobytes()])))
+    decoded, _ = _decode_flac(soundfile, encoded)
+    assert np.array_equal(decoded.ravel(), samples)
+
+
+def test_encoder_factory():
+    assert isinstance(encoder_factory(FLAC, 'audio/pcm;bits=16;rate=16000'), FlacEncoder)
+    assert encoder_factory(MULAW, 'audio/pcm;bits=16;rate=8000').audio_type() == 'audio/pcmu;rate=8000'
+    assert isinstance(encoder_factory(FLAC, 'audio/wav'), PassThroughEncoder)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from voysis.device.mic_array.gcc_phat import gcc_phat
+from voysis.device.mic_array.gcc_phat import NEWTON
+from voysis.device.mic_array.gcc_phat import gcc_phat_multi
+
+
+def _delayed_channels(delays, length=4000):
+    source = np.random.RandomState(1).normal(size=length + 100)
+    spectrum = np.fft.rfft(source)
+    frequencies = np.fft.rfftfreq(len(source))
+    channels = [np.fft.irfft(spectrum * np.exp(-2j * np.pi * frequencies * delay), len(source))[:length]
+                for delay in delays]
+    return (np.stack(channels, axis=1) * 3000).astype(np.int16)
+
+
+def test_gcc_phat_multi_finds_sub_sample_delays():
+    delays = [0, 3.3, -2.6, 5.2, 1.1, -4.7, 2.0, 0.0]
+    block = _delayed_channels(delays)
+    pairs = [[1, 4], [2, 5], [3, 6], [1, 0]]
+    expected = [delays[channel] - delays[reference] for channel, reference in pairs]
+
+    tau, cc = gcc_phat_multi(block, pairs, fs=16000, max_tau=0.001)
+    assert np.allclose(tau * 16000, expected, atol=0.15)
+    assert cc.shape == (33, len(pairs))
+
+    tau, _ = gcc_phat_multi(block, pairs, fs=16000, max_tau=0.001, interp=2)
+    assert np.allclose(tau * 16000, expected, atol=0.02)
+
+    tau, _ = gcc_phat_multi(block, pairs, fs=16000, max_tau=0.001, refine=NEWTON)
+    assert np.allclose(tau * 16000, expected, atol=0.01)
+
+
+def test_gcc_phat_multi_matches_gcc_phat_without_refinement():
+    block = _delayed_channels([0, 3, -2])
+    pairs = [[1, 0], [2, 1]]
+
+    tau, _ = gcc_phat_multi(block, pairs, fs=16000, max_tau=0.001, refine=False)
+
+    single = [gcc_phat(block[:, a], block[:, b], fs=16000, max_tau=0.001, interp=1)[0] for a, b in pairs]
+    assert np.allclose(tau, single)
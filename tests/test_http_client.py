@@ -0,0 +1,20 @@
+from voysis.client.http_client import HTTPClient
+
+
+def test_endpoint_urls_join_without_double_slashes():
+    for base_url in ('http://example.com/api', 'http://example.com/api/'):
+        http_client = HTTPClient(base_url)
+        assert http_client._endpoint_url('/queries') == 'http://example.com/api/queries'
+        assert http_client._endpoint_url('/queries/abc/feedback') == 'http://example.com/api/queries/abc/feedback'
+
+
+def test_query_through_base_url_with_trailing_slash(mock_server, audio_frames):
+    http_client = HTTPClient(mock_server.url('http') + '/')
+    http_client.auth_token = 'token'
+    try:
+        query = http_client.stream_audio(audio_frames(1), notification_handler=lambda reason: None)
+        feedback = http_client.send_feedback(query['id'], rating=3)
+    finally:
+        http_client.close()
+    assert query['context']['audioBytes'] == 32000
+    assert feedback == {'rating': 3, 'queryId': query['id']}
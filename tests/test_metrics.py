@@ -0,0 +1,63 @@
+from six.moves.urllib.request import urlopen
+
+from voysis import metrics
+from voysis.client.ws_client import WSClient
+from voysis.mock.server import MockQueryServer
+
+
+def test_registry_exposes_openmetrics_text():
+    registry = metrics.Registry()
+    queries = registry.counter('test_queries', 'Queries sent.', ['transport'])
+    queries.labels('ws').inc()
+    queries.labels(transport='ws').inc(2)
+    in_flight = registry.gauge('test_in_flight', 'Queries in flight.')
+    in_flight.set_function(lambda: 4)
+    latency = registry.histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value)
+    assert registry.counter('test_queries', 'Queries sent.', ['transport']) is queries
+
+    assert metrics.generate_openmetrics(registry) == '\n'.join([
+        '# TYPE test_in_flight gauge',
+        '# HELP test_in_flight Queries in flight.',
+        'test_in_flight 4.0',
+        '# TYPE test_latency_seconds histogram',
+        '# HELP test_latency_seconds Latency.',
+        'test_latency_seconds_bucket{le="0.1"} 1.0',
+        'test_latency_seconds_bucket{le="1.0"} 3.0',
+        'test_latency_seconds_bucket{le="+Inf"} 4.0',
+        'test_latency_seconds_count 4.0',
+        'test_latency_seconds_sum 4.25',
+        '# TYPE test_queries counter',
+        '# HELP test_queries Queries sent.',
+        'test_queries_total{transport="ws"} 3.0',
+        '# EOF',
+    ]) + '\n'
+
+    server = metrics.start_http_server(0, '127.0.0.1', registry)
+    try:
+        response = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1]))
+        assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+        assert b'test_queries_total{transport="ws"} 3.0' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_ws_client_updates_metrics():
+    queries = metrics.REGISTRY.get('voysis_client_queries').labels('ws')
+    frames = metrics.REGISTRY.get('voysis_client_audio_frames_sent').labels('ws')
+    latency = metrics.REGISTRY.get('voysis_client_response_latency_seconds').labels('ws')
+    opened = metrics.REGISTRY.get('voysis_ws_client_connections_opened')
+    before = (queries.get(), frames.get(), latency._counts[:], opened.get())
+    with MockQueryServer() as server:
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        try:
+            ws_client.stream_audio(iter([b'\x00' * 3200] * 5))
+        finally:
+            ws_client.close()
+    assert queries.get() == before[0] + 1
+    assert frames.get() == before[1] + 5
+    assert sum(latency._counts) == sum(before[2]) + 1
+    assert opened.get() == before[3] + 1
+    assert metrics.REGISTRY.get('voysis_client_queries_in_flight').labels('ws').get() == 0
@@ -0,0 +1,45 @@
+import pytest
+
+from voysis.client.client import ClientError
+from voysis.client.http_client import HTTPClient
+from voysis.client.ws_client import WSClient
+
+
+def test_ws_client_query_stops_on_vad(mock_server, audio_frames):
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    ws_client.auth_token = 'token'
+    notifications = []
+    try:
+        query = ws_client.stream_audio(audio_frames(2), notification_handler=notifications.append)
+        feedback = ws_client.send_feedback(query['id'], rating=5)
+    finally:
+        ws_client.close()
+    assert notifications == ['vad_stop', 'query_complete']
+    assert query['context']['audioBytes'] == 16000
+    assert ws_client.current_conversation_id == query['conversationId']
+    assert feedback == {'rating': 5, 'queryId': query['id']}
+
+
+def test_http_client_query(mock_server, audio_frames):
+    http_client = HTTPClient(mock_server.url('http'))
+    http_client.auth_token = 'token'
+    notifications = []
+    try:
+        query = http_client.stream_audio(audio_frames(1), notification_handler=notifications.append)
+        feedback = http_client.send_feedback(query['id'], rating=4)
+    finally:
+        http_client.close()
+    assert notifications == ['query_complete']
+    assert query['context']['audioBytes'] == 32000
+    assert feedback == {'rating': 4, 'queryId': query['id']}
+
+
+def test_ws_client_reports_injected_errors(mock_server, audio_frames):
+    mock_server.error_rate = 1.0
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    try:
+        with pytest.raises(ClientError):
+            ws_client.stream_audio(audio_frames(1))
+    finally:
+        ws_client.close()
+    assert mock_server.stats['errorsInjected'] == 1
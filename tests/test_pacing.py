@@ -0,0 +1,71 @@
+import time
+
+from voysis.device.pacing import Pacer
+from voysis.device.pacing import UNTHROTTLED
+
+
+class _FakeClock(object):
+    """
+    A clock that only moves when slept on, oversleeping by +oversleep+.
+    """
+
+    def __init__(self, oversleep=0.0):
+        self.now = 100.0
+        self.oversleep = oversleep
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.oversleep
+
+
+def test_rate_mode_makes_up_oversleep_without_drift():
+    fake = _FakeClock(oversleep=0.01)
+    pacer = Pacer(bytes_per_second=32000, speed=2.0, clock=fake.clock, sleep=fake.sleep)
+    deadlines = [pacer.wait(3200) for _ in range(10)]
+    # Each 3200 byte chunk is 0.1s of audio, due every 0.05s at double speed.
+    assert [round(deadline - 100.0, 6) for deadline in deadlines] == [round(0.05 * n, 6) for n in range(1, 11)]
+    # Sleeps are shortened by the previous oversleep, so the last chunk is
+    # only one oversleep late rather than ten.
+    assert abs(fake.sleeps[1] - 0.04) < 1e-9
+    assert abs(fake.now - (100.0 + 0.5 + 0.01)) < 1e-9
+    assert abs(pacer.lag() - 0.01) < 1e-9
+
+
+def test_interval_mode_ignores_chunk_length():
+    fake = _FakeClock()
+    pacer = Pacer(speed=2.0, interval=0.08, clock=fake.clock, sleep=fake.sleep)
+    deadlines = [pacer.wait(length) for length in (100, 5000, 1, 3200)]
+    assert [round(deadline - 100.0, 6) for deadline in deadlines] == [0.0, 0.08, 0.16, 0.24]
+
+
+def test_unthrottled_never_sleeps():
+    fake = _FakeClock()
+    pacer = Pacer(speed=UNTHROTTLED, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(100):
+        pacer.wait(3200)
+    assert fake.sleeps == []
+    assert pacer.lag() == 0.0
+
+
+def test_lag_reports_a_slow_consumer():
+    fake = _FakeClock()
+    pacer = Pacer(bytes_per_second=32000, clock=fake.clock, sleep=fake.sleep)
+    pacer.wait(3200)
+    fake.now += 0.35
+    assert abs(pacer.lag() - 0.35) < 1e-9
+    # The next chunk is already overdue, so it is released at once.
+    pacer.wait(3200)
+    assert len(fake.sleeps) == 1
+
+
+def test_real_time_pacing_on_the_monotonic_clock():
+    pacer = Pacer(bytes_per_second=32000, speed=4.0)
+    started = time.monotonic()
+    for _ in range(8):
+        pacer.wait(3200)
+    # 0.8s of audio at four times real time.
+    assert 0.19 <= time.monotonic() - started < 0.4
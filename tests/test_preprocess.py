@@ -0,0 +1,69 @@
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+from voysis.cmd.batch import find_wav_files
+from voysis.device import preprocess
+
+
+def _write_wav(path, samples, rate=16000):
+    wav_writer = wave.open(str(path), 'wb')
+    wav_writer.setnchannels(1)
+    wav_writer.setsampwidth(2)
+    wav_writer.setframerate(rate)
+    wav_writer.writeframes(samples.astype('<i2').tobytes())
+    wav_writer.close()
+
+
+def test_preprocess_files_trims_normalises_and_caches(tmp_path):
+    rate = 16000
+    samples = np.random.RandomState(0).normal(0, 20, rate * 3)
+    time = np.arange(rate) / float(rate)
+    samples[rate:2 * rate] += 4000 * np.sin(2 * np.pi * 300 * time)
+    source = tmp_path / 'query.wav'
+    _write_wav(source, samples)
+
+    prepared = preprocess.preprocess_files([str(source)], processes=1)
+
+    assert prepared == [str(tmp_path / 'query.trimmed.wav')]
+    wav_reader = wave.open(prepared[0], 'rb')
+    trimmed = np.frombuffer(wav_reader.readframes(wav_reader.getnframes()), dtype='<i2')
+    wav_reader.close()
+    assert abs(len(trimmed) - 1.4 * rate) <= 0.05 * rate
+    assert 29000 <= np.max(np.abs(trimmed)) <= 29300
+    mtime = os.path.getmtime(prepared[0])
+    assert preprocess.preprocess_file(str(source)) == prepared[0]
+    assert os.path.getmtime(prepared[0]) == mtime
+    assert find_wav_files(str(tmp_path)) == [str(source)]
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    source = tmp_path / 'query.wav'
+    _write_wav(source, np.zeros(16000))
+
+    def failing_rename(source_path, target_path):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(preprocess.os, 'rename', failing_rename)
+    with pytest.raises(OSError):
+        preprocess.preprocess_file(str(source))
+    assert os.listdir(str(tmp_path)) == ['query.wav']
+
+
+def test_main_reuses_cached_copies_unless_forced(tmp_path, monkeypatch, capsys):
+    source = tmp_path / 'query.wav'
+    _write_wav(source, np.zeros(16000))
+    prepared = preprocess.trimmed_path(str(source))
+    monkeypatch.setattr(sys, 'argv', ['preprocess', '--processes', '1', str(tmp_path)])
+    preprocess.main()
+    os.utime(prepared, (1, 1))
+    os.utime(str(source), (0, 0))
+    preprocess.main()
+    assert os.path.getmtime(prepared) == 1
+    monkeypatch.setattr(sys, 'argv', ['preprocess', '--force', '--processes', '1', str(tmp_path)])
+    preprocess.main()
+    assert os.path.getmtime(prepared) > 1
+    assert capsys.readouterr().out.split() == [prepared] * 3
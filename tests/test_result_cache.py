@@ -0,0 +1,90 @@
+import io
+import os
+import time
+
+from voysis.client import result_cache
+from voysis.client.result_cache import ResultCache
+from voysis.client.ws_client import WSClient
+from voysis.device.file_device import FileDevice
+from voysis.mock.server import MockQueryServer
+
+
+def test_result_cache_tiers_expiry_and_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_memory_bytes=40, max_disk_bytes=50, ttl=0)
+    cache.put('a', {'id': 'a' * 10})
+    cache.put('b', {'id': 'b' * 10})
+    os.utime(str(tmp_path / 'a.json'), (1, 1))
+    assert cache.get('a') == {'id': 'a' * 10}
+    cache.put('c', {'id': 'c' * 10})
+    assert list(cache._memory) == ['a', 'c']
+    assert sorted(os.listdir(str(tmp_path))) == ['b.json', 'c.json']
+
+    # A new cache sharing the directory reads results from disk.
+    shared = ResultCache(str(tmp_path))
+    assert shared.get('b') == {'id': 'b' * 10}
+    assert shared.get('a') is None
+    assert (shared.hits, shared.misses) == (1, 1)
+
+    expiring = ResultCache(str(tmp_path), ttl=0.01)
+    expiring.put('d', {'id': 'd'})
+    time.sleep(0.02)
+    assert expiring.get('d') is None
+    assert not os.path.exists(str(tmp_path / 'd.json'))
+
+
+def _stream_new_conversation(ws_client, audio, notification_handler=None):
+    device = FileDevice(io.BytesIO(audio))
+    device.playback_speed = 0
+    ws_client.current_conversation_id = None
+    ws_client.current_context = None
+    digest = device.audio_digest()
+    device.start_recording()
+    return ws_client.stream_audio(device.generate_frames(), notification_handler,
+                                  audio_type=device.audio_type(), audio_digest=digest)
+
+
+def test_ws_client_answers_repeated_audio_from_cache():
+    audio = b'\x01\x00' * 16000
+    notifications = []
+    with MockQueryServer() as server:
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        ws_client.result_cache = ResultCache()
+        try:
+            results = [_stream_new_conversation(ws_client, audio, notifications.append) for _ in range(2)]
+        finally:
+            ws_client.close()
+        queries = server.stats['queries']
+    assert results[0] == results[1]
+    assert queries == 1
+    assert notifications == ['query_complete', result_cache.RESULT_CACHE]
+    assert ws_client.current_conversation_id == results[0]['conversationId']
+
+
+def test_result_cache_limits_count_bytes(tmp_path):
+    result = {'text': u'é' * 20}
+    cache = ResultCache(str(tmp_path))
+    # With a codec that leaves non-ASCII characters unescaped, this is room
+    # for the result's characters but not its bytes.
+    encoded_size = len(cache._codec.dumps(result).encode('utf-8'))
+    cache.max_memory_bytes = encoded_size - 1
+    cache.put('a', result)
+    assert 'a' not in cache._memory
+    cache.max_memory_bytes = encoded_size
+    cache.put('a', result)
+    assert cache._memory_bytes == encoded_size
+    assert cache._disk_bytes == os.path.getsize(str(tmp_path / 'a.json'))
+    assert ResultCache(str(tmp_path)).get('a') == result
+
+
+def test_ignore_vad_is_part_of_the_cache_key():
+    audio = b'\x01\x00' * 16000
+    with MockQueryServer() as server:
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        ws_client.result_cache = ResultCache()
+        try:
+            for ignore_vad in (False, True, True):
+                ws_client.ignore_vad = ignore_vad
+                _stream_new_conversation(ws_client, audio)
+        finally:
+            ws_client.close()
+        assert server.stats['queries'] == 2
@@ -0,0 +1,51 @@
+import threading
+
+from voysis.device import ring_buffer
+from voysis.device.ring_buffer import RingBuffer
+
+
+def test_ring_buffer_wraps_and_blocks_until_data_arrives():
+    buffer = RingBuffer(8)
+    buffer.write(b'abcdef')
+    assert buffer.read(4) == b'abcd'
+    buffer.write(b'ghijkl')
+    assert buffer.read(8) == b'efghijkl'
+
+    writer = threading.Timer(0.05, buffer.write, (b'mn',))
+    writer.start()
+    assert buffer.read(2, timeout=5) == b'mn'
+    assert buffer.read(1, timeout=0.01) is None
+    assert buffer.underruns == 2
+
+
+def test_ring_buffer_overflow_policies():
+    overwrite = RingBuffer(4, ring_buffer.OVERWRITE)
+    overwrite.write(b'abc')
+    overwrite.write(b'def')
+    assert overwrite.read(4) == b'cdef'
+    assert (overwrite.overruns, overwrite.dropped_bytes) == (1, 2)
+
+    drop = RingBuffer(4, ring_buffer.DROP)
+    drop.write(b'abc')
+    assert drop.write(b'def') == 1
+    assert drop.read(4) == b'abcd'
+    assert (drop.overruns, drop.dropped_bytes) == (1, 2)
+
+
+def test_ring_buffer_close_wakes_reader():
+    buffer = RingBuffer(4)
+    buffer.write(b'a')
+    threading.Timer(0.05, buffer.close).start()
+    assert buffer.read(4, timeout=5) == b'a'
+    assert buffer.read(4) == b''
+
+
+def test_ring_buffer_clear_keeps_recent_bytes():
+    buffer = RingBuffer(4)
+    buffer.write(b'abcdef')
+    assert buffer.read(4) == b'cdef'
+    assert buffer.clear(keep=2) == 2
+    assert buffer.read(2) == b'ef'
+    assert buffer.clear(keep=10) == 4
+    assert buffer.read(4) == b'cdef'
+    assert buffer.overruns == 0
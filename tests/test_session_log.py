@@ -0,0 +1,145 @@
+import gc
+import json
+
+import pytest
+
+from voysis.client import session_log
+from voysis.client.ws_client import WSClient
+from voysis.device.encoder import MULAW
+from voysis.mock.server import MockQueryServer
+
+
+def _record_query(server, path, frames):
+    ws_client = WSClient(server.url('ws'), timeout=5)
+    ws_client.auth_token = 'token'
+    with session_log.SessionRecorder(path) as recorder:
+        ws_client.session_recorder = recorder
+        try:
+            return ws_client.stream_audio(frames)
+        finally:
+            ws_client.close()
+
+
+def test_recorded_session_holds_query_audio_and_messages(tmp_path, audio_frames):
+    path = str(tmp_path / 'session.vsl')
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        server.completion_delay = 0.05
+        query = _record_query(server, path, audio_frames(1, fill=b'\x01'))
+    records = list(session_log.read_session_log(path))
+    assert records[0].kind == session_log.OPEN
+    assert set(record.session for record in records) == {1}
+    recorded_queries = session_log.recorded_queries(path)
+    assert len(recorded_queries) == 1
+    recorded = recorded_queries[0]
+    assert recorded.query_id == query['id']
+    assert recorded.completed_query == query
+    assert recorded.audio_type == 'audio/pcm;bits=16;rate=16000'
+    assert len(recorded.frames) >= 5
+    assert all(data == b'\x01' * 3200 for offset, data in recorded.frames)
+    offsets = [offset for offset, message in recorded.messages]
+    assert offsets == sorted(offsets)
+    assert [message.get('notificationType') for offset, message in recorded.messages] == [
+        None, 'vad_stop', 'query_complete'
+    ]
+    assert recorded.latency() > 0
+    # A truncated record at the end of the log is ignored.
+    with open(path, 'ab') as log_file:
+        log_file.write(session_log.MAGIC + b'\x02\x01')
+    assert len(list(session_log.read_session_log(path))) == len(records)
+
+
+def test_empty_sessions_do_not_hide_later_ones(tmp_path, audio_frames):
+    path = str(tmp_path / 'session.vsl')
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        _record_query(server, path, audio_frames(1))
+        first = list(session_log.read_session_log(path))
+        # A recorder that records nothing writes nothing.
+        session_log.SessionRecorder(path).close()
+        with open(path, 'rb') as log_file:
+            assert len(log_file.read()) == sum(session_log.RECORD_HEADER.size + len(record.data)
+                                               for record in first) + len(session_log.MAGIC)
+        _record_query(server, path, audio_frames(1))
+    records = list(session_log.read_session_log(path))
+    assert [record.session for record in records] == [1] * len(first) + [2] * (len(records) - len(first))
+    assert len(records) > len(first)
+    assert len(session_log.recorded_queries(path)) == 2
+
+
+def test_credentials_are_not_recorded(tmp_path, audio_frames):
+    path = str(tmp_path / 'session.vsl')
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        _record_query(server, path, audio_frames(1))
+    with open(path, 'rb') as log_file:
+        assert b'Bearer' not in log_file.read()
+    requests = [json.loads(record.data.decode('utf-8')) for record in session_log.read_session_log(path)
+                if record.kind == session_log.SENT_TEXT]
+    assert [request['restUri'] for request in requests] == ['/tokens', '/queries']
+    assert all('Authorization' not in request['headers'] for request in requests)
+    assert all('User-Agent' in request['headers'] for request in requests)
+
+
+class _Owner(object):
+    pass
+
+
+def test_channels_are_not_passed_on_to_new_owners(tmp_path):
+    with session_log.SessionRecorder(str(tmp_path / 'session.vsl')) as recorder:
+        owner = _Owner()
+        assert recorder.channel_for(owner) == 1
+        assert recorder.channel_for(owner) == 1
+        del owner
+        gc.collect()
+        # A new owner may reuse the collected owner's id, but not its channel.
+        owners = [_Owner() for _ in range(10)]
+        assert [recorder.channel_for(owner) for owner in owners] == list(range(2, 12))
+        recorder._last_channel = session_log.MAX_CHANNEL - 1
+        assert recorder.channel_for(_Owner()) == session_log.MAX_CHANNEL
+        with pytest.raises(ValueError):
+            recorder.channel_for(_Owner())
+    records = list(session_log.read_session_log(str(tmp_path / 'session.vsl')))
+    assert [record.channel for record in records] == list(range(1, 12)) + [session_log.MAX_CHANNEL]
+
+
+def test_mock_server_replays_recorded_session(tmp_path, audio_frames):
+    path = str(tmp_path / 'session.vsl')
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        query = _record_query(server, path, audio_frames(1, fill=b'\x01'))
+    server = MockQueryServer()
+    server.replay_session = path
+    with server:
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        ws_client.auth_token = 'token'
+        try:
+            replayer = session_log.SessionReplayer(session_log.recorded_queries(path), speed=0)
+            replayed = replayer.replay(ws_client)
+        finally:
+            ws_client.close()
+    assert len(replayed) == 1
+    assert 'error' not in replayed[0]
+    assert replayed[0]['result'] == query
+    assert replayed[0]['recordedQueryId'] == query['id']
+    assert replayed[0]['latency'] >= 0
+
+
+def test_replay_sends_recorded_frames_without_encoding_them_again(tmp_path, audio_frames):
+    path = str(tmp_path / 'session.vsl')
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        recorded = _record_query(server, path, audio_frames(1, fill=b'\x01'))
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        ws_client.auth_token = 'token'
+        ws_client.audio_encoding = MULAW
+        ws_client.client_vad = True
+        try:
+            replayer = session_log.SessionReplayer(session_log.recorded_queries(path), speed=0)
+            replayed = replayer.replay(ws_client)
+        finally:
+            ws_client.close()
+    result = replayed[0]['result']
+    assert result['audioQuery']['mimeType'] == recorded['audioQuery']['mimeType'] == 'audio/pcm;bits=16;rate=16000'
+    assert result['context']['audioBytes'] == recorded['context']['audioBytes']
+    assert (ws_client.audio_encoding, ws_client.client_vad) == (MULAW, True)
@@ -0,0 +1,78 @@
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from dateutil.tz import tzutc
+
+from voysis.client.token_handler import TokenCache
+from voysis.client.token_handler import token_cache_key
+
+
+class _Issuer(object):
+    def __init__(self, lifetime, delay=0.0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.issued = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self._lock:
+            self.issued += 1
+            token = 'token-{}'.format(self.issued)
+        return token, datetime.now(tzutc()) + timedelta(seconds=self.lifetime)
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_file_lock_shares_one_token_between_caches(tmp_path):
+    path = str(tmp_path / 'tokens.json')
+    key = token_cache_key('ws://example', 'auth')
+    issuer = _Issuer(3600, delay=0.1)
+    # Separate caches on one file stand in for separate processes.
+    caches = [TokenCache(path), TokenCache(path)]
+    tokens = []
+    threads = [threading.Thread(target=lambda cache=cache: tokens.append(cache.get_token(key, issuer)[0]))
+               for cache in caches * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert issuer.issued == 1
+    assert tokens == ['token-1'] * 4
+    assert TokenCache(path).get_token(key, issuer)[0] == 'token-1'
+    assert TokenCache(path).get_token(key, issuer, force=True)[0] == 'token-2'
+
+
+def test_tokens_are_refreshed_in_the_background():
+    key = token_cache_key('ws://example', 'auth')
+    issuer = _Issuer(1.2)
+    cache = TokenCache(refresh_margin=1, expiry_margin=0)
+    try:
+        assert cache.get_token(key, issuer)[0] == 'token-1'
+        assert _wait_until(lambda: issuer.issued >= 2)
+        assert cache.get_token(key, issuer)[0] == 'token-{}'.format(issuer.issued)
+    finally:
+        cache.unregister(issuer)
+
+
+def test_lifetime_shorter_than_refresh_margin_does_not_spin():
+    key = token_cache_key('ws://example', 'auth')
+    issuer = _Issuer(60)
+    cache = TokenCache(refresh_margin=120)
+    try:
+        assert cache.get_token(key, issuer)[0] == 'token-1'
+        time.sleep(0.5)
+        # One background refresh, then a pause before the next attempt.
+        assert issuer.issued <= 2
+        assert cache.get_token(key, issuer)[0] == 'token-{}'.format(issuer.issued)
+    finally:
+        cache.unregister(issuer)
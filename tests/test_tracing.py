@@ -0,0 +1,72 @@
+from voysis.client import tracing
+from voysis.client.http_client import HTTPClient
+from voysis.client.ws_client import WSClient
+from voysis.mock.server import MockQueryServer
+
+
+def _phases(events):
+    return [(event.name, event.phase) for event in events]
+
+
+def test_ws_client_traces_query_phases(audio_frames):
+    tracer = tracing.RecordingTracer()
+    with MockQueryServer() as server:
+        server.vad_after = 0.5
+        ws_client = WSClient(server.url('ws'), timeout=5)
+        ws_client.auth_token = 'token'
+        ws_client.tracer = tracer
+        taken = []
+
+        def frames():
+            for frame in audio_frames(2):
+                taken.append(len(frame))
+                yield frame
+
+        try:
+            query = ws_client.stream_audio(frames())
+        finally:
+            ws_client.close()
+    trace_ids = tracer.trace_ids()
+    assert len(trace_ids) == 1
+    events = tracer.events(trace_ids[0])
+    phases = _phases(events)
+    assert phases[:6] == [
+        ('query', 'begin'), ('connect', 'begin'), ('connect', 'end'),
+        ('token_refresh', 'begin'), ('token_refresh', 'end'), ('query_create', 'begin')
+    ]
+    assert ('query_create', 'end') in phases
+    assert phases.index(('first_audio', 'instant')) < phases.index(('vad_stop', 'instant'))
+    assert phases.index(('vad_stop', 'instant')) < phases.index(('query_complete', 'instant'))
+    assert phases[-1] == ('query', 'end')
+    assert [event.timestamp for event in events] == sorted(event.timestamp for event in events)
+    end = events[-1]
+    assert end.attributes['queryId'] == query['id']
+    assert end.attributes['conversationId'] == query['conversationId']
+    assert end.attributes['completed']
+    # Audio keeps going until vad_stop reaches the client, so how much is
+    # sent varies. The frame taken when it arrives is not sent.
+    audio_sent = [sum(taken), sum(taken[:-1])]
+    assert min(audio_sent) >= 16000
+    assert any(0 < end.bytes_sent - audio_bytes < 1000 for audio_bytes in audio_sent)
+    assert end.bytes_received > 0
+    durations = tracer.durations(trace_ids[0])
+    assert durations['query'] >= durations['audio'] > 0
+
+
+def test_http_client_traces_prepared_query(audio_frames):
+    tracer = tracing.RecordingTracer()
+    with MockQueryServer() as server:
+        http_client = HTTPClient(server.url('http'))
+        http_client.tracer = tracer
+        try:
+            prepared_query = http_client.prepare()
+            http_client.stream_audio(audio_frames(1), notification_handler=lambda reason: None,
+                                     prepared_query=prepared_query)
+        finally:
+            http_client.close()
+    events = tracer.events()
+    assert {event.trace_id for event in events} == {prepared_query.trace.trace_id}
+    phases = _phases(events)
+    assert phases[:2] == [('query', 'begin'), ('prepare', 'begin')]
+    assert ('last_audio', 'instant') in phases
+    assert events[-1].bytes_sent > 32000
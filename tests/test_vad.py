@@ -0,0 +1,47 @@
+import numpy as np
+
+from voysis.client.ws_client import WSClient
+from voysis.device.vad import EnergyVad
+from voysis.mock.server import MockQueryServer
+
+
+def _speech_then_silence(rate=16000, leading=0.5, speech=1.0, trailing=3.0):
+    random = np.random.RandomState(0)
+    noise = random.normal(0, 30, int(rate * (leading + speech + trailing)))
+    start = int(rate * leading)
+    end = int(rate * (leading + speech))
+    time = np.arange(end - start) / float(rate)
+    noise[start:end] += 8000 * np.sin(2 * np.pi * 220 * time)
+    return noise.astype('<i2').tobytes()
+
+
+def _chunks(data, chunk_size=1024):
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)]
+
+
+def test_energy_vad_stops_after_trailing_silence():
+    frames = _chunks(_speech_then_silence())
+    passed = list(EnergyVad(silence_duration=0.8).filter_frames(iter(frames)))
+    passed_seconds = sum(len(frame) for frame in passed) / 32000.0
+    assert 2.2 <= passed_seconds <= 2.5
+
+
+def test_energy_vad_ignores_silence():
+    vad = EnergyVad()
+    frames = _chunks(_speech_then_silence(speech=0))
+    assert len(list(vad.filter_frames(iter(frames)))) == len(frames)
+    assert not vad.speech_started
+
+
+def test_ws_client_finalises_audio_on_client_vad():
+    with MockQueryServer() as mock_server:
+        ws_client = WSClient(mock_server.url('ws'), timeout=5)
+        ws_client.client_vad = True
+        notifications = []
+        try:
+            query = ws_client.stream_audio(iter(_chunks(_speech_then_silence())),
+                                           notification_handler=notifications.append)
+        finally:
+            ws_client.close()
+    assert notifications == ['client_vad', 'query_complete']
+    assert query['context']['audioBytes'] <= 2.5 * 32000
@@ -1,4 +1,63 @@
+import sys
+import wave
+
+import pytest
+
 
 def test_vtc():
     # TODO write tests for vtc components
     pass
+
+
+def _write_corpus(folder, count):
+    for index in range(count):
+        wav_file = wave.open(str(folder / 'query{}.wav'.format(index)), 'wb')
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        # Each file's samples differ, so each has its own cache entry.
+        wav_file.writeframes(bytes(bytearray([index, 0])) * 1600)
+        wav_file.close()
+
+
+@pytest.mark.parametrize('error_rate,exit_code', [(0.0, None), (1.0, 1)])
+def test_batch_exit_code_reflects_failures(tmp_path, monkeypatch, mock_server, error_rate, exit_code):
+    pytest.importorskip('pyaudio')
+    from voysis.cmd import vtc
+    corpus = tmp_path / 'corpus'
+    corpus.mkdir()
+    _write_corpus(corpus, 3)
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(u'[general]\nplayback_speed = 0\n')
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(sys, 'argv', ['voysis-vtc', '-c', str(config_file), '-u', mock_server.url('http'),
+                                      'query', '--batch', str(corpus), '--concurrency', '2'])
+    mock_server.error_rate = error_rate
+    if exit_code is None:
+        vtc.main()
+    else:
+        with pytest.raises(SystemExit) as exit_info:
+            vtc.main()
+        assert exit_info.value.code == exit_code
+    assert mock_server.stats['queries'] == (3 if exit_code is None else 0)
+
+
+def test_batch_results_are_cached_regardless_of_file_order(tmp_path, mock_server):
+    pytest.importorskip('pyaudio')
+    from voysis.client.result_cache import ResultCache
+    from voysis.cmd import vtc
+    corpus = tmp_path / 'corpus'
+    corpus.mkdir()
+    _write_corpus(corpus, 6)
+    query_result_cache = ResultCache(str(tmp_path / 'cache'))
+
+    def use_cache(query_client):
+        query_client.result_cache = query_result_cache
+
+    for ordered in (True, False):
+        failures = vtc.stream_batch(mock_server.url('http'), str(corpus), concurrency=3, ordered=ordered,
+                                    client_setup=use_cache)
+        assert failures == 0
+    # Every file in the second run is answered from the cache, whichever
+    # client streams it.
+    assert mock_server.stats['queries'] == 6
@@ -0,0 +1,51 @@
+import io
+import struct
+import wave
+
+import numpy as np
+
+from voysis.device import wav
+from voysis.device.file_device import FileDevice
+
+
+def _wav_bytes(samples, rate=16000, channels=1, sample_width=2):
+    output = io.BytesIO()
+    wav_writer = wave.open(output, 'wb')
+    wav_writer.setnchannels(channels)
+    wav_writer.setsampwidth(sample_width)
+    wav_writer.setframerate(rate)
+    wav_writer.writeframes(samples.tobytes())
+    wav_writer.close()
+    return output.getvalue()
+
+
+def _with_list_chunk(wav_data):
+    list_chunk = b'LIST' + struct.pack('<I', 5) + b'INFO\x00\x00'
+    return wav_data[:36] + list_chunk + wav_data[36:]
+
+
+def test_read_wav_header_skips_metadata_chunks():
+    samples = np.arange(100, dtype='<i2')
+    wav_file = io.BytesIO(_with_list_chunk(_wav_bytes(samples, rate=8000)))
+    wav_format = wav.read_wav_header(wav_file)
+    assert wav_format.rate == 8000
+    assert wav_format.channels == 1
+    assert wav_format.bits == 16
+    assert wav_format.data_size == 200
+    assert wav_file.read() == samples.tobytes()
+
+
+def test_read_wav_header_leaves_raw_files_untouched():
+    wav_file = io.BytesIO(b'\x01\x02' * 10)
+    assert wav.read_wav_header(wav_file) is None
+    assert wav_file.tell() == 0
+
+
+def test_file_device_converts_stereo_to_mono():
+    stereo = np.array([[100, 300], [-200, -400]] * 500, dtype='<i2')
+    device = FileDevice(io.BytesIO(_wav_bytes(stereo, rate=22050, channels=2)))
+    device.playback_speed = 0
+    assert device.audio_type() == 'audio/pcm;bits=16;rate=22050'
+    device.start_recording()
+    mono = np.frombuffer(b''.join(bytes(frame) for frame in device.generate_frames()), dtype='<i2')
+    assert np.array_equal(mono, np.array([200, -300] * 500))
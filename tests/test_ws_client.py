@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from voysis.client import ws_client as ws_client_module
+from voysis.client.client import ClientError
+from voysis.client.ws_client import WSClient
+
+
+def test_concurrent_queries_share_one_connection(mock_server, audio_frames):
+    mock_server.completion_delay = 0.1
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    ws_client.auth_token = 'token'
+    results = {}
+    notifications = {}
+
+    def stream(index):
+        notifications[index] = []
+        try:
+            results[index] = ws_client.stream_audio(audio_frames(1), notifications[index].append)
+        except Exception as error:
+            results[index] = error
+
+    threads = [threading.Thread(target=stream, args=(index,)) for index in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        ws_client.close()
+    assert all(isinstance(result, dict) for result in results.values()), results
+    assert len(set(result['id'] for result in results.values())) == 4
+    # Each query's audio ended at its own vad_stop, with no frames
+    # credited to a query streaming alongside it.
+    assert [result['context']['audioBytes'] for result in results.values()] == [16000] * 4
+    assert all(received == ['vad_stop', 'query_complete'] for received in notifications.values())
+    assert mock_server.stats['connections'] == 1
+    assert mock_server.stats['queries'] == 4
+
+
+def test_late_vad_stop_reaches_the_query_that_finalised(mock_server, audio_frames):
+    # Each query takes 0.3s to send its audio, and its vad_stop arrives
+    # 0.45s after it started, while the next query would be streaming.
+    mock_server.vad_delay = 0.3
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    notifications = {}
+
+    def paced_frames():
+        for frame in audio_frames(1):
+            time.sleep(0.03)
+            yield frame
+
+    def stream(index):
+        notifications[index] = []
+        ws_client.stream_audio(paced_frames(), notifications[index].append)
+
+    threads = [threading.Thread(target=stream, args=(index,)) for index in range(3)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        ws_client.close()
+    assert all(received == ['vad_stop', 'query_complete'] for received in notifications.values()), notifications
+    assert mock_server.stats['queries'] == 3
+
+def test_pending_requests_fail_when_the_connection_drops(mock_server):
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    try:
+        ws_client.connect()
+        mock_server.drop_rate = 1.0
+        future = ws_client.send_request('/queries', {})
+        with pytest.raises(ClientError):
+            future.wait_until_complete(5)
+        assert not ws_client.is_connected()
+    finally:
+        ws_client.close()
+
+
+def test_dropped_connection_is_reported_as_the_query_failure(mock_server, audio_frames):
+    mock_server.completion_delay = 5
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    ws_client.auth_token = 'token'
+    notifications = []
+
+    def drop_connections():
+        for session in list(mock_server._sessions):
+            session.drop()
+
+    # The audio is sent by then, and the query is waiting on completion.
+    dropper = threading.Timer(0.3, drop_connections)
+    dropper.start()
+    try:
+        with pytest.raises(ClientError) as error_info:
+            ws_client.stream_audio(audio_frames(0.2), notifications.append)
+    finally:
+        dropper.join()
+        ws_client.close()
+    assert str(error_info.value) == 'Query failed connection_closed'
+    assert notifications == ['connection_closed']
+
+
+def test_reconnects_with_backoff_after_connection_loss(mock_server, audio_frames):
+    ws_client = WSClient(mock_server.url('ws'), timeout=5)
+    ws_client.auth_token = 'token'
+    ws_client.reconnect_backoff = 0.05
+    attempts = ws_client_module.RECONNECT_ATTEMPTS.get()
+    try:
+        ws_client.stream_audio(audio_frames(1))
+        # Restart the server on the same port once the client has started
+        # retrying.
+        mock_server.stop()
+        restart = threading.Timer(0.2, mock_server.start)
+        restart.start()
+        query = ws_client.stream_audio(audio_frames(1))
+        restart.join()
+    finally:
+        ws_client.close()
+    assert query['context']['audioBytes'] == 16000
+    assert ws_client_module.RECONNECT_ATTEMPTS.get() > attempts
+
+
+def test_backoff_delay_doubles_up_to_the_maximum():
+    ws_client = WSClient('ws://127.0.0.1:1/websocketapi')
+    ws_client.reconnect_backoff = 0.1
+    ws_client.reconnect_backoff_max = 0.4
+    for attempt, ceiling in ((1, 0.1), (2, 0.2), (3, 0.4), (6, 0.4)):
+        delays = [ws_client._backoff_delay(attempt) for _ in range(50)]
+        assert all(ceiling / 2 <= delay <= ceiling for delay in delays)
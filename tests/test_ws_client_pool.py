@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from voysis.client.client import ClientError
+from voysis.client.ws_client import WSClient
+from voysis.client.ws_client_pool import WSClientPool
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _pool(mock_server, size, health_check_interval=5.0):
+    def new_client():
+        ws_client = WSClient(mock_server.url('ws'), timeout=5)
+        ws_client.auth_token = 'token'
+        return ws_client
+    return WSClientPool(new_client, size=size, health_check_interval=health_check_interval).start()
+
+
+def test_pool_replaces_dead_connections(mock_server, audio_frames):
+    pool = _pool(mock_server, 2, health_check_interval=0.05)
+    try:
+        assert mock_server.stats['connections'] == 2
+        with pool.lease(timeout=1) as ws_client:
+            ws_client.close()
+        assert pool.replaced_connections == 1
+        assert _wait_until(lambda: len(pool._idle) == 2 and len(mock_server._sessions) == 2)
+        # Drop the server's side of every connection, idle or not.
+        for session in list(mock_server._sessions):
+            session.drop()
+        assert _wait_until(lambda: mock_server.stats['connections'] == 5 and len(pool._idle) == 2)
+        assert pool.replaced_connections == 3
+        with pool.lease(timeout=1) as ws_client:
+            query = ws_client.stream_audio(audio_frames(1))
+        assert query['context']['audioBytes'] == 16000
+    finally:
+        pool.close()
+    assert not pool._idle
+
+
+def test_acquire_timeout_is_a_deadline(mock_server):
+    pool = _pool(mock_server, 1)
+    stop = threading.Event()
+
+    def wake_waiters():
+        while not stop.wait(0.02):
+            with pool._condition:
+                pool._condition.notify_all()
+
+    waker = threading.Thread(target=wake_waiters)
+    waker.start()
+    try:
+        pool.acquire()
+        started = time.time()
+        with pytest.raises(ClientError):
+            pool.acquire(timeout=0.2)
+        assert time.time() - started < 1
+    finally:
+        stop.set()
+        waker.join()
+        pool.close()
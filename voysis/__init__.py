@@ -1 +1 @@
-__all__ = [ 'client', 'cmd', 'device' ]
+__all__ = [ 'client', 'cmd', 'device', 'metrics' ]
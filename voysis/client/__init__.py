@@ -1 +1,8 @@
-__all__ = ["client", "http_client", "ws_client", "token_handler", "user_agent"]
+import sys
+
+__all__ = ["client", "codec", "http_client", "result_cache", "session_log", "ws_client", "ws_client_pool",
+           "token_handler", "tracing", "user_agent"]
+
+# The asyncio clients use async def, which needs Python 3.5.
+if sys.version_info >= (3, 5):
+    __all__ += ["async_client", "async_ws_client"]
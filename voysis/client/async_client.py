@@ -0,0 +1,129 @@
+import abc
+import asyncio
+import six
+from dateutil.parser import parse as parsedatetime
+from datetime import datetime
+from dateutil.tz import tzutc
+from voysis.client import client as client
+
+
+class AsyncResponseFuture(object):
+    def __init__(self, call_on_complete=None):
+        self._future = asyncio.get_event_loop().create_future()
+        self._callable = call_on_complete
+        self._error = None
+        self.response_code = None
+        self.response_message = None
+
+    async def wait_until_complete(self, timeout):
+        if not self._future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            except asyncio.TimeoutError:
+                raise client.ClientError("Timeout waiting on response.")
+        if self._error:
+            raise self._error
+
+    async def get_entity(self, timeout=None):
+        await self.wait_until_complete(timeout)
+        return self._future.result()
+
+    def result(self):
+        """
+        Return the response entity of a completed future without waiting.
+        """
+        return self._future.result()
+
+    def set(self, response_code, response_message=None, response_entity=None):
+        self.response_code = response_code
+        self.response_message = response_message
+        if not self._future.done():
+            self._future.set_result(response_entity)
+        if self._callable:
+            self._callable(self)
+
+    def set_error(self, error):
+        """
+        Complete this future without a response. Waiting on the future
+        raises +error+.
+        """
+        self._error = error
+        if not self._future.done():
+            self._future.set_result(None)
+        if self._callable:
+            self._callable(self)
+
+    def is_complete(self):
+        return self._future.done()
+
+
+@six.add_metaclass(abc.ABCMeta)
+class AsyncClient(client.Client):
+    """
+    Base class for clients that run on an asyncio event loop. The request,
+    feedback and token methods are coroutines, so many clients can share a
+    single loop without a thread per connection.
+    """
+
+    @abc.abstractmethod
+    async def stream_audio(self, frames_generator, notification_handler=None, audio_type=None):
+        '''
+        Stream audio data to the query API, creating a new conversation (if
+        required) and a new audio query. Raises a ClientError if query
+        processing is unsuccessful.
+        :param frames_generator: An async iterator (or a plain iterable)
+        yielding audio frames.
+        :param notification_handler A callable that will be invoked if
+        streaming to the server is stopped for any reason.
+        :param audio_type The Content-Type to use for the audio
+        :return: The completed query as a dictionary.
+        '''
+        pass
+
+    @abc.abstractmethod
+    async def send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST'):
+        """
+        Send a request to the remote server.
+        :return: An AsyncResponseFuture instance that can be awaited to
+                 obtain the response.
+        """
+        pass
+
+    async def close(self):
+        """
+        Release any resources in use by this client.
+        :return: None
+        """
+        pass
+
+    async def send_feedback(self, query_id, rating=None, description=None, durations=None):
+        """
+        Send feedback to the server for the given query.
+        """
+        request_body = {}
+        if rating:
+            request_body['rating'] = rating
+        if description:
+            request_body['description'] = description
+        if durations:
+            request_body['durations'] = durations
+        if len(request_body) < 1:
+            return None
+        uri = "/queries/{query_id}/feedback".format(
+            query_id=query_id
+        )
+        response_future = await self.send_request(uri, request_body, method='PATCH')
+        return await response_future.get_entity()
+
+    async def refresh_app_token(self, force=False):
+        if self.auth_token and (force or self._app_token_expiry < datetime.now(tzutc())):
+            auth_headers = {
+                'Authorization': 'Bearer ' + self.auth_token,
+                'Accept': 'application/json'
+            }
+            response_future = await self.send_request('/tokens', extra_headers=auth_headers)
+            app_token_response = await response_future.get_entity(5)
+            if response_future.response_code == 200:
+                self._app_token = app_token_response['token']
+                self._app_token_expiry = parsedatetime(app_token_response['expiresAt'])
+        return self._app_token
@@ -0,0 +1,348 @@
+import asyncio
+import ssl
+from collections import OrderedDict
+from voysis.client import client as client
+from voysis.client import async_client as async_client
+
+try:
+    import websockets
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    websockets = None
+    ConnectionClosed = None
+
+
+class AsyncWSClient(async_client.AsyncClient):
+    """
+    A WebSocket client that runs on an asyncio event loop. It speaks the
+    same request/response/notification protocol as WSClient, but a single
+    event loop can drive many instances concurrently, and many queries
+    on each. Requires the `websockets` package.
+    """
+
+    def __init__(self, url, user_agent=None, timeout=15):
+        if websockets is None:
+            raise ImportError("AsyncWSClient requires the 'websockets' package. "
+                              "Install it with 'pip install voysis-python[async]'")
+        async_client.AsyncClient.__init__(self, url, user_agent)
+        self._timeout = timeout
+        self._websocket = None
+        self._reader_task = None
+        self._next_request_id = 1
+        self._response_futures = dict()
+        self._queries_by_request_id = dict()
+        self._queries_by_query_id = dict()
+        self._active_queries = OrderedDict()
+        self._streaming_query = None
+        # The locks are created on first use, on the loop that uses them.
+        self._connect_lock = None
+        self._audio_lock = None
+
+    async def send_audio(self, frames_generator, query=None):
+        """
+        Send audio frames over the WebSocket. Audio frames carry no query
+        identifier, so callers that share this client must hold the audio
+        lock from query creation until the audio is finalised.
+        :param frames_generator: An async iterator or a plain iterable of
+                                 frames.
+        :param query: The AsyncStreamingQuery the audio belongs to.
+                      Streaming stops early if the query is completed or
+                      stopped.
+        :return: None
+        """
+        query = query if query else self._streaming_query
+        if hasattr(frames_generator, '__aiter__'):
+            async for frame in frames_generator:
+                if query and query.complete_reason:
+                    break
+                await self._send(bytes(frame))
+        else:
+            for frame in frames_generator:
+                if query and query.complete_reason:
+                    break
+                await self._send(bytes(frame))
+        if not (query and query.complete_reason):
+            await self.finalise_audio()
+
+    async def send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST'):
+        return await self._send_request(uri, request_entity, extra_headers, call_on_complete, method)
+
+    async def finalise_audio(self):
+        '''
+        When VAD is not encountered this has to be send to notify server that all audio has been sent
+        '''
+        await self._send(bytes([4]))
+
+    def on_ws_message(self, web_socket, message):
+        json_msg = self._get_codec().loads(message)
+        if 'response' == json_msg['type']:
+            request_id = str(json_msg['requestId'])
+            future = self._response_futures.pop(request_id, None)
+            query = self._queries_by_request_id.pop(request_id, None)
+            if query:
+                if int(json_msg['responseCode']) > 299:
+                    query.error = client.ClientError(
+                        "Request {requestId} failed with status code {responseCode}: {responseMessage}".format(
+                            **json_msg)
+                    )
+                    self._update_state(query, 'error')
+                elif json_msg.get('entity'):
+                    query.query_id = json_msg['entity'].get('id')
+                    if query.query_id and id(query) in self._active_queries:
+                        self._queries_by_query_id[query.query_id] = query
+            if future:
+                future.set(
+                    json_msg['responseCode'],
+                    response_message=json_msg['responseMessage'],
+                    response_entity=json_msg['entity']
+                )
+        elif 'notification' == json_msg['type']:
+            notification_type = json_msg['notificationType']
+            query = self._find_query(json_msg)
+            if query:
+                if 'query_complete' == notification_type:
+                    query.completed_query = json_msg['entity']
+                self._update_state(query, notification_type, 'vad_stop' != notification_type)
+
+    def on_ws_close(self, web_socket):
+        if web_socket is not self._websocket:
+            return
+        self._websocket = None
+        pending_futures = list(self._response_futures.values())
+        self._response_futures.clear()
+        for query in self._take_active_queries():
+            self._update_state(query, 'connection_closed')
+        closed_error = client.ClientError("Connection closed before a response was received")
+        for future in pending_futures:
+            future.set_error(closed_error)
+
+    async def connect(self):
+        """
+        Connect the WebSocket. If the socket does not connect within the
+        client's timeout, ClientError is raised.
+        :return: bool True if the connection was successful
+        """
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if not self._websocket:
+                connect_args = {}
+                if self._url.startswith('wss://'):
+                    ssl_context = ssl.create_default_context()
+                    ssl_context.check_hostname = self.check_hostname
+                    connect_args['ssl'] = ssl_context
+                try:
+                    web_socket = await asyncio.wait_for(
+                        websockets.connect(self._url, **connect_args), self._timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise client.ClientError("Timed out waiting on WebSocket connection")
+                if self._reader_task:
+                    # The reader of a lost connection may still be finishing.
+                    await self._reader_task
+                self._websocket = web_socket
+                self._reader_task = asyncio.ensure_future(self._read_messages(web_socket))
+        return True
+
+    async def close(self):
+        """
+        Close the WebSocket and wait for the reader task to finish.
+        :return: None
+        """
+        if self._websocket:
+            await self._websocket.close()
+        if self._reader_task:
+            await self._reader_task
+        self._reader_task = None
+        self._websocket = None
+
+    async def stream_audio(self, frames_generator, notification_handler=None, audio_type=None):
+        """
+        Stream audio for a new query. Many calls may run at once on the same
+        client: each tracks its own query state, and notifications are
+        routed to the query they belong to. Audio for concurrent queries is
+        sent one query at a time, since audio frames on the socket carry no
+        query identifier. A query that finalises its audio keeps the socket
+        until the server answers it, as a vad_stop may already be on its
+        way and carries no identifier either.
+        """
+        query = AsyncStreamingQuery(notification_handler)
+        try:
+            await self.connect()
+            await self.refresh_app_token()
+            if self._audio_lock is None:
+                self._audio_lock = asyncio.Lock()
+            async with self._audio_lock:
+                if audio_type is not None:
+                    self._audio_type = audio_type
+                create_entity = self._create_audio_query_entity()
+                self._register_query(query)
+                self._streaming_query = query
+                try:
+                    await self._send_request('/queries', create_entity,
+                                             call_on_complete=self._update_current_conversation, query=query)
+                    await self.send_audio(frames_generator, query)
+                    await query.wait_until_answered(self._timeout)
+                finally:
+                    self._streaming_query = None
+            await self._wait_for_query(query, 'query completion')
+            completed_query = query.completed_query
+            if completed_query:
+                self._update_current_context(completed_query)
+                return completed_query
+            else:
+                raise client.ClientError("Query failed {}".format(query.complete_reason))
+        except OSError as error:
+            raise client.ClientError(error.strerror or str(error))
+        except ConnectionClosed as error:
+            if query.error:
+                raise query.error
+            raise client.ClientError("Query failed connection_closed: {}".format(error))
+        finally:
+            query.notification_handler = None
+            self._unregister_query(query)
+
+    async def send_feedback(self, query_id, rating=None, description=None, durations=None):
+        await self.connect()
+        return await super(AsyncWSClient, self).send_feedback(query_id, rating, description, durations)
+
+    async def _send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None,
+                            method='POST', query=None):
+        request_id = self._next_request_id
+        self._next_request_id = self._next_request_id + 1
+        body = {
+            'type': 'request',
+            'requestId': request_id,
+            'method': method,
+            'restUri': uri,
+            'entity': request_entity
+        }
+        message = self._encode_request(body, extra_headers)
+        response_future = async_client.AsyncResponseFuture(call_on_complete=call_on_complete)
+        self._response_futures[str(request_id)] = response_future
+        if query:
+            query.request_id = str(request_id)
+            self._queries_by_request_id[query.request_id] = query
+        await self._send(message)
+        return response_future
+
+    async def _send(self, data):
+        web_socket = self._websocket
+        if not web_socket:
+            raise client.ClientError("WebSocket connection is closed")
+        await web_socket.send(data)
+
+    async def _read_messages(self, web_socket):
+        try:
+            while True:
+                message = await web_socket.recv()
+                self.on_ws_message(web_socket, message)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.on_ws_close(web_socket)
+
+    def _register_query(self, query):
+        self._active_queries[id(query)] = query
+
+    def _unregister_query(self, query):
+        self._active_queries.pop(id(query), None)
+        self._queries_by_request_id.pop(query.request_id, None)
+        self._queries_by_query_id.pop(query.query_id, None)
+
+    def _take_active_queries(self):
+        queries = list(self._active_queries.values())
+        self._active_queries.clear()
+        self._queries_by_request_id.clear()
+        self._queries_by_query_id.clear()
+        return queries
+
+    def _find_query(self, json_msg):
+        """
+        Find the query a notification belongs to, as WSClient does: by
+        query ID where the server supplies one, otherwise the query
+        streaming audio for a vad_stop, and the oldest query still in
+        progress for anything else.
+        """
+        entity = json_msg.get('entity')
+        query_id = json_msg.get('queryId')
+        if not query_id and isinstance(entity, dict):
+            query_id = entity.get('queryId', entity.get('id'))
+        query = self._queries_by_query_id.get(query_id) if query_id else None
+        if not query and 'vad_stop' == json_msg['notificationType']:
+            query = self._streaming_query
+        if not query:
+            for active_query in self._active_queries.values():
+                if not active_query.is_complete():
+                    return active_query
+        return query
+
+    async def _wait_for_query(self, query, message):
+        if not await query.wait_until_complete(self._timeout):
+            raise client.ClientError("Timed out waiting on " + message)
+        if query.error:
+            raise query.error
+
+    def _update_state(self, query, complete_reason=None, response_ready=True):
+        if complete_reason:
+            query.complete_reason = complete_reason
+        query.set_answered()
+        notification_handler = query.notification_handler
+        if notification_handler:
+            notification_handler(query.complete_reason)
+        if response_ready:
+            query.set_complete()
+
+    def _update_current_conversation(self, response_future):
+        if response_future.response_code == 201:
+            self.current_conversation_id = response_future.result()['conversationId']
+
+
+class AsyncStreamingQuery(object):
+    """
+    The state of a single audio query being streamed over an
+    AsyncWSClient.
+    """
+
+    def __init__(self, notification_handler=None):
+        self.notification_handler = notification_handler
+        self.request_id = None
+        self.query_id = None
+        self.complete_reason = None
+        self.completed_query = None
+        self.error = None
+        self._answered = asyncio.get_event_loop().create_future()
+        self._complete = asyncio.get_event_loop().create_future()
+
+    def set_answered(self):
+        """
+        Record that the server has sent a notification or error for this
+        query, so it is no longer waiting on the query's audio.
+        """
+        if not self._answered.done():
+            self._answered.set_result(self.complete_reason)
+
+    async def wait_until_answered(self, timeout):
+        return await _wait(self._answered, timeout)
+
+    def set_complete(self):
+        self.set_answered()
+        if not self._complete.done():
+            self._complete.set_result(self.complete_reason)
+
+    def is_complete(self):
+        return self._complete.done()
+
+    async def wait_until_complete(self, timeout):
+        """
+        :return: True if the query completed within +timeout+ seconds.
+        """
+        return await _wait(self._complete, timeout)
+
+
+async def _wait(future, timeout):
+    try:
+        await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
@@ -3,9 +3,31 @@ import six
 import uuid
 import threading
 from datetime import datetime
+from time import perf_counter
 from dateutil.parser import parse as parsedatetime
 from dateutil.tz import tzutc
+from voysis.client import codec as codec
+from voysis.client import result_cache as result_cache
+from voysis.client import tracing as tracing
+from voysis.client.token_handler import token_cache_key
 from voysis.client.user_agent import UserAgent
+from voysis import metrics as metrics
+from voysis.device import encoder as encoder
+from voysis.device import vad as vad
+
+QUERIES = metrics.counter('voysis_client_queries', 'Audio queries started.', ['transport'])
+QUERY_ERRORS = metrics.counter('voysis_client_query_errors', 'Audio queries that failed.', ['transport'])
+QUERIES_IN_FLIGHT = metrics.gauge('voysis_client_queries_in_flight', 'Audio queries in progress.', ['transport'])
+QUERY_DURATION = metrics.histogram('voysis_client_query_duration_seconds',
+                                   'Time from starting an audio query to its result.', ['transport'])
+RESPONSE_LATENCY = metrics.histogram('voysis_client_response_latency_seconds',
+                                     'Time from the last audio sent to the query result.', ['transport'])
+AUDIO_FRAMES_SENT = metrics.counter('voysis_client_audio_frames_sent', 'Audio frames sent.', ['transport'])
+AUDIO_BYTES_SENT = metrics.counter('voysis_client_audio_bytes_sent', 'Bytes of audio sent.', ['transport'])
+RESULT_CACHE_HITS = metrics.counter('voysis_client_result_cache_hits', 'Audio queries answered from the result cache.',
+                                    ['transport'])
+TOKEN_REFRESHES = metrics.counter('voysis_client_token_refreshes', 'App tokens requested from the server.',
+                                  ['transport'])
 
 
 class ClientError(Exception):
@@ -26,15 +48,18 @@ class ResponseFuture(object):
         self._event = threading.Event()
         self._callable = call_on_complete
         self._response_entity = None
+        self._error = None
         self.response_code = response_code
         self.response_message = response_message
         if response_entity:
-            self.set(response_entity)
+            self.set(response_code, response_message, response_entity)
 
     def wait_until_complete(self, timeout):
         if not self._event.is_set():
             if not self._event.wait(timeout):
                 raise ClientError("Timeout waiting on response.")
+        if self._error:
+            raise self._error
 
     def get_entity(self, timeout=None):
         self.wait_until_complete(timeout)
@@ -48,12 +73,74 @@ class ResponseFuture(object):
         if self._callable:
             self._callable(self)
 
+    def set_error(self, error):
+        """
+        Complete this future without a response. Waiting on the future
+        raises +error+.
+        """
+        self._error = error
+        self._event.set()
+        if self._callable:
+            self._callable(self)
+
     def is_complete(self):
         return self._event.is_set()
 
 
+class PreparedQuery(object):
+    """
+    A query whose connection and app token are being set up in the
+    background, ahead of the audio being streamed. Created by
+    Client.prepare() and passed to Client.stream_audio().
+    """
+
+    def __init__(self, audio_type, trace=tracing.NULL_TRACE):
+        self.audio_type = audio_type
+        self.trace = trace
+        self._event = threading.Event()
+        self._error = None
+
+    def set_ready(self, error=None):
+        self._error = error
+        self._event.set()
+
+    def is_ready(self):
+        return self._event.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Block until preparation has finished. Raises the error encountered
+        during preparation, if any.
+        """
+        if not self._event.wait(timeout):
+            raise ClientError("Timed out waiting on query preparation")
+        if self._error:
+            raise self._error
+
+
+class QueryStats(object):
+    """
+    Counts the audio sent for a query, for its metrics.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.audio_frames = 0
+        self.audio_bytes = 0
+        self.audio_end = None
+
+    def count_frames(self, frames_generator):
+        for frame in frames_generator:
+            self.audio_frames += 1
+            self.audio_bytes += len(frame)
+            yield frame
+        self.audio_end = perf_counter()
+
+
 @six.add_metaclass(abc.ABCMeta)
 class Client(object):
+    # The transport label of this client's metrics.
+    transport = None
 
     def __init__(self, url, user_agent=None):
         self._url = url
@@ -64,14 +151,24 @@ class Client(object):
         self.locale = 'en-US'
         self.check_hostname = True
         self.auth_token = None
+        self.token_cache = None
+        self.audio_encoding = None
+        self.client_vad = False
+        self.client_vad_silence = 0.8
+        self.tracer = None
+        self.json_codec = codec.AUTO
+        self.result_cache = None
         self.current_conversation_id = None
         self.current_context = None
         self._app_token = None
         self._app_token_expiry = datetime.now(tzutc())
         self._audio_type = 'audio/pcm;bits=16;rate=16000'
+        self._codec = None
+        self._common_headers = None
 
     @abc.abstractmethod
-    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None):
+    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None, prepared_query=None,
+                     audio_digest=None):
         '''
         Stream audio data to the query API, creating a new conversation (if
         required) and a new audio query. Raises a ClientError if query
@@ -82,10 +179,33 @@ class Client(object):
         should accept a single argument, which will be a string indicating
         the reason for the stoppage.
         :param audio_type The Content-Type to use for the audio
+        :param prepared_query A PreparedQuery returned by prepare(). Frames
+        are not read from +frames_generator+ until it is ready, so they
+        buffer in the device in the meantime.
+        :param audio_digest A digest of the audio, such as the one returned
+        by FileDevice.audio_digest(). When +result_cache+ is set, a query
+        whose audio, locale, context and conversation have been seen before
+        is answered from the cache without reading +frames_generator+, and
+        +notification_handler+ is called with 'result_cache'.
         :return: The completed query as a dictionary.
         '''
         pass
 
+    def prepare(self, audio_type=None):
+        '''
+        Start getting ready to stream a query on a background thread, so
+        that connecting and refreshing the app token can overlap with
+        starting the audio device.
+        :param audio_type The Content-Type that will be used for the audio
+        :return: A PreparedQuery to pass to stream_audio.
+        '''
+        prepared_query = PreparedQuery(audio_type if audio_type is not None else self._audio_type,
+                                       self._start_trace())
+        prepare_thread = threading.Thread(target=self._run_prepare, args=(prepared_query,))
+        prepare_thread.daemon = True
+        prepare_thread.start()
+        return prepared_query
+
     @abc.abstractmethod
     def send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST'):
         """
@@ -108,19 +228,61 @@ class Client(object):
         Release any resources in use by this client.
         :return: None
         """
-        pass
+        self._stop_token_refresh()
 
     def create_common_headers(self):
-        headers = {
-            'User-Agent': self.user_agent.get(),
-            'X-Voysis-Audio-Profile': self.audio_profile_id,
-            'X-Voysis-Ignore-Vad': str(self.ignore_vad),
-            'Content-Type': 'application/json',
-            'Accept': self.api_media_type
-        }
-        if self._app_token:
-            headers['Authorization'] = 'Bearer ' + self._app_token
-        return headers
+        return dict(self._get_common_headers()[1])
+
+    def _get_common_headers(self):
+        """
+        Get the headers sent with every request, which are only rebuilt
+        when the settings they are built from change.
+        :return: A tuple of the settings, the headers, and the headers
+                 encoded as JSON. The headers must not be modified.
+        """
+        key = (self._app_token, self.ignore_vad, self.audio_profile_id, self.api_media_type, self.user_agent.get())
+        common_headers = self._common_headers
+        if common_headers is None or common_headers[0] != key:
+            headers = {
+                'User-Agent': self.user_agent.get(),
+                'X-Voysis-Audio-Profile': self.audio_profile_id,
+                'X-Voysis-Ignore-Vad': str(self.ignore_vad),
+                'Content-Type': 'application/json',
+                'Accept': self.api_media_type
+            }
+            if self._app_token:
+                headers['Authorization'] = 'Bearer ' + self._app_token
+            common_headers = (key, headers, self._get_codec().dumps(headers))
+            self._common_headers = common_headers
+        return common_headers
+
+    def _encode_request(self, body, extra_headers=None):
+        """
+        Encode a request message for the WebSocket API, with the common
+        headers and +extra_headers+ added to +body+.
+        :return: The message as a JSON string.
+        """
+        json_codec = self._get_codec()
+        if extra_headers:
+            headers = self.create_common_headers()
+            headers.update(extra_headers)
+            body['headers'] = headers
+            return json_codec.dumps(body)
+        # Splice the cached encoding of the headers into the message,
+        # rather than encoding them again.
+        return json_codec.dumps(body)[:-1] + ',"headers":' + self._get_common_headers()[2] + '}'
+
+    def _get_codec(self):
+        """
+        Get the JSON codec named by +json_codec+.
+        """
+        if self.json_codec == codec.AUTO:
+            return codec.DEFAULT_CODEC
+        json_codec = self._codec
+        if json_codec is None or json_codec.name != self.json_codec:
+            json_codec = codec.get_codec(self.json_codec)
+            self._codec = json_codec
+        return json_codec
 
     def send_feedback(self, query_id, rating=None, description=None, durations=None):
         """
@@ -141,18 +303,162 @@ class Client(object):
         return self.send_request(uri, request_body, method='PATCH').get_entity()
 
     def refresh_app_token(self, force=False):
-        if self.auth_token and (force or self._app_token_expiry < datetime.now(tzutc())):
-            auth_headers = {
-                'Authorization': 'Bearer ' + self.auth_token,
-                'Accept': 'application/json'
-            }
-            response_future = self.send_request('/tokens', extra_headers=auth_headers)
-            app_token_response = response_future.get_entity(5)
-            if response_future.response_code == 200:
-                self._app_token = app_token_response['token']
-                self._app_token_expiry = parsedatetime(app_token_response['expiresAt'])
+        """
+        Make sure the client holds a valid app token. When +token_cache+
+        is set, the token is taken from the cache, which shares it with
+        other clients and refreshes it in the background.
+        """
+        if self.auth_token and self.token_cache:
+            app_token, expiry = self.token_cache.get_token(
+                token_cache_key(self._url, self.auth_token), self._issue_app_token, force
+            )
+            if app_token:
+                self._app_token = app_token
+                self._app_token_expiry = expiry
+        elif self.auth_token and (force or self._app_token_expiry < datetime.now(tzutc())):
+            issued = self._issue_app_token()
+            if issued:
+                self._app_token, self._app_token_expiry = issued
         return self._app_token
 
+    def _issue_app_token(self):
+        """
+        Request a new app token from the server.
+        :return: A (token, expiry) tuple, or None if the request failed.
+        """
+        auth_headers = {
+            'Authorization': 'Bearer ' + self.auth_token,
+            'Accept': 'application/json'
+        }
+        TOKEN_REFRESHES.labels(self.transport).inc()
+        response_future = self.send_request('/tokens', extra_headers=auth_headers)
+        app_token_response = response_future.get_entity(5)
+        if response_future.response_code == 200:
+            return app_token_response['token'], parsedatetime(app_token_response['expiresAt'])
+        return None
+
+    def _stop_token_refresh(self):
+        if self.token_cache:
+            self.token_cache.unregister(self._issue_app_token)
+
+    def _start_trace(self, prepared_query=None):
+        """
+        Start tracing a query, continuing the trace begun by +prepared_query+
+        if there is one.
+        :return: The QueryTrace, which does nothing if +tracer+ isn't set.
+        """
+        if prepared_query and prepared_query.trace.is_active(tracing.QUERY):
+            return prepared_query.trace
+        if not self.tracer:
+            return tracing.NULL_TRACE
+        trace = tracing.QueryTrace(self.tracer)
+        trace.begin(tracing.QUERY)
+        return trace
+
+    def _end_trace(self, trace, completed_query):
+        if completed_query:
+            trace.query_id = completed_query.get('id', trace.query_id)
+            trace.conversation_id = completed_query.get('conversationId', trace.conversation_id)
+        trace.end(tracing.QUERY, completed=bool(completed_query))
+
+    def _get_cached_result(self, audio_digest, audio_type, notification_handler=None, prepared_query=None):
+        """
+        Look a query up in +result_cache+, and when it is found, update the
+        conversation and context as if it had been sent.
+        :return: A tuple of the query's cache key, or None if it can't be
+                 cached, and the cached result, or None.
+        """
+        if not (self.result_cache and audio_digest):
+            return None, None
+        if audio_type is None:
+            audio_type = prepared_query.audio_type if prepared_query else self._audio_type
+        key = result_cache.result_key(
+            audio_digest, audio_type, self._url, self.locale, self.current_context, self.current_conversation_id,
+            audioEncoding=self.audio_encoding, clientVad=self.client_vad and not self.ignore_vad,
+            ignoreVad=self.ignore_vad
+        )
+        result = self.result_cache.get(key)
+        if result:
+            RESULT_CACHE_HITS.labels(self.transport).inc()
+            self.current_conversation_id = result.get('conversationId', self.current_conversation_id)
+            self._update_current_context(result)
+            if prepared_query:
+                self._end_trace(prepared_query.trace, result)
+            if notification_handler:
+                notification_handler(result_cache.RESULT_CACHE)
+        return key, result
+
+    def _start_query_stats(self):
+        QUERIES.labels(self.transport).inc()
+        QUERIES_IN_FLIGHT.labels(self.transport).inc()
+        return QueryStats()
+
+    def _end_query_stats(self, stats, completed_query):
+        """
+        Update the query metrics once a query has finished, successfully
+        if +completed_query+ is set.
+        """
+        transport = self.transport
+        QUERIES_IN_FLIGHT.labels(transport).dec()
+        AUDIO_FRAMES_SENT.labels(transport).inc(stats.audio_frames)
+        AUDIO_BYTES_SENT.labels(transport).inc(stats.audio_bytes)
+        if completed_query:
+            end = perf_counter()
+            QUERY_DURATION.labels(transport).observe(end - stats.started)
+            if stats.audio_end is not None:
+                RESPONSE_LATENCY.labels(transport).observe(end - stats.audio_end)
+        else:
+            QUERY_ERRORS.labels(transport).inc()
+
+    def _refresh_app_token_traced(self, trace):
+        with trace.span(tracing.TOKEN_REFRESH) as attributes:
+            app_token = self._app_token
+            self.refresh_app_token()
+            attributes['refreshed'] = self._app_token != app_token
+
+    def _run_prepare(self, prepared_query):
+        try:
+            with prepared_query.trace.span(tracing.PREPARE):
+                self._prepare_query(prepared_query)
+            prepared_query.set_ready()
+        except Exception as error:
+            prepared_query.set_ready(error)
+
+    def _prepare_query(self, prepared_query):
+        """
+        Do the work of preparing a query. Runs on a background thread.
+        """
+        self._refresh_app_token_traced(prepared_query.trace)
+
+    def _encode_frames(self, frames_generator, audio_type=None, notification_handler=None):
+        """
+        Apply client-side VAD, when +client_vad+ is enabled, and the
+        configured +audio_encoding+ to the audio. When the VAD detects the
+        end of speech, the frames end and +notification_handler+ is called
+        with 'client_vad'.
+        :return: A tuple of the frames to send and their Content-Type.
+        """
+        if audio_type is None:
+            audio_type = self._audio_type
+        if self.client_vad and not self.ignore_vad:
+            frames_generator = self._detect_speech_end(frames_generator, audio_type, notification_handler)
+        if not self.audio_encoding:
+            return frames_generator, audio_type
+        audio_encoder = encoder.encoder_factory(self.audio_encoding, audio_type)
+        return audio_encoder.encode_frames(frames_generator), audio_encoder.audio_type()
+
+    def _detect_speech_end(self, frames_generator, audio_type, notification_handler):
+        pcm_format = encoder.parse_audio_type(audio_type)
+        if not pcm_format or pcm_format['bits'] != 16 or pcm_format['channels'] != 1:
+            return frames_generator
+
+        def on_speech_end():
+            if notification_handler:
+                notification_handler(vad.CLIENT_VAD)
+
+        detector = vad.EnergyVad(rate=pcm_format['rate'], silence_duration=self.client_vad_silence)
+        return detector.filter_frames(frames_generator, on_speech_end)
+
     def _create_audio_query_entity(self):
         entity = {
             'locale': self.locale,
@@ -0,0 +1,94 @@
+"""
+JSON encoding for the messages exchanged with the Query API. get_codec()
+picks the fastest implementation installed, trying orjson, then ujson,
+then falling back to the standard library's json module. Install
+voysis-python[fast] to get orjson.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+AUTO = 'auto'
+
+
+class JsonCodec(object):
+    """
+    Encodes with the standard library's json module. Output is compact,
+    without whitespace between items.
+    """
+
+    name = 'json'
+
+    def dumps(self, obj):
+        """
+        :return: +obj+ encoded as a JSON string.
+        """
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(self, data):
+        """
+        :param data: A JSON document, as a string or UTF-8 bytes.
+        """
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+_CODECS = [
+    (OrjsonCodec, orjson),
+    (UjsonCodec, ujson),
+    (JsonCodec, json),
+]
+
+
+def available_codecs():
+    """
+    :return: The names of the codecs that can be used, fastest first.
+    """
+    return [codec_class.name for codec_class, module in _CODECS if module is not None]
+
+
+def get_codec(name=AUTO):
+    """
+    Get a codec by name.
+    :param name: One of 'orjson', 'ujson' or 'json', or 'auto' for the
+                 fastest available.
+    :return: A codec instance.
+    """
+    for codec_class, module in _CODECS:
+        if name == AUTO and module is not None:
+            return codec_class()
+        if name == codec_class.name:
+            if module is None:
+                raise ValueError("JSON codec {} requires the '{}' package".format(name, name))
+            return codec_class()
+    raise ValueError('Unsupported JSON codec {}'.format(name))
+
+
+DEFAULT_CODEC = get_codec()
@@ -1,58 +1,88 @@
 import base64
-import json
+import threading
 import requests
 from furl import furl
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.exceptions import HTTPError as UrlLib3HTTPError
 
 from voysis.client import client as client
+from voysis.client import tracing as tracing
 
 
 class HTTPClient(client.Client):
+    transport = 'http'
 
     def __init__(self, url, user_agent=None):
         client.Client.__init__(self, url, user_agent)
         self.base_url = furl(url)
+        self.pool_connections = 10
+        self.pool_maxsize = 10
+        self.pool_block = False
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._endpoint_urls = dict()
 
     def send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST'):
         headers = self.create_common_headers()
         if extra_headers:
             headers.update(extra_headers)
-        url = self.base_url.copy().add(path=uri)
-        req_method = getattr(requests, method.lower())
-        response = req_method(
-            str(url),
+        json_codec = self._get_codec()
+        response = self._get_session().request(
+            method,
+            self._endpoint_url(uri),
             headers=headers,
-            json=request_entity,
+            data=json_codec.dumps(request_entity) if request_entity is not None else None,
             verify=self.check_hostname
         )
         return client.ResponseFuture(
             response_code=response.status_code,
-            response_entity=response.json(),
+            response_entity=json_codec.loads(response.content),
             call_on_complete=call_on_complete
         )
 
-    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None):
+    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None, prepared_query=None,
+                     audio_digest=None):
+        cache_key, cached_result = self._get_cached_result(audio_digest, audio_type, notification_handler,
+                                                           prepared_query)
+        if cached_result:
+            return cached_result
+        trace = self._start_trace(prepared_query)
+        stats = self._start_query_stats()
+        query = None
         try:
-            self.refresh_app_token()
-            if audio_type is not None:
-                self._audio_type = audio_type
+            if prepared_query:
+                prepared_query.wait_until_ready()
+                if audio_type is None:
+                    audio_type = prepared_query.audio_type
+            self._refresh_app_token_traced(trace)
+            frames_generator, self._audio_type = self._encode_frames(
+                frames_generator, audio_type, notification_handler
+            )
             entity = self._create_audio_query_entity()
             headers = self.create_common_headers()
             headers['Content-Type'] = self._audio_type
-            headers['X-Voysis-Entity'] = base64.b64encode(json.dumps(entity).encode("UTF-8"))
-            streaming_url = self.base_url.copy().add(path=['queries'])
-            response = requests.post(
-                str(streaming_url),
+            headers['X-Voysis-Entity'] = base64.b64encode(self._get_codec().dumps(entity).encode("UTF-8"))
+            trace.add_sent(len(headers['X-Voysis-Entity']))
+            # The query is created by the request carrying the audio, so
+            # creation lasts until the response arrives.
+            trace.begin(tracing.QUERY_CREATE)
+            response = self._get_session().post(
+                self._endpoint_url('/queries'),
                 headers=headers,
                 stream=True,
                 verify=self.check_hostname,
-                data=frames_generator
+                data=stats.count_frames(tracing.trace_frames(trace, frames_generator))
             )
+            trace.add_received(len(response.content))
+            trace.end(tracing.QUERY_CREATE, responseCode=response.status_code)
             if response.status_code == 200:
-                query = response.json()
+                query = self._get_codec().loads(response.content)
+                trace.instant(tracing.QUERY_COMPLETE)
                 self.current_conversation_id = query['conversationId']
                 self._update_current_context(query)
+                if cache_key:
+                    self.result_cache.put(cache_key, query)
                 notification_handler('query_complete')
                 return query
             else:
@@ -64,3 +94,54 @@ class HTTPClient(client.Client):
             raise client.ClientError(msg)
         except (HTTPError, UrlLib3HTTPError) as error:
             raise client.ClientError(str(error))
+        finally:
+            self._end_query_stats(stats, query)
+            self._end_trace(trace, query)
+
+    def close(self):
+        """
+        Close the pooled connections held by this client.
+        :return: None
+        """
+        super(HTTPClient, self).close()
+        with self._session_lock:
+            session = self._session
+            self._session = None
+        if session:
+            session.close()
+
+    def _get_session(self):
+        """
+        Get the Session used for all requests, creating it on first use so
+        that the pool settings can be configured after construction.
+        +pool_connections+ is the number of hosts to keep pools for and
+        +pool_maxsize+ the number of keep-alive connections per host.
+        """
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._session is None:
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        pool_block=self.pool_block
+                    )
+                    new_session = requests.Session()
+                    new_session.mount('http://', adapter)
+                    new_session.mount('https://', adapter)
+                    self._session = new_session
+                session = self._session
+        return session
+
+    def _endpoint_url(self, uri):
+        url = self._endpoint_urls.get(uri)
+        if url is None:
+            # Added as segments, so a base URL ending in '/' doesn't gain a
+            # double slash.
+            url = str(self.base_url.copy().add(path=[segment for segment in uri.split('/') if segment]))
+            if len(self._endpoint_urls) >= 64:
+                # Per-query URIs such as feedback would otherwise grow
+                # the cache without bound.
+                self._endpoint_urls.clear()
+            self._endpoint_urls[uri] = url
+        return url
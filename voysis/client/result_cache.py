@@ -0,0 +1,223 @@
+"""
+A cache of query results keyed by the content of the query: its audio,
+and the locale, context and conversation it was sent in. A client with a
++result_cache+ answers a query it has seen before from the cache, without
+contacting the server. This suits regression and demo runs that replay
+the same recordings, and should not be used where each query must reach
+the server.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from voysis.client import codec as codec
+
+# The notification a client gives when a query is answered from the cache,
+# in place of query_complete.
+RESULT_CACHE = 'result_cache'
+
+CACHE_SUFFIX = '.json'
+
+
+def result_key(audio_digest, audio_type, url, locale, context=None, conversation_id=None, **settings):
+    """
+    Build the cache key of a query.
+    :param audio_digest: A digest of the query's audio, such as the one
+                         returned by FileDevice.audio_digest().
+    :param audio_type: The Content-Type of the audio.
+    :param url: The URL of the Query API the query is sent to.
+    :param settings: Any other client settings that affect the result.
+    :return: The key, as a hex string.
+    """
+    inputs = {
+        'audio': audio_digest,
+        'audioType': audio_type,
+        'url': url,
+        'locale': locale,
+        'context': context,
+        'conversationId': conversation_id
+    }
+    inputs.update(settings)
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Holds results in memory, up to +max_memory_bytes+ of encoded results,
+    and optionally in +directory+ on disk, up to +max_disk_bytes+. Each tier
+    evicts its least recently used results when full. Results expire
+    +ttl+ seconds after they were stored, or never if +ttl+ is 0.
+
+    The disk tier can be shared by several processes. Results are written
+    to a temporary file and renamed into place, so readers never see a
+    partial result.
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024,
+                 ttl=24 * 60 * 60.0):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._codec = codec.DEFAULT_CODEC
+        self._lock = threading.Lock()
+        # key -> (expiry, result encoded as UTF-8 JSON), least recently
+        # used first.
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key):
+        """
+        :return: A copy of the result stored for +key+, or None if there is
+                 no unexpired result.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return self._codec.loads(entry[1].decode('utf-8'))
+                self._remove_from_memory(key)
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._add_to_memory(key, entry)
+        return self._codec.loads(entry[1].decode('utf-8'))
+
+    def put(self, key, result):
+        """
+        Store a copy of +result+ under +key+.
+        """
+        expiry = time.time() + self.ttl if self.ttl else None
+        entry = (expiry, self._codec.dumps(result).encode('utf-8'))
+        with self._lock:
+            self._add_to_memory(key, entry)
+        if self.directory:
+            self._write_disk(key, entry)
+
+    def clear(self):
+        """
+        Remove every result, from memory and disk.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.directory:
+                for path, size, mtime in self._disk_entries():
+                    self._remove_file(path)
+                self._disk_bytes = 0
+
+    def _add_to_memory(self, key, entry):
+        if key in self._memory:
+            self._remove_from_memory(key)
+        size = len(entry[1])
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            self._remove_from_memory(next(iter(self._memory)))
+
+    def _remove_from_memory(self, key):
+        entry = self._memory.pop(key)
+        self._memory_bytes -= len(entry[1])
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                expiry = json.loads(cache_file.readline().decode('utf-8'))
+                encoded = cache_file.read()
+        except (IOError, OSError, ValueError):
+            return None
+        if expiry is not None and expiry <= now:
+            self._remove_file(path)
+            return None
+        try:
+            # Disk eviction is by modification time, so mark it as used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return expiry, encoded
+
+    def _write_disk(self, key, entry):
+        # The expiry on the first line, then the encoded result.
+        data = (json.dumps(entry[0]) + '\n').encode('utf-8') + entry[1]
+        path = self._path(key)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.result')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                temp_file.write(data)
+            with self._lock:
+                self._scan_disk()
+                self._disk_bytes -= self._file_size(path)
+                os.rename(temp_path, path)
+                self._disk_bytes += len(data)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _scan_disk(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for path, size, mtime in self._disk_entries())
+
+    def _evict_disk(self):
+        """
+        Remove the least recently used results until the disk tier fits.
+        Other processes may share the directory, so its contents are
+        listed again rather than tracked.
+        """
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        self._disk_bytes = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_file(path)
+            self._disk_bytes -= size
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX) or name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
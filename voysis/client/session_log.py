@@ -0,0 +1,324 @@
+"""
+Recording and replay of WebSocket sessions. A WSClient with a
++session_recorder+ appends everything it sends (request messages and
+audio frames) and receives (responses and notifications) to a compact
+binary log, with the time of each. The log can be replayed through a
+client, sending the same audio with the same timing, or served back to
+a client with the original responses and timing by the mock server's
+replay mode, so that client-side changes are measured against identical
+traffic.
+
+A log is a sequence of sessions, one per recorder that appended records
+to it. Each starts with MAGIC and is a series of records, each a header
+packed as RECORD_HEADER (the record kind, the channel, seconds since the
+session began and the payload length) followed by the payload. Every
+client writing to a recorder gets its own channel, opened by an OPEN
+record whose payload describes the client as JSON. Requests are recorded
+without their REDACTED_HEADERS, so a log holds no credentials.
+"""
+import json
+import struct
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+MAGIC = b'VSL\x01'
+RECORD_HEADER = struct.Struct('<BHdI')
+# The highest channel number RECORD_HEADER can hold.
+MAX_CHANNEL = 0xFFFF
+
+OPEN = 1
+SENT_TEXT = 2
+SENT_AUDIO = 3
+RECEIVED = 4
+
+# Request headers left out of the log, as they hold credentials.
+REDACTED_HEADERS = ('authorization',)
+
+# The binary frame that ends a query's audio.
+FINALISE_AUDIO = b'\x04'
+
+SessionRecord = namedtuple('SessionRecord', ['session', 'channel', 'kind', 'timestamp', 'data'])
+
+
+class SessionRecorder(object):
+    """
+    Appends sessions to the log at +path+. Records are buffered, and
+    written when the buffer fills or the recorder is flushed or closed.
+    Safe to share between clients and threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        # MAGIC is written with the first record, so a recorder that
+        # records nothing leaves no empty session behind.
+        self._started = False
+        self._start = time.perf_counter()
+        # Held weakly, so that an owner that is garbage collected can't
+        # pass its channel on to a new owner.
+        self._channels = weakref.WeakKeyDictionary()
+        self._last_channel = 0
+
+    def channel_for(self, owner, description=None):
+        """
+        Get the channel of +owner+, such as a client, opening one on its
+        first use. Every owner gets a new channel, for as long as it lives.
+        :param description: A JSON serialisable description of the owner,
+                            stored in the OPEN record.
+        :return: The channel number.
+        :raises ValueError: if every channel up to MAX_CHANNEL is taken.
+        """
+        channel = self._channels.get(owner)
+        if channel is None:
+            with self._lock:
+                channel = self._channels.get(owner)
+                if channel is None:
+                    if self._last_channel >= MAX_CHANNEL:
+                        raise ValueError('Session log {} has no channels left'.format(self.path))
+                    self._last_channel += 1
+                    channel = self._last_channel
+                    self._channels[owner] = channel
+                    description = dict(description or {}, wallTime=time.time())
+                    self._write(channel, OPEN, json.dumps(description).encode('utf-8'))
+        return channel
+
+    def record(self, channel, kind, data):
+        """
+        Append a record of +data+, as bytes or a string.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        elif not isinstance(data, bytes):
+            data = bytes(bytearray(data))
+        with self._lock:
+            self._write(channel, kind, data)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write(self, channel, kind, data):
+        if self._file.closed:
+            return
+        if not self._started:
+            self._file.write(MAGIC)
+            self._started = True
+        self._file.write(RECORD_HEADER.pack(kind, channel, time.perf_counter() - self._start, len(data)))
+        self._file.write(data)
+
+
+def read_session_log(path):
+    """
+    Read the records of a session log. A record cut short, as the last one
+    may be if the recording process died, ends the log.
+    :return: A generator of SessionRecords. Their +session+ numbers the
+             sessions in the log from 1.
+    """
+    session = 0
+    with open(path, 'rb') as log_file:
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if header.startswith(MAGIC):
+                session += 1
+                header = header[len(MAGIC):] + log_file.read(len(MAGIC))
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, channel, timestamp, size = RECORD_HEADER.unpack(header)
+            data = log_file.read(size)
+            if len(data) < size:
+                return
+            yield SessionRecord(session, channel, kind, timestamp, data)
+
+
+def redact_request(message):
+    """
+    Remove the REDACTED_HEADERS from a request before it is recorded.
+    :param message: The request, as JSON.
+    :return: The request as JSON, unchanged if it had none of the headers.
+    """
+    request = json.loads(message)
+    headers = request.get('headers') if isinstance(request, dict) else None
+    if not isinstance(headers, dict):
+        return message
+    redacted = [name for name in headers if name.lower() in REDACTED_HEADERS]
+    if not redacted:
+        return message
+    for name in redacted:
+        del headers[name]
+    return json.dumps(request, separators=(',', ':'))
+
+
+class RecordedQuery(object):
+    """
+    An audio query taken from a session log: the request that created
+    it, the audio sent for it and the messages received about it, each
+    with the seconds since the request was sent.
+    """
+
+    def __init__(self, request, timestamp):
+        self.request = request
+        self.timestamp = timestamp
+        self.frames = []
+        self.messages = []
+        self.finalised = False
+        self.query_id = None
+
+    @property
+    def audio_type(self):
+        return ((self.request.get('entity') or {}).get('audioQuery') or {}).get('mimeType')
+
+    @property
+    def completed_query(self):
+        for offset, message in self.messages:
+            if message.get('notificationType') == 'query_complete':
+                return message.get('entity')
+        return None
+
+    def audio_end(self):
+        """
+        :return: The offset of the last audio sent, or None if there was none.
+        """
+        return self.frames[-1][0] if self.frames else None
+
+    def latency(self):
+        """
+        :return: The seconds from the last audio sent to query_complete, or
+                 None if the query didn't complete.
+        """
+        for offset, message in self.messages:
+            if message.get('notificationType') == 'query_complete' and self.frames:
+                return offset - self.audio_end()
+        return None
+
+    def _is_complete(self):
+        return any(message.get('notificationType') == 'query_complete' for offset, message in self.messages)
+
+
+def recorded_queries(path):
+    """
+    Extract the audio queries from a session log, in the order they were
+    created. Audio belongs to the query most recently created on its
+    channel, and notifications to the query they name or else the oldest
+    incomplete query on their channel, as they do in WSClient.
+    :return: A list of RecordedQuery instances.
+    """
+    queries = []
+    by_request = {}
+    by_channel = {}
+    for record in read_session_log(path):
+        channel = (record.session, record.channel)
+        channel_queries = by_channel.setdefault(channel, [])
+        if record.kind == SENT_TEXT:
+            message = json.loads(record.data.decode('utf-8'))
+            if message.get('method') == 'POST' and message.get('restUri') == '/queries':
+                query = RecordedQuery(message, record.timestamp)
+                queries.append(query)
+                channel_queries.append(query)
+                by_request[channel + (str(message.get('requestId')),)] = query
+        elif record.kind == SENT_AUDIO and channel_queries:
+            query = channel_queries[-1]
+            if record.data == FINALISE_AUDIO:
+                query.finalised = True
+            elif not query.finalised:
+                query.frames.append((record.timestamp - query.timestamp, record.data))
+        elif record.kind == RECEIVED:
+            message = json.loads(record.data.decode('utf-8'))
+            if message.get('type') == 'response':
+                query = by_request.pop(channel + (str(message.get('requestId')),), None)
+                if query and message.get('entity'):
+                    query.query_id = message['entity'].get('id')
+            else:
+                query = _find_query(channel_queries, message)
+            if query:
+                query.messages.append((record.timestamp - query.timestamp, message))
+    return queries
+
+
+def _find_query(channel_queries, notification):
+    entity = notification.get('entity')
+    query_id = notification.get('queryId')
+    if not query_id and isinstance(entity, dict):
+        query_id = entity.get('queryId', entity.get('id'))
+    for query in channel_queries:
+        if query_id and query.query_id == query_id:
+            return query
+    for query in channel_queries:
+        if not query._is_complete():
+            return query
+    return None
+
+
+class SessionReplayer(object):
+    """
+    Sends the audio of recorded queries through a client again, one query
+    at a time, with the recorded gaps between frames scaled by +speed+
+    (0 sends as fast as possible).
+    """
+
+    def __init__(self, queries, speed=1.0):
+        self.queries = queries
+        self.speed = speed
+
+    def replay(self, voysis_client, notification_handler=None):
+        """
+        Replay every query through +voysis_client+. The recorded frames
+        are sent as they were recorded, already encoded and trimmed, so the
+        client's +audio_encoding+ and +client_vad+ are turned off until the
+        replay ends.
+        :return: A list with a dict for each query, holding the recorded
+                 query's ID, the new result or error, and the seconds from
+                 the last audio sent to the result, now and when recorded.
+        """
+        audio_encoding, client_vad = voysis_client.audio_encoding, voysis_client.client_vad
+        voysis_client.audio_encoding, voysis_client.client_vad = None, False
+        try:
+            return self._replay(voysis_client, notification_handler)
+        finally:
+            voysis_client.audio_encoding, voysis_client.client_vad = audio_encoding, client_vad
+
+    def _replay(self, voysis_client, notification_handler):
+        results = []
+        for query in self.queries:
+            replayed = {
+                'recordedQueryId': query.query_id,
+                'recordedLatency': query.latency()
+            }
+            timing = {}
+            try:
+                replayed['result'] = voysis_client.stream_audio(
+                    self._frames(query, timing), notification_handler=notification_handler,
+                    audio_type=query.audio_type
+                )
+                if 'audioEnd' in timing:
+                    replayed['latency'] = time.perf_counter() - timing['audioEnd']
+            except Exception as error:
+                replayed['error'] = error
+            results.append(replayed)
+        return results
+
+    def _frames(self, query, timing):
+        start = time.perf_counter()
+        first_offset = query.frames[0][0] if query.frames else 0.0
+        for offset, data in query.frames:
+            if self.speed > 0:
+                delay = start + (offset - first_offset) / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            # The client may stop reading early, after a vad_stop.
+            timing['audioEnd'] = time.perf_counter()
+            yield data
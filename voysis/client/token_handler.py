@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+from datetime import datetime
+from datetime import timedelta
+from dateutil.parser import parse as parsedatetime
+from dateutil.tz import tzutc
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locking on this platform. The on-disk store is
+    # still replaced atomically, but processes may issue tokens at the
+    # same time.
+    fcntl = None
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_token_cache(path=None):
+    """
+    Get the process-wide TokenCache for +path+, creating it if needed.
+    Every client given the same cache shares its tokens.
+    :param path: The file to persist tokens to, so that they are shared
+                 between processes, or None for an in-memory cache.
+    :return: A TokenCache instance
+    """
+    if path:
+        path = os.path.expanduser(path)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = TokenCache(path)
+            _caches[path] = cache
+        return cache
+
+
+def token_cache_key(url, auth_token):
+    """
+    Build the key tokens are stored under. The auth token is hashed so
+    that it is never written to disk.
+    """
+    return hashlib.sha256((url + '\n' + auth_token).encode('UTF-8')).hexdigest()
+
+
+class TokenCache(object):
+    """
+    A cache of application tokens that can be shared by many clients and,
+    when given a path, by many processes. Tokens are refreshed on a
+    background thread +refresh_margin+ seconds before they expire, so
+    queries don't wait on token issuance. When the token is written to
+    disk, issuance happens under an exclusive file lock and the store is
+    re-read first, so a fleet of workers issues one token rather than one
+    each.
+    """
+
+    def __init__(self, path=None, refresh_margin=120, expiry_margin=5):
+        """
+        :param path: The file to persist tokens to, or None.
+        :param refresh_margin: Seconds before expiry at which the
+                               background thread refreshes a token.
+        :param expiry_margin: Seconds before expiry after which a token is
+                              no longer handed out.
+        """
+        self.path = path
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.expiry_margin = timedelta(seconds=expiry_margin)
+        self._tokens = dict()
+        self._issuers = dict()
+        self._lock = threading.RLock()
+        self._issue_lock = threading.RLock()
+        self._condition = threading.Condition(self._lock)
+        self._refresh_thread = None
+
+    def get_token(self, key, issue_token, force=False):
+        """
+        Get a valid token for +key+, issuing a new one if needed.
+        :param key: The key returned by token_cache_key().
+        :param issue_token: A callable that issues a new token and returns
+                            a (token, expiry) tuple, or None on failure.
+                            It is also used for background refreshes while
+                            the object it is bound to is alive.
+        :param force: Issue a new token even if a valid one is cached.
+        :return: A (token, expiry) tuple, or (None, None).
+        """
+        self._register(key, issue_token)
+        with self._lock:
+            entry = self._tokens.get(key)
+        if not force and self._is_usable(entry, self.expiry_margin):
+            return entry
+        with self._issue_lock:
+            with self._lock:
+                current_entry = self._tokens.get(key)
+            if current_entry is not entry and self._is_usable(current_entry, self.expiry_margin):
+                # Another thread issued a token while we waited.
+                return current_entry
+            entry = self._refresh(key, issue_token, None if force else self.expiry_margin)
+        return entry if entry else (None, None)
+
+    def unregister(self, issue_token):
+        """
+        Stop using +issue_token+ for background refreshes.
+        """
+        with self._lock:
+            for issuers in self._issuers.values():
+                for reference in list(issuers):
+                    if reference() in (None, issue_token):
+                        issuers.remove(reference)
+
+    def _register(self, key, issue_token):
+        with self._lock:
+            issuers = self._issuers.setdefault(key, [])
+            if not any(reference() == issue_token for reference in issuers):
+                issuers.append(_weak_callable(issue_token))
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(target=self._refresh_in_background)
+                self._refresh_thread.daemon = True
+                self._refresh_thread.start()
+
+    def _refresh(self, key, issue_token, margin):
+        # Must be called while holding the issue lock. When +margin+ is
+        # given, a token another process stored that is usable for at
+        # least that long is taken instead of issuing a new one.
+        with _FileLock(self.path):
+            entry = None
+            if margin is not None and self.path:
+                entry = self._read_store().get(key)
+                if not self._is_usable(entry, margin):
+                    entry = None
+            if entry is None:
+                entry = issue_token()
+                if not (entry and entry[0]):
+                    return None
+                if self.path:
+                    self._write_entry(key, entry)
+        with self._condition:
+            self._tokens[key] = entry
+            self._condition.notify()
+        return entry
+
+    def _refresh_in_background(self):
+        retry_at = dict()
+        while True:
+            now = datetime.now(tzutc())
+            due_keys = []
+            next_due = None
+            with self._lock:
+                for key, issuers in self._issuers.items():
+                    issue_token = _first_alive(issuers)
+                    entry = self._tokens.get(key)
+                    if issue_token is None or entry is None:
+                        continue
+                    due = max(entry[1] - self.refresh_margin, retry_at.get(key, now))
+                    if due <= now:
+                        due_keys.append((key, issue_token))
+                    elif next_due is None or due < next_due:
+                        next_due = due
+            for key, issue_token in due_keys:
+                try:
+                    with self._issue_lock:
+                        entry = self._refresh(key, issue_token, self.refresh_margin)
+                except Exception:
+                    entry = None
+                if entry is None or entry[1] - self.refresh_margin <= now:
+                    # Try again shortly. Callers still issue tokens
+                    # themselves if this keeps failing.
+                    retry_at[key] = now + timedelta(seconds=5)
+                else:
+                    retry_at.pop(key, None)
+            if not due_keys:
+                with self._condition:
+                    timeout = None if next_due is None else (next_due - now).total_seconds()
+                    self._condition.wait(timeout)
+
+    def _is_usable(self, entry, margin):
+        return bool(entry and entry[0] and entry[1] - margin > datetime.now(tzutc()))
+
+    def _read_store(self):
+        try:
+            with open(self.path, 'r') as store_file:
+                stored = json.load(store_file)
+        except (IOError, OSError, ValueError):
+            return dict()
+        tokens = dict()
+        for key, value in stored.items():
+            try:
+                tokens[key] = (value['token'], parsedatetime(value['expiresAt']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        return tokens
+
+    def _write_entry(self, key, entry):
+        stored = dict(
+            (stored_key, {'token': token, 'expiresAt': expiry.isoformat()})
+            for stored_key, (token, expiry) in self._read_store().items()
+            if expiry > datetime.now(tzutc())
+        )
+        stored[key] = {'token': entry[0], 'expiresAt': entry[1].isoformat()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tokens')
+        try:
+            with os.fdopen(file_descriptor, 'w') as temp_file:
+                json.dump(stored, temp_file)
+            os.chmod(temp_path, 0o600)
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+
+class _FileLock(object):
+    """
+    An exclusive advisory lock on a file beside the token store.
+    """
+
+    def __init__(self, path):
+        self._lock_path = path + '.lock' if path and fcntl else None
+        self._lock_file = None
+
+    def __enter__(self):
+        if self._lock_path:
+            self._lock_file = open(self._lock_path, 'a')
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._lock_file:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        return False
+
+
+def _weak_callable(callable_object):
+    if hasattr(callable_object, '__self__'):
+        return weakref.WeakMethod(callable_object)
+    return lambda: callable_object
+
+
+def _first_alive(references):
+    for reference in references:
+        callable_object = reference()
+        if callable_object is not None:
+            return callable_object
+    return None
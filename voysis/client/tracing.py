@@ -0,0 +1,260 @@
+"""
+Hooks for tracing the phases of a query. A client with a +tracer+ set
+reports each phase of a query (connecting, refreshing the app token,
+creating the query, streaming the audio and waiting for the result) to
+it as TraceEvents. Timestamps come from a monotonic, high resolution
+clock, so they can be subtracted to give phase durations but are not
+wall clock times.
+"""
+import abc
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import glog as log
+import six
+
+BEGIN = 'begin'
+END = 'end'
+INSTANT = 'instant'
+
+# The phases of a query, in the order they usually happen.
+QUERY = 'query'
+PREPARE = 'prepare'
+CONNECT = 'connect'
+TOKEN_REFRESH = 'token_refresh'
+QUERY_CREATE = 'query_create'
+AUDIO = 'audio'
+FIRST_AUDIO = 'first_audio'
+LAST_AUDIO = 'last_audio'
+VAD_STOP = 'vad_stop'
+QUERY_COMPLETE = 'query_complete'
+
+
+class TraceEvent(object):
+    """
+    A point in a query's trace: the beginning or end of a phase, or an
+    instant such as a notification arriving.
+
+    +trace_id+ is unique to the query and generated by the client, so that
+    events can be correlated before the server has assigned a query ID.
+    +bytes_sent+ and +bytes_received+ are the totals for the query so far.
+    +duration+ is set on END events, in seconds.
+    """
+
+    __slots__ = ('trace_id', 'name', 'phase', 'timestamp', 'duration', 'bytes_sent', 'bytes_received',
+                 'attributes')
+
+    def __init__(self, trace_id, name, phase, timestamp, duration=None, bytes_sent=0, bytes_received=0,
+                 attributes=None):
+        self.trace_id = trace_id
+        self.name = name
+        self.phase = phase
+        self.timestamp = timestamp
+        self.duration = duration
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.attributes = attributes if attributes else {}
+
+    def to_dict(self):
+        event = {
+            'traceId': self.trace_id,
+            'name': self.name,
+            'phase': self.phase,
+            'timestamp': self.timestamp,
+            'bytesSent': self.bytes_sent,
+            'bytesReceived': self.bytes_received
+        }
+        if self.duration is not None:
+            event['duration'] = self.duration
+        event.update(self.attributes)
+        return event
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Tracer(object):
+    """
+    Receives the TraceEvents of every query made by the clients it is set
+    on. on_event is called on whichever thread the event happened, which
+    includes the WebSocket thread, so it must be thread-safe and quick.
+    """
+
+    @abc.abstractmethod
+    def on_event(self, event):
+        pass
+
+
+class RecordingTracer(Tracer):
+    """
+    Keeps every event in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+
+    def on_event(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def events(self, trace_id=None):
+        """
+        :param trace_id: Only return the events of this trace.
+        :return: A list of the events recorded, in the order they happened.
+        """
+        with self._lock:
+            return [event for event in self._events if trace_id is None or event.trace_id == trace_id]
+
+    def trace_ids(self):
+        with self._lock:
+            return list(dict.fromkeys(event.trace_id for event in self._events))
+
+    def durations(self, trace_id):
+        """
+        :return: A dict of the duration of each phase of a trace, in
+                 seconds. Instants give their time since the trace began.
+        """
+        events = self.events(trace_id)
+        if not events:
+            return {}
+        start = events[0].timestamp
+        durations = {}
+        for event in events:
+            if event.phase == END:
+                durations[event.name] = event.duration
+            elif event.phase == INSTANT:
+                durations[event.name] = event.timestamp - start
+        return durations
+
+
+class LogTracer(Tracer):
+    """
+    Logs each event as a line of JSON.
+    """
+
+    def on_event(self, event):
+        log.info('trace ' + json.dumps(event.to_dict(), sort_keys=True))
+
+
+class QueryTrace(object):
+    """
+    The trace of a single query. Tracks the time each phase began, the
+    bytes transferred and the IDs the query has been given, and passes
+    events to the tracer.
+    """
+
+    def __init__(self, tracer, trace_id=None):
+        self.tracer = tracer
+        self.trace_id = trace_id if trace_id else uuid.uuid4().hex
+        self.request_id = None
+        self.query_id = None
+        self.conversation_id = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._begun = {}
+
+    def begin(self, name, **attributes):
+        timestamp = time.perf_counter()
+        self._begun[name] = timestamp
+        self._emit(name, BEGIN, timestamp, None, attributes)
+
+    def end(self, name, **attributes):
+        """
+        End phase +name+. Does nothing if the phase hasn't begun, or has
+        already ended.
+        """
+        timestamp = time.perf_counter()
+        begun = self._begun.pop(name, None)
+        if begun is not None:
+            self._emit(name, END, timestamp, timestamp - begun, attributes)
+
+    def instant(self, name, **attributes):
+        self._emit(name, INSTANT, time.perf_counter(), None, attributes)
+
+    def is_active(self, name):
+        return name in self._begun
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Trace the body of a with statement as phase +name+. The dict
+        yielded holds attributes for the END event, which also gets an
+        +error+ attribute if the body raises.
+        """
+        self.begin(name, **attributes)
+        end_attributes = {}
+        try:
+            yield end_attributes
+        except Exception as error:
+            end_attributes['error'] = repr(error)
+            raise
+        finally:
+            self.end(name, **end_attributes)
+
+    def add_sent(self, size):
+        self.bytes_sent += size
+
+    def add_received(self, size):
+        self.bytes_received += size
+
+    def _emit(self, name, phase, timestamp, duration, attributes):
+        for key, value in (('requestId', self.request_id),
+                           ('queryId', self.query_id),
+                           ('conversationId', self.conversation_id)):
+            if value is not None:
+                attributes.setdefault(key, value)
+        self.tracer.on_event(TraceEvent(self.trace_id, name, phase, timestamp, duration,
+                                        self.bytes_sent, self.bytes_received, attributes))
+
+
+class _NullTrace(QueryTrace):
+    """
+    The trace of a query made by a client with no tracer. Does nothing.
+    """
+
+    def __init__(self):
+        QueryTrace.__init__(self, None, trace_id='')
+
+    def begin(self, name, **attributes):
+        pass
+
+    def end(self, name, **attributes):
+        pass
+
+    def instant(self, name, **attributes):
+        pass
+
+    def is_active(self, name):
+        return False
+
+    @contextmanager
+    def span(self, name, **attributes):
+        yield {}
+
+    def add_sent(self, size):
+        pass
+
+    def add_received(self, size):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def trace_frames(trace, frames_generator):
+    """
+    Trace the streaming of +frames_generator+ as the AUDIO phase, with
+    FIRST_AUDIO and LAST_AUDIO instants, counting the bytes sent.
+    """
+    frames = 0
+    for frame in frames_generator:
+        if not frames:
+            trace.begin(AUDIO)
+            trace.instant(FIRST_AUDIO)
+        frames += 1
+        trace.add_sent(len(frame))
+        yield frame
+    trace.instant(LAST_AUDIO, frames=frames)
+    trace.end(AUDIO, frames=frames)
@@ -1,10 +1,24 @@
-import json
+import random
 import threading
+import time
 import websocket
+from collections import OrderedDict
+from voysis import metrics as metrics
 from voysis.client import client as client
+from voysis.client import session_log as session_log
+from voysis.client import tracing as tracing
+
+CONNECTIONS_OPENED = metrics.counter('voysis_ws_client_connections_opened', 'WebSocket connections opened.')
+CONNECTIONS_CLOSED = metrics.counter('voysis_ws_client_connections_closed', 'WebSocket connections closed.')
+RECONNECT_ATTEMPTS = metrics.counter('voysis_ws_client_reconnect_attempts',
+                                     'Attempts to reopen a lost WebSocket connection.')
+AUDIO_QUEUE_DEPTH = metrics.gauge('voysis_ws_client_audio_queue_depth',
+                                  'Queries waiting for another query on the same connection to finish sending '
+                                  'audio.')
 
 
 class WSClient(client.Client):
+    transport = 'ws'
 
     def __init__(self, url, user_agent=None, timeout=15):
         client.Client.__init__(self, url, user_agent)
@@ -12,105 +26,174 @@ class WSClient(client.Client):
         self._websocket_app = None
         self._web_socket_thread = None
         self._next_request_id = 1
-        self._complete_reason = None
-        self._notification_handler = None
-        self._event = threading.Event()
-        self._completed_query = None
+        self._lock = threading.RLock()
+        self._connect_lock = threading.Lock()
+        self._audio_lock = threading.Lock()
+        self._connected_event = threading.Event()
         self._response_futures = dict()
+        self._queries_by_request_id = dict()
+        self._queries_by_query_id = dict()
+        self._active_queries = OrderedDict()
+        self._streaming_query = None
         self._error = None
+        self._was_connected = False
+        self.reconnect_attempts = 5
+        self.reconnect_backoff = 0.1
+        self.reconnect_backoff_max = 5.0
+        self.session_recorder = None
 
-    def send_audio(self, frames_generator):
+    def send_audio(self, frames_generator, query=None):
+        """
+        Send audio frames over the WebSocket. Audio frames carry no query
+        identifier, so callers that share this client must hold the audio
+        lock from query creation until the audio is finalised.
+        :param frames_generator: The frames to send.
+        :param query: The StreamingQuery the audio belongs to. Streaming
+                      stops early if the query is completed or stopped.
+        :return: None
+        """
+        query = query if query else self._streaming_query
+        trace = query.trace if query else tracing.NULL_TRACE
+        frames = 0
+        audio_bytes = 0
         for frame in frames_generator:
-            if self._complete_reason:
+            if query and query.complete_reason:
                 break
-            self._websocket_app.send(frame, websocket.ABNF.OPCODE_BINARY)
-        if not self._complete_reason:
+            if not frames:
+                trace.begin(tracing.AUDIO)
+                trace.instant(tracing.FIRST_AUDIO)
+            frames += 1
+            self._send(frame, websocket.ABNF.OPCODE_BINARY)
+            audio_bytes += len(frame)
+            trace.add_sent(len(frame))
+        finalised = not (query and query.complete_reason)
+        if finalised:
             self.finalise_audio()
+            trace.add_sent(1)
+        if query and query.stats:
+            query.stats.audio_frames += frames
+            query.stats.audio_bytes += audio_bytes
+            query.stats.audio_end = time.perf_counter()
+        trace.instant(tracing.LAST_AUDIO, frames=frames)
+        trace.end(tracing.AUDIO, frames=frames, finalised=finalised)
 
     def send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST'):
-        request_id = self._next_request_id
-        self._next_request_id = self._next_request_id + 1
-        body = {
-            'type': 'request',
-            'requestId': request_id,
-            'method': method,
-            'restUri': uri,
-            'entity': request_entity
-        }
-        headers = self.create_common_headers()
-        if extra_headers:
-            headers.update(extra_headers)
-        body['headers'] = headers
-        response_future = client.ResponseFuture(call_on_complete=call_on_complete)
-        self._response_futures[str(request_id)] = response_future
-        self._websocket_app.send(json.dumps(body))
-        return response_future
-
+        return self._send_request(uri, request_entity, extra_headers, call_on_complete, method)
 
     def finalise_audio(self):
         '''
         When VAD is not encountered this has to be send to notify server that all audio has been sent
         '''
-        self._websocket_app.send([4], websocket.ABNF.OPCODE_BINARY)
+        self._send([4], websocket.ABNF.OPCODE_BINARY)
 
     def on_ws_message(self, web_socket, message):
-        json_msg = json.loads(message)
+        if self.session_recorder:
+            self._record_session(session_log.RECEIVED, message)
+        json_msg = self._get_codec().loads(message)
         if 'response' == json_msg['type']:
-            if int(json_msg['responseCode']) > 299:
-                self._error = client.ClientError(
-                    "Request {requestId} failed with status code {responseCode}: {responseMessage}".format(**json_msg)
-                )
-            try:
-                future = self._response_futures.pop(json_msg['requestId'])
+            request_id = str(json_msg['requestId'])
+            with self._lock:
+                future = self._response_futures.pop(request_id, None)
+                query = self._queries_by_request_id.pop(request_id, None)
+            if query:
+                query.trace.add_received(len(message))
+                if int(json_msg['responseCode']) > 299:
+                    query.error = client.ClientError(
+                        "Request {requestId} failed with status code {responseCode}: {responseMessage}".format(
+                            **json_msg)
+                    )
+                    self._update_state(query, 'error')
+                elif json_msg.get('entity'):
+                    query.query_id = json_msg['entity'].get('id')
+                    query.trace.query_id = query.query_id
+                    query.trace.conversation_id = json_msg['entity'].get('conversationId')
+                    with self._lock:
+                        if query.query_id and query.query_id in self._active_queries:
+                            self._queries_by_query_id[query.query_id] = query
+                query.trace.end(tracing.QUERY_CREATE, responseCode=json_msg['responseCode'])
+            if future:
                 future.set(
                     json_msg['responseCode'],
                     response_message=json_msg['responseMessage'],
                     response_entity=json_msg['entity']
                 )
-            except KeyError:
-                pass
         elif 'notification' == json_msg['type']:
             notification_type = json_msg['notificationType']
-            if 'query_complete' == notification_type:
-                self._completed_query = json_msg['entity']
-            self._update_state(notification_type, 'vad_stop' != notification_type)
+            query = self._find_query(json_msg)
+            if query:
+                query.trace.add_received(len(message))
+                query.trace.instant(notification_type)
+                if 'query_complete' == notification_type:
+                    query.completed_query = json_msg['entity']
+                self._update_state(query, notification_type, 'vad_stop' != notification_type)
 
     def on_ws_error(self, web_socket, error):
+        if web_socket is not self._websocket_app:
+            return
+        if isinstance(error, websocket.WebSocketConnectionClosedException):
+            # The connection dropped, which on_ws_close, called next, reports
+            # to the queries.
+            return
+        self._error = error
+        for query in self._take_active_queries():
+            query.error = error
+            self._update_state(query, 'error')
         try:
-            self._complete_reason = 'error'
-            self._error = error
             web_socket.close()
         except websocket.WebSocketException:
-            self._update_state()
+            pass
 
     def on_ws_open(self, web_socket):
-        self._event.set()
+        self._connected_event.set()
 
     def on_ws_close(self, web_socket):
-        self._update_state()
+        with self._lock:
+            if web_socket is not self._websocket_app:
+                return
+            # Forget the closed socket so that the next connect() opens a
+            # new one rather than reporting the stale connection state.
+            self._websocket_app = None
+            pending_futures = list(self._response_futures.values())
+            self._response_futures.clear()
+        CONNECTIONS_CLOSED.inc()
+        for query in self._take_active_queries():
+            self._update_state(query, 'connection_closed')
+        closed_error = client.ClientError("Connection closed before a response was received")
+        for future in pending_futures:
+            future.set_error(closed_error)
+        self._connected_event.set()
 
     def connect(self):
         """
         Connect the WebSocket. This method blocks until the socket is
         successfully connected. If the socket does not connect within
-        the client's timeout, ClientError is raised.
+        the client's timeout, ClientError is raised. If a previously open
+        connection was lost, up to +reconnect_attempts+ further attempts
+        are made, with jittered exponential backoff between them.
         :return: bool True if the connection was successful
         """
-        if not self._websocket_app:
-            self._event.clear()
-            self._websocket_app = websocket.WebSocketApp(
-                self._url,
-                on_message=self.on_ws_message,
-                on_error=self.on_ws_error,
-                on_open=self.on_ws_open,
-                on_close=self.on_ws_close
-            )
-            self._web_socket_thread = WebSocketThread(self._websocket_app, check_hostname=self.check_hostname)
-            self._web_socket_thread.start()
-            connected = self._wait_for_event('WebSocket connection')
-        else:
-            connected = self._websocket_app.sock.connected
-        return connected
+        with self._connect_lock:
+            if self.is_connected():
+                return True
+            attempt = 0
+            while True:
+                try:
+                    return self._open_connection()
+                except Exception:
+                    attempt += 1
+                    if not self._was_connected or attempt > self.reconnect_attempts:
+                        raise
+                    RECONNECT_ATTEMPTS.inc()
+                    time.sleep(self._backoff_delay(attempt))
+
+    def is_connected(self):
+        """
+        Check whether the WebSocket is currently connected, without
+        attempting to connect it.
+        :return: bool True if the socket is open
+        """
+        web_socket_app = self._websocket_app
+        return bool(web_socket_app and web_socket_app.sock and web_socket_app.sock.connected)
 
     def close(self):
         """
@@ -118,72 +201,290 @@ class WSClient(client.Client):
         client resources are cleaned up.
         :return: None
         """
-        self._websocket_app.close()
-        self._web_socket_thread.join()
-        self._web_socket_thread = None
+        self._stop_token_refresh()
+        with self._lock:
+            web_socket_app = self._websocket_app
+            self._was_connected = False
+        if web_socket_app:
+            web_socket_app.close()
+        self._join_web_socket_thread()
         self._websocket_app = None
 
-    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None):
+    def stream_audio(self, frames_generator, notification_handler=None, audio_type=None, prepared_query=None,
+                     audio_digest=None):
+        """
+        Stream audio for a new query. This method may be called concurrently
+        from several threads sharing this client: each call tracks its own
+        query state, and notifications are routed to the query they belong
+        to. Audio for concurrent queries is sent one query at a time, since
+        audio frames on the socket carry no query identifier. A query that
+        finalises its audio keeps the socket until the server answers it,
+        as a vad_stop may already be on its way and carries no identifier
+        either.
+        """
+        cache_key, cached_result = self._get_cached_result(audio_digest, audio_type, notification_handler,
+                                                           prepared_query)
+        if cached_result:
+            return cached_result
+        trace = self._start_trace(prepared_query)
+        query = StreamingQuery(notification_handler, trace)
+        query.stats = self._start_query_stats()
         try:
-            if audio_type is not None:
+            if prepared_query:
+                prepared_query.wait_until_ready(self._timeout)
+                if audio_type is None:
+                    audio_type = prepared_query.audio_type
+            frames_generator, audio_type = self._encode_frames(frames_generator, audio_type, notification_handler)
+            self._connect_traced(trace)
+            self._refresh_app_token_traced(trace)
+            AUDIO_QUEUE_DEPTH.inc()
+            with self._audio_lock:
+                AUDIO_QUEUE_DEPTH.dec()
                 self._audio_type = audio_type
-            self._complete_reason = None
-            self._error = None
-            self._notification_handler = notification_handler
-            self.connect()
-            self.refresh_app_token()
-            create_entity = self._create_audio_query_entity()
-            # self._event.clear()
-            self.send_request('/queries', create_entity, call_on_complete=self._update_current_conversation)
-            # self._wait_for_event('query creation')
-            self._event.clear()
-            self.send_audio(frames_generator)
-            self._wait_for_event('query completion')
-            completed_query = self._completed_query
-            self._completed_query = None
+                create_entity = self._create_audio_query_entity()
+                self._register_query(query)
+                self._streaming_query = query
+                try:
+                    self._send_request('/queries', create_entity,
+                                       call_on_complete=self._update_current_conversation, query=query)
+                    self.send_audio(frames_generator, query)
+                    query.wait_until_answered(self._timeout)
+                finally:
+                    self._streaming_query = None
+            self._wait_for_query(query, 'query completion')
+            completed_query = query.completed_query
             if completed_query:
                 self._update_current_context(completed_query)
+                if cache_key:
+                    self.result_cache.put(cache_key, completed_query)
                 return completed_query
             else:
-                raise client.ClientError("Query failed {}".format(self._complete_reason))
+                raise client.ClientError("Query failed {}".format(query.complete_reason))
         except OSError as error:
             raise client.ClientError(error.strerror)
         except websocket.WebSocketConnectionClosedException as error:
             # This exception typically happens when we try to continue
             # streaming after the server side has shut down the socket
             # due to an error condition.
-            if self._error:
-                raise self._error
+            error_cause = query.error or self._error
+            if error_cause:
+                raise error_cause
             else:
                 raise error
         except websocket.WebSocketException as error:
             raise client.ClientError(str(error))
         finally:
-            self._notification_handler = None
+            query.notification_handler = None
+            self._unregister_query(query)
+            self._end_query_stats(query.stats, query.completed_query)
+            self._end_trace(trace, query.completed_query)
 
     def send_feedback(self, query_id, rating=None, description=None, durations=None):
         self.connect()
         return super(WSClient, self).send_feedback(query_id, rating, description, durations)
 
-    def _wait_for_event(self, message):
-        if not self._event.wait(self._timeout):
+    def _open_connection(self):
+        if self._websocket_app:
+            # The socket has closed without on_ws_close being called yet.
+            stale_app = self._websocket_app
+            self._websocket_app = None
+            stale_app.close()
+        self._join_web_socket_thread()
+        self._connected_event.clear()
+        self._error = None
+        self._websocket_app = websocket.WebSocketApp(
+            self._url,
+            on_message=self.on_ws_message,
+            on_error=self.on_ws_error,
+            on_open=self.on_ws_open,
+            on_close=self.on_ws_close
+        )
+        self._web_socket_thread = WebSocketThread(self._websocket_app, check_hostname=self.check_hostname)
+        self._web_socket_thread.start()
+        if not self._connected_event.wait(self._timeout):
+            raise client.ClientError("Timed out waiting on WebSocket connection")
+        if self._error:
+            raise self._error
+        if not self.is_connected():
+            raise client.ClientError("WebSocket connection closed while connecting")
+        self._was_connected = True
+        CONNECTIONS_OPENED.inc()
+        return True
+
+    def _join_web_socket_thread(self):
+        web_socket_thread = self._web_socket_thread
+        self._web_socket_thread = None
+        if web_socket_thread and web_socket_thread is not threading.current_thread():
+            web_socket_thread.join(self._timeout)
+
+    def _backoff_delay(self, attempt):
+        """
+        Calculate the delay before reconnection attempt +attempt+ (starting
+        at 1). The delay doubles with each attempt up to
+        +reconnect_backoff_max+, and half of it is randomised so that many
+        clients dropped at once do not reconnect in lockstep.
+        """
+        ceiling = min(self.reconnect_backoff_max, self.reconnect_backoff * (2 ** (attempt - 1)))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def _send(self, data, opcode=websocket.ABNF.OPCODE_TEXT):
+        web_socket_app = self._websocket_app
+        if not web_socket_app:
+            raise websocket.WebSocketConnectionClosedException("Connection is already closed.")
+        if self.session_recorder:
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                self._record_session(session_log.SENT_AUDIO, data)
+            else:
+                self._record_session(session_log.SENT_TEXT, session_log.redact_request(data))
+        web_socket_app.send(data, opcode)
+
+    def _record_session(self, kind, data):
+        recorder = self.session_recorder
+        if recorder:
+            channel = recorder.channel_for(self, {'url': self._url, 'userAgent': self.user_agent.get()})
+            recorder.record(channel, kind, data)
+
+    def _prepare_query(self, prepared_query):
+        # The creation request is only a send, with no wait for the
+        # response, so it stays with the audio under the audio lock.
+        self._connect_traced(prepared_query.trace)
+        self._refresh_app_token_traced(prepared_query.trace)
+
+    def _connect_traced(self, trace):
+        with trace.span(tracing.CONNECT) as attributes:
+            attributes['reused'] = self.is_connected()
+            self.connect()
+
+    def _issue_app_token(self):
+        # May be called from the token cache's refresh thread, after the
+        # connection has dropped.
+        self.connect()
+        return super(WSClient, self)._issue_app_token()
+
+    def _send_request(self, uri, request_entity=None, extra_headers=None, call_on_complete=None, method='POST',
+                      query=None):
+        with self._lock:
+            request_id = self._next_request_id
+            self._next_request_id = self._next_request_id + 1
+            response_future = client.ResponseFuture(call_on_complete=call_on_complete)
+            self._response_futures[str(request_id)] = response_future
+            if query:
+                query.request_id = str(request_id)
+                self._queries_by_request_id[query.request_id] = query
+        body = {
+            'type': 'request',
+            'requestId': request_id,
+            'method': method,
+            'restUri': uri,
+            'entity': request_entity
+        }
+        message = self._encode_request(body, extra_headers)
+        if query:
+            query.trace.request_id = query.request_id
+            query.trace.begin(tracing.QUERY_CREATE)
+            query.trace.add_sent(len(message))
+        self._send(message)
+        return response_future
+
+    def _register_query(self, query):
+        with self._lock:
+            self._active_queries[id(query)] = query
+
+    def _unregister_query(self, query):
+        with self._lock:
+            self._active_queries.pop(id(query), None)
+            self._queries_by_request_id.pop(query.request_id, None)
+            self._queries_by_query_id.pop(query.query_id, None)
+
+    def _take_active_queries(self):
+        with self._lock:
+            queries = list(self._active_queries.values())
+            self._active_queries.clear()
+            self._queries_by_request_id.clear()
+            self._queries_by_query_id.clear()
+        return queries
+
+    def _find_query(self, json_msg):
+        """
+        Find the query a notification belongs to. Notifications are matched
+        on query ID where the server supplies one. Otherwise a vad_stop
+        belongs to the query currently streaming audio, and any other
+        notification to the oldest query still in progress.
+        """
+        entity = json_msg.get('entity')
+        query_id = json_msg.get('queryId')
+        if not query_id and isinstance(entity, dict):
+            query_id = entity.get('queryId', entity.get('id'))
+        with self._lock:
+            query = self._queries_by_query_id.get(query_id) if query_id else None
+            if not query and 'vad_stop' == json_msg['notificationType']:
+                query = self._streaming_query
+            if not query:
+                for active_query in self._active_queries.values():
+                    if not active_query.is_complete():
+                        query = active_query
+                        break
+        return query
+
+    def _wait_for_query(self, query, message):
+        if not query.wait_until_complete(self._timeout):
             raise client.ClientError("Timed out waiting on " + message)
+        if query.error:
+            raise query.error
         if self._error:
             raise self._error
 
-    def _update_state(self, complete_reason=None, response_ready=True):
+    def _update_state(self, query, complete_reason=None, response_ready=True):
         if complete_reason:
-            self._complete_reason = complete_reason
-        notification_handler = self._notification_handler
+            query.complete_reason = complete_reason
+        query.set_answered()
+        notification_handler = query.notification_handler
         if notification_handler:
-            notification_handler(self._complete_reason)
+            notification_handler(query.complete_reason)
         if response_ready:
-            self._event.set()
+            query.set_complete()
 
     def _update_current_conversation(self, response_future):
         if response_future.response_code == 201:
             self.current_conversation_id = response_future.get_entity()['conversationId']
-        # self._event.set()
+
+
+class StreamingQuery(object):
+    """
+    The state of a single audio query being streamed over a WSClient.
+    """
+
+    def __init__(self, notification_handler=None, trace=tracing.NULL_TRACE):
+        self.notification_handler = notification_handler
+        self.trace = trace
+        self.stats = None
+        self.request_id = None
+        self.query_id = None
+        self.complete_reason = None
+        self.completed_query = None
+        self.error = None
+        self._answered = threading.Event()
+        self._event = threading.Event()
+
+    def set_answered(self):
+        """
+        Record that the server has sent a notification or error for this
+        query, so it is no longer waiting on the query's audio.
+        """
+        self._answered.set()
+
+    def wait_until_answered(self, timeout):
+        return self._answered.wait(timeout)
+
+    def set_complete(self):
+        self._answered.set()
+        self._event.set()
+
+    def is_complete(self):
+        return self._event.is_set()
+
+    def wait_until_complete(self, timeout):
+        return self._event.wait(timeout)
 
 
 class WebSocketThread(threading.Thread):
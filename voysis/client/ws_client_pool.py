@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from voysis.client import client as client
+
+
+class WSClientPool(object):
+    """
+    A pool of connected WSClient instances. Clients are connected ahead of
+    time and leased to callers, so the WebSocket upgrade is paid once per
+    connection rather than once per query. Dead sockets are detected when
+    a client is leased or returned, and by a periodic health check, and
+    are replaced in the background.
+    """
+
+    def __init__(self, client_factory, size=4, health_check_interval=5.0):
+        """
+        Create a new pool. No connections are made until start() is called.
+        :param client_factory: A callable that returns a new, configured
+                               WSClient.
+        :param size: The number of connections to keep open.
+        :param health_check_interval: Seconds between checks of idle
+                                      connections.
+        """
+        self._client_factory = client_factory
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._idle = deque()
+        self._leased = set()
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._closed = threading.Event()
+        self._health_check_thread = None
+        self.replaced_connections = 0
+        self.failed_connections = 0
+
+    def start(self):
+        """
+        Open the pool's connections and start the background health check.
+        Blocks until the initial connections have been attempted.
+        :return: This pool instance
+        """
+        threads = [self._replace_in_background() for _ in range(self.size)]
+        for thread in threads:
+            thread.join()
+        self._health_check_thread = threading.Thread(target=self._health_check)
+        self._health_check_thread.daemon = True
+        self._health_check_thread.start()
+        return self
+
+    def acquire(self, timeout=None):
+        """
+        Take a connected client from the pool, waiting up to +timeout+
+        seconds for one to become available.
+        :param timeout: The maximum time to wait, or None to wait forever.
+        :return: A connected WSClient
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        discarded = []
+        try:
+            with self._condition:
+                while True:
+                    if self._closed.is_set():
+                        raise client.ClientError("Client pool is closed")
+                    while self._idle:
+                        ws_client = self._idle.popleft()
+                        if ws_client.is_connected():
+                            self._leased.add(ws_client)
+                            return ws_client
+                        self._discard(ws_client, discarded)
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise client.ClientError("Timed out waiting on a pooled connection")
+                    self._condition.wait(remaining)
+        finally:
+            _close_all(discarded)
+
+    def release(self, ws_client):
+        """
+        Return a leased client to the pool. Clients whose socket has closed
+        are discarded and replaced in the background.
+        :param ws_client: The client to return.
+        :return: None
+        """
+        discarded = []
+        with self._condition:
+            self._leased.discard(ws_client)
+            if self._closed.is_set():
+                discarded.append(ws_client)
+            elif ws_client.is_connected():
+                self._idle.append(ws_client)
+                self._condition.notify()
+            else:
+                self._discard(ws_client, discarded)
+        _close_all(discarded)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Lease a client for the duration of a with block.
+        """
+        ws_client = self.acquire(timeout)
+        try:
+            yield ws_client
+        finally:
+            self.release(ws_client)
+
+    def close(self):
+        """
+        Close every connection in the pool. Leased clients are closed when
+        they are returned.
+        :return: None
+        """
+        with self._condition:
+            self._closed.set()
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+        _close_all(idle)
+        if self._health_check_thread:
+            self._health_check_thread.join()
+            self._health_check_thread = None
+
+    def _discard(self, ws_client, discarded):
+        # Must be called while holding the condition. Closing a client joins
+        # its socket thread, so the caller closes the clients collected in
+        # +discarded+ once the condition is released.
+        discarded.append(ws_client)
+        self.replaced_connections += 1
+        self._replace_in_background()
+
+    def _replace_in_background(self):
+        with self._condition:
+            self._pending += 1
+        thread = threading.Thread(target=self._open_connection)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _open_connection(self):
+        ws_client = None
+        try:
+            ws_client = self._client_factory()
+            ws_client.connect()
+        except Exception:
+            if ws_client:
+                _close_quietly(ws_client)
+            ws_client = None
+        with self._condition:
+            self._pending -= 1
+            if ws_client is None:
+                self.failed_connections += 1
+                return
+            if not self._closed.is_set():
+                self._idle.append(ws_client)
+                self._condition.notify()
+                return
+        # The pool was closed while the connection was being opened.
+        _close_quietly(ws_client)
+
+    def _health_check(self):
+        while not self._closed.wait(self.health_check_interval):
+            discarded = []
+            with self._condition:
+                for ws_client in list(self._idle):
+                    if not ws_client.is_connected():
+                        self._idle.remove(ws_client)
+                        self._discard(ws_client, discarded)
+                missing = self.size - len(self._idle) - len(self._leased) - self._pending
+                for _ in range(missing):
+                    self._replace_in_background()
+            _close_all(discarded)
+
+
+def _close_all(ws_clients):
+    for ws_client in ws_clients:
+        _close_quietly(ws_client)
+
+
+def _close_quietly(ws_client):
+    try:
+        ws_client.close()
+    except Exception:
+        pass
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from contextlib import contextmanager
+
+import glog as log
+
+from voysis.client.ws_client_pool import WSClientPool
+from voysis.device.preprocess import TRIMMED_SUFFIX
+
+
+def find_wav_files(wav_dir):
+    """
+    Find every .wav file under +wav_dir+, in a stable order. Trimmed
+    copies cached by the preprocessor are skipped.
+    """
+    paths = []
+    for root, dirs, files in os.walk(wav_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.wav') and not file.endswith(TRIMMED_SUFFIX):
+                paths.append(os.path.join(root, file))
+    return paths
+
+
+class BatchRunner(object):
+    """
+    Runs a task over many items on a pool of worker threads, each with its
+    own client. Failed items are retried, and progress and throughput are
+    logged while the batch runs.
+    """
+
+    def __init__(self, client_factory, concurrency=1, retries=0, ordered=True, pooled=False,
+                 progress_interval=5.0, retry_delay=0.5):
+        """
+        :param client_factory: A callable that returns a new, configured client.
+        :param concurrency: The number of items to process at once.
+        :param retries: The number of times to retry a failed item.
+        :param ordered: Emit results in the order of the items, rather than
+                        as they complete.
+        :param pooled: Lease WSClients from a WSClientPool of warm
+                       connections, rather than giving each worker thread
+                       its own client.
+        :param progress_interval: Seconds between progress log messages.
+        :param retry_delay: Seconds to wait before the first retry of an
+                            item, growing linearly with each further retry.
+        """
+        self._client_factory = client_factory
+        self.concurrency = max(1, concurrency)
+        self.retries = max(0, retries)
+        self.ordered = ordered
+        self.progress_interval = progress_interval
+        self.retry_delay = retry_delay
+        self._pool = WSClientPool(client_factory, size=self.concurrency).start() if pooled else None
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+        self._total = 0
+        self._completed = 0
+        self._failed = 0
+        self._started = None
+        self._last_progress = 0
+
+    def run(self, items, task):
+        """
+        Run +task+ for every item.
+        :param items: The items to process.
+        :param task: A callable taking a client and an item, returning the
+                     item's result.
+        :return: A generator of (item, result, error) tuples, where error is
+                 the exception raised by the last attempt, or None.
+        """
+        items = list(items)
+        self._total = len(items)
+        self._completed = 0
+        self._failed = 0
+        self._started = time.time()
+        self._last_progress = self._started
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [executor.submit(self._run_item, task, item) for item in items]
+            for future in (futures if self.ordered else as_completed(futures)):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=True)
+            self._log_progress(force=True)
+
+    def close(self):
+        """
+        Close every client used by the batch.
+        :return: None
+        """
+        if self._pool:
+            self._pool.close()
+        for batch_client in self._clients:
+            batch_client.close()
+        self._clients = []
+
+    def _run_item(self, task, item):
+        attempt = 0
+        while True:
+            try:
+                with self._lease_client() as batch_client:
+                    result = task(batch_client, item)
+                self._item_done(failed=False)
+                return item, result, None
+            except Exception as error:
+                attempt += 1
+                if attempt > self.retries:
+                    self._item_done(failed=True)
+                    return item, None, error
+                log.info('Retrying {} after error: {}'.format(item, error))
+                time.sleep(self.retry_delay * attempt)
+
+    @contextmanager
+    def _lease_client(self):
+        if self._pool:
+            with self._pool.lease(timeout=60) as batch_client:
+                yield batch_client
+        else:
+            batch_client = getattr(self._local, 'client', None)
+            if batch_client is None:
+                batch_client = self._client_factory()
+                self._local.client = batch_client
+                with self._lock:
+                    self._clients.append(batch_client)
+            yield batch_client
+
+    def _item_done(self, failed):
+        with self._lock:
+            self._completed += 1
+            if failed:
+                self._failed += 1
+        self._log_progress()
+
+    def _log_progress(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+            elapsed = max(now - self._started, 1e-6)
+            rate = self._completed / elapsed
+            remaining = (self._total - self._completed) / rate if rate else float('inf')
+            completed, failed, total = self._completed, self._failed, self._total
+        log.info('Progress: {}/{} done, {} failed, {:.2f} files/s, {:.0f}s elapsed, {:.0f}s remaining'.format(
+            completed, total, failed, rate, elapsed, remaining))
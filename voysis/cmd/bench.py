@@ -0,0 +1,180 @@
+import itertools
+import math
+import time
+from collections import defaultdict
+
+from voysis.cmd.batch import BatchRunner
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """
+    A histogram of latencies in logarithmic buckets, so percentiles are
+    accurate to within +precision+ of the true value however many samples
+    are recorded.
+    """
+
+    def __init__(self, precision=0.01):
+        self._log_base = math.log1p(precision)
+        self._counts = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = max(0.0, float(value))
+        self._counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        """
+        The value below which +percentile+ percent of samples fall, or
+        None if no samples have been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * percentile / 100.0)))
+        seen = 0
+        for bucket in sorted(self._counts):
+            seen += self._counts[bucket]
+            if seen >= rank:
+                return min(self.max, max(self.min, self._bucket_value(bucket)))
+        return self.max
+
+    def to_dict(self):
+        summary = {
+            'count': self.count,
+            'min': self.min,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max
+        }
+        for percentile in PERCENTILES:
+            summary['p{:g}'.format(percentile)] = self.percentile(percentile)
+        return summary
+
+    def _bucket(self, value):
+        if value < 1.0:
+            return 0
+        return int(math.log(value) / self._log_base) + 1
+
+    def _bucket_value(self, bucket):
+        # The upper bound of the bucket.
+        return math.exp(bucket * self._log_base) if bucket else 1.0
+
+
+class Benchmark(object):
+    """
+    Replays a corpus against the Query API and aggregates latencies.
+
+    In closed-loop mode, +concurrency+ workers each send their next query
+    as soon as the previous one completes. In open-loop mode, queries are
+    started at a fixed rate of +qps+, with at most +concurrency+ in flight.
+    Open-loop latency is measured from when each query was scheduled to
+    start rather than when it actually started, so time spent waiting for
+    a free worker counts against the result. This corrects for
+    coordinated omission: a slow server can't hide its latency by slowing
+    the load generator down.
+    """
+
+    def __init__(self, client_factory, concurrency=1, qps=None, pooled=False):
+        self._client_factory = client_factory
+        self.concurrency = concurrency
+        self.qps = qps
+        self.pooled = pooled
+
+    def run(self, items, task, requests=None):
+        """
+        Run the benchmark.
+        :param items: The corpus items to replay, cycled through as needed.
+        :param task: A callable taking a client and an item that runs one
+                     query and returns a dict of phase durations in
+                     milliseconds.
+        :param requests: The number of queries to send. Defaults to one per
+                         item.
+        :return: A report dict.
+        """
+        items = list(items)
+        requests = requests if requests else len(items)
+        interval = 1.0 / self.qps if self.qps else None
+        work = [(item, index * interval if interval else None)
+                for index, item in enumerate(itertools.islice(itertools.cycle(items), requests))]
+        histograms = defaultdict(LatencyHistogram)
+        errors = defaultdict(int)
+        runner = BatchRunner(self._client_factory, concurrency=self.concurrency, ordered=False,
+                             pooled=self.pooled)
+        started = time.monotonic()
+        timed_task = _TimedTask(task, started)
+        try:
+            for _, result, error in runner.run(work, timed_task):
+                if error:
+                    errors[type(error).__name__] += 1
+                    continue
+                durations, latency, service_time = result
+                histograms['total'].record(latency)
+                if interval:
+                    histograms['service'].record(service_time)
+                for phase, duration in durations.items():
+                    histograms[phase].record(duration)
+        finally:
+            runner.close()
+        elapsed = time.monotonic() - started
+        completed = requests - sum(errors.values())
+        return {
+            'mode': 'open' if interval else 'closed',
+            'concurrency': self.concurrency,
+            'targetQps': self.qps,
+            'requests': requests,
+            'completed': completed,
+            'failed': requests - completed,
+            'errorRate': (requests - completed) / float(requests) if requests else 0.0,
+            'errors': dict(errors),
+            'elapsedSeconds': elapsed,
+            'throughputQps': completed / elapsed if elapsed else 0.0,
+            'latencyMs': dict((phase, histogram.to_dict()) for phase, histogram in histograms.items())
+        }
+
+
+class _TimedTask(object):
+
+    def __init__(self, task, started):
+        self._task = task
+        self._started = started
+
+    def __call__(self, bench_client, work_item):
+        item, offset = work_item
+        scheduled = None
+        if offset is not None:
+            scheduled = self._started + offset
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        start = time.monotonic()
+        durations = self._task(bench_client, item)
+        end = time.monotonic()
+        intended_start = start if scheduled is None else scheduled
+        return durations, (end - intended_start) * 1000.0, (end - start) * 1000.0
+
+
+def format_report(report):
+    """
+    Format a benchmark report as a human readable table.
+    """
+    lines = [
+        '{mode}-loop benchmark: {completed}/{requests} queries completed in {elapsedSeconds:.1f}s, '
+        '{throughputQps:.2f} queries/s, error rate {errorRate:.2%}'.format(**report)
+    ]
+    header = ['phase', 'count', 'min', 'mean'] + ['p{:g}'.format(p) for p in PERCENTILES] + ['max']
+    lines.append(''.join('{:>10}'.format(column) for column in header))
+    for phase, summary in sorted(report['latencyMs'].items()):
+        values = [summary[column] for column in header[2:]]
+        lines.append('{:>10}{:>10}'.format(phase, summary['count']) +
+                     ''.join('{:>10.1f}'.format(value) if value is not None else '{:>10}'.format('-')
+                             for value in values))
+    for error_type, count in sorted(report['errors'].items()):
+        lines.append('{:>10} errors: {}'.format(error_type, count))
+    return '\n'.join(lines)
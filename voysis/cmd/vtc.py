@@ -11,12 +11,19 @@ import traceback
 
 from select import select
 from voysis import config as config
+from voysis.cmd import batch as batch
+from voysis.cmd import bench as bench
 from voysis.client.client import ClientError
 from voysis.client.http_client import HTTPClient
+from voysis.client import result_cache as result_cache
+from voysis.client import session_log as session_log
+from voysis.client import tracing as tracing
+from voysis.client.token_handler import get_token_cache
 from voysis.client.ws_client import WSClient
 from voysis.device.file_device import FileDevice
 from voysis.device.mic_device import MicDevice
 from voysis.device.mic_array.mic_array import MicArrayDevice
+from voysis.device import preprocess as preprocess
 from voysis.version import __version__
 
 MICROPHONE = 'mic'
@@ -28,26 +35,30 @@ class RecordingStopper(object):
     """
     A class that can be used to stop a device recording and save interesting event information.
     """
-    def __init__(self, device, query_start, durations):
+    def __init__(self, device, query_start, durations, verbose=True):
         """
         Create a new RecordingStopper instance.
         :param device: The device that will be stopped.
         :param query_start: The timestamp of the start of the query.
         :param durations: A dict that will be populated with relevant durations.
+        :param verbose: Print a message when recording is stopped.
         """
         self._device = device
+        self._verbose = verbose
         self._query_start = int(query_start * 1000)
         self._durations = durations
         self._mappings = {
             'vad_stop': 'vad',
             'user_stop': 'userStop',
+            'client_vad': 'clientVad',
+            'result_cache': 'cached',
             'query_complete': 'complete'
         }
 
     def stop_recording(self, reason):
         was_recording = self._device.is_recording()
         self._device.stop_recording()
-        if was_recording:
+        if was_recording and self._verbose:
             print("Recording stopped (%s), waiting for response.." % reason)
         if reason:
             event_timestamp = int(time() * 1000) - self._query_start
@@ -62,6 +73,13 @@ def valid_file(parser, arg):
         return open(arg, 'rb') # return an open file handle
 
 
+def valid_file_path(parser, arg):
+    if not os.path.isfile(arg):
+        parser.error("The file %s does not exist!" % arg)
+    else:
+        return arg
+
+
 def valid_folder(parser, arg):
     if not os.path.isdir(arg):
         parser.error("The folder %s does not exist!" % arg)
@@ -94,6 +112,7 @@ def client_factory(url):
         config.apply_config(client, 'http_client')
     else:
         raise ValueError('No client for protocol in URL %s' % url)
+    client.token_cache = get_token_cache(config.get('client', 'token_cache_file', None))
     return client
 
 
@@ -102,10 +121,7 @@ def device_factory(record, client):
         device = FileDevice()
 
     if record == MICROPHONE_ARRAY:
-        # TODO make Microphone array stream concatenate all the channels to only one
-        raise ValueError('')
-        device = None
-        # device = MicArrayDevice(client)
+        device = MicArrayDevice(client)
 
     if record == MICROPHONE:
         device = MicDevice(client)
@@ -114,6 +130,11 @@ def device_factory(record, client):
 
 
 def stream_mic(client, device, durations):
+    prepared_query = client.prepare(device.audio_type())
+    if device.continuous:
+        # Capture while waiting, so the recording can include the moment
+        # before ENTER was pressed.
+        device.start_capture()
     print("Ready to capture your voice query")
     input("Press ENTER to start recording")
     query = None
@@ -133,19 +154,24 @@ def stream_mic(client, device, durations):
         keyboard_thread = threading.Thread(target=keyboard_stop)
         keyboard_thread.daemon = True
         keyboard_thread.start()
-        query = client.stream_audio(device.generate_frames(), notification_handler=recording_stopper.stop_recording, 
-                                    audio_type=device.audio_type())
+        query = client.stream_audio(device.generate_frames(), notification_handler=recording_stopper.stop_recording,
+                                    audio_type=device.audio_type(), prepared_query=prepared_query)
         recording_stopper.stop_recording(None)
     except ValueError:
         pass
+    finally:
+        device.close()
     return query
 
 
 def stream_file(client, device, durations):
     recording_stopper = RecordingStopper(device, time(), durations)
+    audio_digest = device.audio_digest() if client.result_cache else None
+    prepared_query = client.prepare(device.audio_type())
     device.start_recording()
-    query = client.stream_audio(device.generate_frames(), notification_handler=recording_stopper.stop_recording, 
-                                audio_type=device.audio_type())
+    query = client.stream_audio(device.generate_frames(), notification_handler=recording_stopper.stop_recording,
+                                audio_type=device.audio_type(), prepared_query=prepared_query,
+                                audio_digest=audio_digest)
     recording_stopper.stop_recording(None)
     return query
 
@@ -162,10 +188,126 @@ def stream(voysis_client, file=None, record=None):
     durations = {}
     result = streamer(voysis_client, device, durations)
     print('Durations: ' + (json.dumps(durations)))
-    voysis_client.send_feedback(result['id'], durations=durations)
+    if 'cached' not in durations:
+        voysis_client.send_feedback(result['id'], durations=durations)
     return result, result['id'], result['conversationId']
 
 
+def stream_path(voysis_client, path):
+    with open(path, 'rb') as wav_file:
+        result, query_id, conversation_id = stream(voysis_client, wav_file)
+    return result
+
+
+def stream_batch_path(voysis_client, path):
+    """
+    Stream a wav file from a batch. With a result cache, each file starts a
+    new conversation, as the conversation a leased client carries over
+    depends on which files it happened to stream before, and is part of
+    the cache key.
+    """
+    if voysis_client.result_cache:
+        voysis_client.current_conversation_id = None
+        voysis_client.current_context = None
+    return stream_path(voysis_client, path)
+
+
+def find_corpus(wav_dir, preprocess_files=False):
+    paths = batch.find_wav_files(wav_dir)
+    if preprocess_files:
+        log.info('Trimming silence from {} files'.format(len(paths)))
+        paths = preprocess.preprocess_files(paths)
+    return paths
+
+
+def stream_batch(url, wav_dir, concurrency=1, retries=0, ordered=True, client_setup=None, preprocess_files=False):
+    """
+    Stream every wav file in a folder, +concurrency+ files at a time, and
+    print each result.
+    :param client_setup: A callable applied to each new client.
+    :param preprocess_files: Stream trimmed and normalised copies of the files.
+    :return: The number of files that failed.
+    """
+    paths = find_corpus(wav_dir, preprocess_files)
+    log.info('Streaming {} files from folder {} over {}'.format(len(paths), wav_dir, url))
+
+    def new_client():
+        batch_client = client_factory(url)
+        if client_setup:
+            client_setup(batch_client)
+        return batch_client
+
+    pooled = url.startswith('ws://') or url.startswith('wss://')
+    runner = batch.BatchRunner(new_client, concurrency=concurrency, retries=retries, ordered=ordered, pooled=pooled)
+    failures = 0
+    try:
+        for path, result, error in runner.run(paths, stream_batch_path):
+            if error:
+                failures += 1
+                log.error('Streaming {} failed: {}'.format(path, getattr(error, 'message', None) or error))
+            else:
+                log.info('Streamed {}'.format(path))
+                json.dump(result, sys.stdout, indent=4)
+    finally:
+        runner.close()
+    return failures
+
+
+def bench_query(voysis_client, path, playback_speed=1.0):
+    """
+    Stream a wav file in a new conversation, without feedback or output.
+    :return: The durations of the query's phases, in milliseconds.
+    """
+    voysis_client.current_conversation_id = None
+    voysis_client.current_context = None
+    durations = {}
+    device = FileDevice()
+    device.playback_speed = playback_speed
+    with open(path, 'rb') as wav_file:
+        device.wav_file = wav_file
+        recording_stopper = RecordingStopper(device, time(), durations, verbose=False)
+        device.start_recording()
+        voysis_client.stream_audio(device.generate_frames(), notification_handler=recording_stopper.stop_recording,
+                                   audio_type=device.audio_type())
+        recording_stopper.stop_recording(None)
+    return durations
+
+
+def run_bench(url, corpus_dir, concurrency=1, qps=None, requests=None, playback_speed=1.0, report_file=None,
+              preprocess_files=False):
+    """
+    Replay a folder of wav files against the Query API and print latency
+    percentiles, throughput and error rate.
+    :return: The benchmark report.
+    """
+    paths = find_corpus(corpus_dir, preprocess_files)
+    if not paths:
+        raise ValueError('No wav files found in {}'.format(corpus_dir))
+    pooled = url.startswith('ws://') or url.startswith('wss://')
+    benchmark = bench.Benchmark(lambda: client_factory(url), concurrency=concurrency, qps=qps, pooled=pooled)
+    report = benchmark.run(paths, lambda bench_client, path: bench_query(bench_client, path, playback_speed),
+                           requests=requests)
+    report['url'] = url
+    print(bench.format_report(report))
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    return report
+
+
+def replay_session(voysis_client, session_file, speed=1.0):
+    """
+    Send the audio of every query recorded in +session_file+ again.
+    :return: A list with the outcome of each query, with its latency now
+             and when it was recorded.
+    """
+    replayed = session_log.SessionReplayer(session_log.recorded_queries(session_file), speed).replay(voysis_client)
+    for outcome in replayed:
+        if 'error' in outcome:
+            outcome['error'] = str(outcome['error'])
+    return replayed
+
+
 def feedback(voysis_client, query_id, rating, description):
     feedback_result = voysis_client.send_feedback(query_id, rating, description)
     return json.dumps(feedback_result, indent=4, sort_keys=True)
@@ -187,7 +329,7 @@ def write_context(context, saved_context_file):
 
 def create_parser():
     parser = argparse.ArgumentParser()
-    subparser = parser.add_subparsers(dest='subcommand', title='subcommands', description='query, feedback')
+    subparser = parser.add_subparsers(dest='subcommand', title='subcommands', description='query, feedback, bench, replay')
     parser.add_argument("-u",
                         "--url",
                         dest="url", metavar="str", type=str,
@@ -225,6 +367,35 @@ def create_parser():
                         help="Sends all the wav files from a folder",
                         metavar="DIR",
                         type=lambda x: valid_folder(parser, x))
+    query_parser.add_argument("--concurrency",
+                              help="The number of files to stream at the same time in batch mode.",
+                              default=1,
+                              type=int)
+    query_parser.add_argument("--retries",
+                              help="The number of times to retry a file that fails in batch mode.",
+                              default=0,
+                              type=int)
+    query_parser.add_argument("--unordered",
+                              help="Print batch results as they complete, rather than in file order.",
+                              default=False,
+                              action='store_true')
+    query_parser.add_argument("--preprocess",
+                              help="In batch mode, trim silence from and normalise the files before streaming "
+                                   "them. Trimmed copies are cached beside the originals.",
+                              default=False,
+                              action='store_true')
+    query_parser.add_argument("--result-cache",
+                              dest="result_cache_dir", metavar="dir",
+                              help="Answer queries for audio files that have been sent before from a cache of "
+                                   "results in this folder, rather than sending them again.")
+    query_parser.add_argument("--session-log",
+                              dest="session_log_file", metavar="FILE",
+                              help="Append everything sent and received over WebSocket to this session log, for "
+                                   "replaying later.")
+    query_parser.add_argument("--trace",
+                              help="Log the timing of each phase of each query.",
+                              default=False,
+                              action='store_true')
     query_parser.add_argument("-r",
                         "--record",
                         help="Record from mic and send audio stream. Values: {}, {}, {}".format(MICROPHONE,
@@ -241,6 +412,48 @@ def create_parser():
                         type=lambda x: valid_rating(parser, int(x)))
     feedback_parser.add_argument("--description",
                         help="Set a text description to go with the rating in the feedback request. Optional.")
+    bench_parser = subparser.add_parser('bench', help='Replay a folder of wav files and report latency percentiles.')
+    bench_parser.add_argument("corpus_dir",
+                              help="The folder of wav files to replay.",
+                              metavar="DIR",
+                              type=lambda x: valid_folder(parser, x))
+    bench_parser.add_argument("--concurrency",
+                              help="The number of queries in flight at once. In open-loop mode, the most that "
+                                   "may be in flight.",
+                              default=1,
+                              type=int)
+    bench_parser.add_argument("--qps",
+                              help="Start queries at this fixed rate (open loop), rather than as soon as the "
+                                   "previous query completes (closed loop).",
+                              type=float)
+    bench_parser.add_argument("--requests",
+                              help="The number of queries to send, cycling through the corpus. Defaults to one "
+                                   "per file.",
+                              type=int)
+    bench_parser.add_argument("--playback-speed",
+                              dest="playback_speed",
+                              help="Stream audio at this multiple of real time (0 for as fast as possible).",
+                              default=1.0,
+                              type=float)
+    bench_parser.add_argument("--preprocess",
+                              help="Trim silence from and normalise the files before replaying them. Trimmed "
+                                   "copies are cached beside the originals.",
+                              default=False,
+                              action='store_true')
+    bench_parser.add_argument("--report",
+                              dest="report_file",
+                              help="Write the report as JSON to this file.",
+                              metavar="FILE")
+    replay_parser = subparser.add_parser('replay', help='Send the audio of the queries in a session log again, with '
+                                                        'its recorded timing.')
+    replay_parser.add_argument("session_file",
+                               help="The session log to replay, as written by query --session-log.",
+                               metavar="FILE",
+                               type=lambda x: valid_file_path(parser, x))
+    replay_parser.add_argument("--speed",
+                               help="Send audio at this multiple of its recorded pace (0 for as fast as possible).",
+                               default=1.0,
+                               type=float)
 
     return parser
 
@@ -253,6 +466,7 @@ def main():
         saved_context = read_context('context.json')
         url = args.url if args.url else config.get(config.GENERAL, 'url', None)
         voysis_client = client_factory(url)
+        failures = 0
         if args.subcommand == 'feedback':
             query_id = args.query_id if args.query_id else saved_context[url]['queryId']
             if not query_id:
@@ -262,29 +476,52 @@ def main():
             response = feedback(voysis_client, query_id, args.rating, args.description)
             print(response)
         elif args.subcommand == 'query':
-            if args.continue_conversation:
-                voysis_client.current_conversation_id = saved_context[url]['conversationId']
-            if args.use_context:
-                voysis_client.current_context = saved_context[url]['context'].copy()
-            if not args.wav_dir:
-                response, query_id, conversation_id = stream(voysis_client, args.wav_fh, args.record)
-                json.dump(response, sys.stdout, indent=4)
-                saved_context[url]['conversationId'] = conversation_id
-                saved_context[url]['queryId'] = query_id
-                saved_context[url]['context'] = voysis_client.current_context
-                write_context(saved_context, 'context.json')
-            else:
-                for root, dirs, files in os.walk(args.wav_dir):
-                    log.info('Streaming files from folder {} over {}'.format(args.wav_dir, args.api_flavour))
-                    for file in files:
-                        if file.endswith('.wav'):
-                            file_path = os.path.join(args.wav_dir, file)
-                            log.info('Streaming {}'.format(file_path))
-                            response, query_id, conversation_id = stream(voysis_client, open(file_path, 'rb'))
-                            json.dump(response, sys.stdout, indent=4)
+            query_result_cache = None
+            session_recorder = None
+            if args.session_log_file:
+                session_recorder = session_log.SessionRecorder(args.session_log_file)
+            if args.result_cache_dir:
+                query_result_cache = result_cache.ResultCache(args.result_cache_dir)
+                config.apply_config(query_result_cache, 'result_cache')
+
+            def apply_saved_context(query_client):
+                if args.continue_conversation:
+                    query_client.current_conversation_id = saved_context[url]['conversationId']
+                if args.use_context:
+                    query_client.current_context = saved_context[url]['context'].copy()
+                if args.trace:
+                    query_client.tracer = tracing.LogTracer()
+                query_client.result_cache = query_result_cache
+                if session_recorder and hasattr(query_client, 'session_recorder'):
+                    query_client.session_recorder = session_recorder
+            apply_saved_context(voysis_client)
+            try:
+                if not args.wav_dir:
+                    response, query_id, conversation_id = stream(voysis_client, args.wav_fh, args.record)
+                    json.dump(response, sys.stdout, indent=4)
+                    saved_context[url]['conversationId'] = conversation_id
+                    saved_context[url]['queryId'] = query_id
+                    saved_context[url]['context'] = voysis_client.current_context
+                    write_context(saved_context, 'context.json')
+                else:
+                    failures = stream_batch(url, args.wav_dir, concurrency=args.concurrency,
+                                            retries=args.retries, ordered=not args.unordered,
+                                            client_setup=apply_saved_context, preprocess_files=args.preprocess)
+            finally:
+                if session_recorder:
+                    session_recorder.close()
+        elif args.subcommand == 'bench':
+            run_bench(url, args.corpus_dir, concurrency=args.concurrency, qps=args.qps, requests=args.requests,
+                      playback_speed=args.playback_speed, report_file=args.report_file,
+                      preprocess_files=args.preprocess)
+        elif args.subcommand == 'replay':
+            json.dump(replay_session(voysis_client, args.session_file, args.speed), sys.stdout, indent=4)
         else:
             raise ValueError('Unsupported subcommand.')
         voysis_client.close()
+        if failures:
+            log.error('{} files failed'.format(failures))
+            raise SystemExit(1)
     except ClientError as client_error:
         log.error(client_error.message)
     except Exception as e:
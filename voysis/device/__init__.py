@@ -1 +1 @@
-__all__ = ["device", "file_device", "mic_device"]
\ No newline at end of file
+__all__ = ["device", "encoder", "file_device", "mic_device", "pacing", "preprocess", "ring_buffer", "vad", "wav"]
\ No newline at end of file
@@ -0,0 +1,445 @@
+"""
+Audio encoders that compress raw PCM frames before they are sent to the
+Query API. Encoders take the frames produced by Device.generate_frames
+and yield encoded frames, and report the Content-Type of their output.
+
+Run this module to print encoder throughput and compression figures:
+
+    python -m voysis.device.encoder [file.wav]
+"""
+import abc
+import sys
+import time
+
+import numpy as np
+import six
+
+from voysis.device import wav as wav
+
+PCM = 'pcm'
+FLAC = 'flac'
+MULAW = 'mulaw'
+
+
+def parse_audio_type(audio_type):
+    """
+    Parse a raw PCM Content-Type such as 'audio/pcm;bits=16;rate=16000'.
+    :param audio_type: The Content-Type string.
+    :return: A dict with 'mime_type', 'bits', 'rate' and 'channels' keys,
+             or None if +audio_type+ is not raw PCM.
+    """
+    parts = [part.strip() for part in audio_type.split(';')]
+    if parts[0].lower() != 'audio/pcm':
+        return None
+    params = dict(part.split('=', 1) for part in parts[1:] if '=' in part)
+    return {
+        'mime_type': parts[0],
+        'bits': int(params.get('bits', 16)),
+        'rate': int(params.get('rate', 16000)),
+        'channels': int(params.get('channels', 1))
+    }
+
+
+def encoder_factory(encoding, audio_type):
+    """
+    Create an encoder for +encoding+ that accepts audio of +audio_type+.
+    Audio that is not 16-bit PCM is passed through unchanged, since it
+    is already in a format the encoders can't improve on.
+    :param encoding: One of PCM, FLAC or MULAW.
+    :param audio_type: The Content-Type of the audio produced by the device.
+    :return: An Encoder instance
+    """
+    pcm_format = parse_audio_type(audio_type)
+    if not pcm_format or pcm_format['bits'] != 16 or encoding == PCM:
+        return PassThroughEncoder(audio_type)
+    if encoding == FLAC:
+        return FlacEncoder(pcm_format['rate'], pcm_format['channels'])
+    if encoding == MULAW:
+        return MuLawEncoder(pcm_format['rate'], pcm_format['channels'])
+    raise ValueError('Unsupported audio encoding {}'.format(encoding))
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Encoder(object):
+
+    @abc.abstractmethod
+    def audio_type(self):
+        """
+        The Content-Type of the encoded audio.
+        """
+        pass
+
+    @abc.abstractmethod
+    def encode(self, frame):
+        """
+        Encode a frame of audio. Encoders may buffer input, so the result
+        can be empty.
+        :param frame: A bytes-like object of 16-bit little-endian samples.
+        :return: The encoded bytes available so far.
+        """
+        pass
+
+    def flush(self):
+        """
+        Encode any buffered input at the end of the stream.
+        :return: The remaining encoded bytes.
+        """
+        return b''
+
+    def encode_frames(self, frames_generator):
+        for frame in frames_generator:
+            encoded = self.encode(frame)
+            if encoded:
+                yield encoded
+        encoded = self.flush()
+        if encoded:
+            yield encoded
+
+
+class PassThroughEncoder(Encoder):
+
+    def __init__(self, audio_type):
+        self._audio_type = audio_type
+
+    def audio_type(self):
+        return self._audio_type
+
+    def encode(self, frame):
+        return frame
+
+    def encode_frames(self, frames_generator):
+        return frames_generator
+
+
+class _SampleBuffer(object):
+    """
+    Collects whole 16-bit sample frames from byte chunks of any length.
+    """
+
+    def __init__(self, channels):
+        self._frame_bytes = 2 * channels
+        self._channels = channels
+        self._pending = b''
+
+    def add(self, frame):
+        data = self._pending + bytes(frame) if self._pending else frame
+        usable = len(data) - len(data) % self._frame_bytes
+        self._pending = bytes(data[usable:])
+        samples = np.frombuffer(data, dtype='<i2', count=usable // 2)
+        return samples.reshape(-1, self._channels)
+
+
+class MuLawEncoder(Encoder):
+    """
+    G.711 mu-law companding: 8 bits per sample, half the size of 16-bit
+    PCM, at a small loss of quality. Cheap enough for any device.
+    """
+    _BIAS = 0x21
+    _CLIP = 8159
+
+    def __init__(self, rate=16000, channels=1):
+        self._rate = rate
+        self._channels = channels
+        self._buffer = _SampleBuffer(channels)
+
+    def audio_type(self):
+        return 'audio/pcmu;rate={}'.format(self._rate)
+
+    def encode(self, frame):
+        # The CCITT reference algorithm, on 14-bit magnitudes.
+        samples = self._buffer.add(frame).ravel().astype(np.int32) >> 2
+        negative = samples < 0
+        magnitude = np.minimum(np.where(negative, -samples, samples), self._CLIP) + self._BIAS
+        segment = np.maximum(np.frexp(magnitude)[1] - 6, 0)
+        code = np.where(segment > 7, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+        return (code ^ np.where(negative, 0x7F, 0xFF)).astype(np.uint8).tobytes()
+
+
+class FlacEncoder(Encoder):
+    """
+    A streaming FLAC encoder for 16-bit PCM. Each block is coded with the
+    best fixed linear predictor and partitioned Rice coding of the
+    residual, which is lossless and typically sends speech at around half
+    the size of raw PCM. The stream header leaves the total sample count
+    and MD5 signature unset, as allowed for streams of unknown length.
+    """
+
+    def __init__(self, rate=16000, channels=1, block_size=4096, max_partition_order=4):
+        self._rate = rate
+        self._channels = channels
+        self._block_size = block_size
+        self._max_partition_order = max_partition_order
+        self._buffer = _SampleBuffer(channels)
+        self._pending = np.zeros((0, channels), dtype=np.int32)
+        self._frame_number = 0
+        self._header_sent = False
+
+    def audio_type(self):
+        return 'audio/flac'
+
+    def encode(self, frame):
+        samples = self._buffer.add(frame)
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        whole_blocks = len(samples) - len(samples) % self._block_size
+        encoded = [self._stream_header()]
+        for start in range(0, whole_blocks, self._block_size):
+            encoded.append(self._encode_block(samples[start:start + self._block_size]))
+        self._pending = samples[whole_blocks:].astype(np.int32)
+        return b''.join(encoded)
+
+    def flush(self):
+        encoded = [self._stream_header()]
+        if len(self._pending):
+            encoded.append(self._encode_block(self._pending))
+            self._pending = self._pending[:0]
+        return b''.join(encoded)
+
+    def _stream_header(self):
+        if self._header_sent:
+            return b''
+        self._header_sent = True
+        bits = _BitWriter()
+        bits.write(1, 1)
+        bits.write(0, 7)
+        bits.write(34, 24)
+        bits.write(self._block_size, 16)
+        bits.write(self._block_size, 16)
+        bits.write(0, 24)
+        bits.write(0, 24)
+        bits.write(self._rate, 20)
+        bits.write(self._channels - 1, 3)
+        bits.write(15, 5)
+        bits.write(0, 36)
+        bits.write(0, 64)
+        bits.write(0, 64)
+        return b'fLaC' + bits.to_bytes()
+
+    def _encode_block(self, block):
+        block = block.astype(np.int64)
+        block_size = len(block)
+        bits = _BitWriter()
+        block_size_code = _BLOCK_SIZE_CODES.get(block_size)
+        bits.write(0xFFF8, 16)
+        bits.write(block_size_code if block_size_code else 0b0111, 4)
+        bits.write(0, 4)
+        bits.write(self._channels - 1, 4)
+        bits.write(0b100, 3)
+        bits.write(0, 1)
+        bits.write_bytes(_utf8_coded(self._frame_number))
+        if not block_size_code:
+            bits.write(block_size - 1, 16)
+        bits.write_bytes(bytes([_crc8(bits.to_bytes())]))
+        for channel in range(self._channels):
+            self._encode_subframe(bits, block[:, channel])
+        frame = bits.to_bytes()
+        self._frame_number += 1
+        return frame + _crc16(frame).to_bytes(2, 'big')
+
+    def _encode_subframe(self, bits, samples):
+        if np.all(samples == samples[0]):
+            bits.write(0, 8)
+            bits.write_signed(int(samples[0]), 16)
+            return
+        order, residual = _best_fixed_predictor(samples)
+        bits.write(0b00010000 | (order << 1), 8)
+        bits.write_signed_array(samples[:order], 16)
+        folded = np.where(residual >= 0, residual << 1, ((-residual) << 1) - 1)
+        partition_order, parameters = self._choose_rice_partitions(folded, len(samples), order)
+        bits.write(0, 2)
+        bits.write(partition_order, 4)
+        partition_size = len(samples) >> partition_order
+        start = 0
+        for partition, parameter in enumerate(parameters):
+            end = (partition + 1) * partition_size - order
+            bits.write(int(parameter), 4)
+            bits.write_rice(folded[start:end], int(parameter))
+            start = end
+
+    def _choose_rice_partitions(self, folded, block_size, order):
+        best = None
+        for partition_order in range(self._max_partition_order + 1):
+            partitions = 1 << partition_order
+            if block_size % partitions or (block_size >> partition_order) <= order:
+                break
+            boundaries = np.arange(1, partitions) * (block_size >> partition_order) - order
+            parameters = []
+            total_bits = 0
+            for values in np.split(folded, boundaries):
+                cost = _rice_costs(values)
+                parameter = int(np.argmin(cost))
+                parameters.append(parameter)
+                total_bits += int(cost[parameter]) + 4
+            if best is None or total_bits < best[0]:
+                best = (total_bits, partition_order, parameters)
+        return best[1], best[2]
+
+
+_BLOCK_SIZE_CODES = dict((256 << n, 8 + n) for n in range(8))
+_RICE_PARAMETERS = np.arange(15, dtype=np.int64)
+
+
+def _rice_costs(values):
+    """
+    The number of bits needed to Rice code +values+ with each parameter
+    from 0 to 14.
+    """
+    return (values[None, :] >> _RICE_PARAMETERS[:, None]).sum(axis=1) + len(values) * (_RICE_PARAMETERS + 1)
+
+
+def _best_fixed_predictor(samples):
+    best_order = 0
+    best_residual = samples
+    best_cost = np.abs(samples).sum()
+    residual = samples
+    for order in range(1, min(4, len(samples) - 1) + 1):
+        residual = np.diff(residual)
+        cost = np.abs(residual).sum()
+        if cost < best_cost:
+            best_order, best_residual, best_cost = order, residual, cost
+    return best_order, best_residual
+
+
+class _BitWriter(object):
+    """
+    Accumulates a big-endian bit stream as arrays of bits, so that whole
+    arrays of residuals can be written with vectorised operations.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, value, bit_count):
+        shifts = np.arange(bit_count - 1, -1, -1, dtype=np.uint64)
+        self._append(((np.uint64(value) >> shifts) & np.uint64(1)).astype(np.uint8))
+
+    def write_signed(self, value, bit_count):
+        self.write(value & ((1 << bit_count) - 1), bit_count)
+
+    def write_signed_array(self, values, bit_count):
+        if len(values):
+            shifts = np.arange(bit_count - 1, -1, -1, dtype=np.int64)
+            masked = np.asarray(values, dtype=np.int64) & ((1 << bit_count) - 1)
+            self._append(((masked[:, None] >> shifts) & 1).astype(np.uint8).ravel())
+
+    def write_bytes(self, data):
+        self._append(np.unpackbits(np.frombuffer(data, dtype=np.uint8)))
+
+    def write_rice(self, folded, parameter):
+        if not len(folded):
+            return
+        quotients = folded >> parameter
+        lengths = quotients + 1 + parameter
+        starts = np.concatenate(([0], np.cumsum(lengths[:-1])))
+        stream = np.zeros(int(lengths.sum()), dtype=np.uint8)
+        stop_bits = starts + quotients
+        stream[stop_bits] = 1
+        if parameter:
+            shifts = np.arange(parameter - 1, -1, -1, dtype=np.int64)
+            remainders = (folded[:, None] >> shifts) & 1
+            positions = stop_bits[:, None] + 1 + np.arange(parameter)
+            stream[positions.ravel()] = remainders.ravel()
+        self._append(stream)
+
+    def to_bytes(self):
+        stream = np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=np.uint8)
+        return np.packbits(stream).tobytes()
+
+    def _append(self, bits):
+        self._chunks.append(bits)
+
+
+def _utf8_coded(value):
+    if value < 0x80:
+        return bytes([value])
+    byte_count = 2
+    while value >= 1 << (5 * byte_count + 1):
+        byte_count += 1
+    coded = []
+    for _ in range(byte_count - 1):
+        coded.insert(0, 0x80 | (value & 0x3F))
+        value >>= 6
+    coded.insert(0, ((0xFF00 >> byte_count) & 0xFF) | value)
+    return bytes(coded)
+
+
+def _crc_table(polynomial, width):
+    top_bit = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) if crc & top_bit else (crc << 1)
+        table.append(crc & mask)
+    return table
+
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def benchmark(audio, rate=16000, chunk_size=1024, encodings=(MULAW, FLAC)):
+    """
+    Measure the throughput and compression of each encoder on +audio+.
+    :param audio: 16-bit mono PCM bytes.
+    :return: A list of result dicts, one per encoding.
+    """
+    audio_type = 'audio/pcm;bits=16;rate={}'.format(rate)
+    audio_seconds = len(audio) / float(2 * rate)
+    results = []
+    for encoding in encodings:
+        audio_encoder = encoder_factory(encoding, audio_type)
+        chunks = (audio[i:i + chunk_size] for i in range(0, len(audio), chunk_size))
+        start = time.time()
+        encoded_size = sum(len(encoded) for encoded in audio_encoder.encode_frames(chunks))
+        elapsed = time.time() - start
+        results.append({
+            'encoding': encoding,
+            'audioType': audio_encoder.audio_type(),
+            'ratio': encoded_size / float(len(audio)),
+            'kbitPerSecond': encoded_size * 8 / audio_seconds / 1000,
+            'realTimeFactor': audio_seconds / elapsed if elapsed else float('inf'),
+            'megabytesPerSecond': len(audio) / elapsed / 1e6 if elapsed else float('inf')
+        })
+    return results
+
+
+def main():
+    rate = 16000
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as wav_file:
+            wav_format = wav.read_wav_header(wav_file)
+            audio = wav_file.read(wav_format.data_size if wav_format and wav_format.data_size else -1)
+        if wav_format:
+            rate = wav_format.rate
+            if not wav.is_pcm16_mono(wav_format):
+                audio = wav.to_pcm16_mono(audio[:len(audio) - len(audio) % wav_format.block_align], wav_format)
+    else:
+        # Ten seconds of a tone in light noise, as a stand-in for speech.
+        t = np.arange(10 * rate) / float(rate)
+        signal = 3000 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t))
+        signal += np.random.normal(0, 200, len(t))
+        audio = np.clip(signal, -32768, 32767).astype('<i2').tobytes()
+    for result in benchmark(audio, rate):
+        print('{encoding:6} {ratio:6.3f} of PCM  {kbitPerSecond:7.1f} kbit/s  '
+              '{realTimeFactor:8.1f}x real time  {megabytesPerSecond:6.2f} MB/s'.format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,154 @@
-import datetime
-import sys
-import time
+import hashlib
+import io
+import mmap
 import voysis.config as config
+from voysis.device import wav as wav
 from voysis.device.device import Device
-
-if sys.version[0] == '2':
-    import Queue as queue
-else:
-    import queue
+from voysis.device.pacing import Pacer
 
 
 class FileDevice(Device):
+    """
+    A device that streams audio from a file. WAV files are parsed so that
+    only their sample data is sent. Sample data that is not 16-bit mono
+    PCM is converted as it is streamed, and audio_type() reports the
+    file's real sample rate. Files without a RIFF header are sent as they
+    are, and are assumed to hold 16-bit 16kHz mono PCM.
+
+    Chunks are paced to the audio's real duration, scaled by
+    +playback_speed+ (0 sends as fast as possible). If
+    +time_between_chunks+ is set, chunks are instead sent at that fixed
+    interval.
+    """
+
     def __init__(self, wav_file=None):
         Device.__init__(self)
-        self.time_between_chunks = config.get_float(config.GENERAL, 'time_between_chunks', 0.08)
-        self._queue = queue.Queue()
-        self._last_chunk_time = datetime.datetime.utcfromtimestamp(0)
+        self.time_between_chunks = config.get_float(config.GENERAL, 'time_between_chunks', None)
+        self.playback_speed = config.get_float(config.GENERAL, 'playback_speed', 1.0)
+        self._recording = False
+        self._mapped_file = None
+        self._wav_format = None
+        self._format_file = None
         self.wav_file = wav_file
 
     def start_recording(self):
-        self._queue.queue.clear()
-        self.wav_to_frames()
+        self._read_format()
+        self._mapped_file = self._map_file()
+        self._recording = True
 
     def stop_recording(self):
-        self._queue.queue.clear()
+        self._recording = False
 
     def is_recording(self):
-        return not(self._queue.empty())
+        return self._recording
 
     def generate_frames(self):
-        while not self._queue.empty():
-            data = self._queue.get_nowait()
-            if data:
-                now = datetime.datetime.utcnow()
-                seconds_since_last = (now - self._last_chunk_time).total_seconds()
-                if seconds_since_last < self.time_between_chunks:
-                    time.sleep(self.time_between_chunks - seconds_since_last)
-                self._last_chunk_time = now
+        pacer = self.create_pacer()
+        try:
+            for data in self.wav_to_frames():
+                if not self._recording:
+                    break
+                pacer.wait(len(data))
                 yield data
+        finally:
+            self._recording = False
 
     def wav_to_frames(self):
-        while True:
-            data = self.wav_file.read(self.chunk_size)
-            if not data:
-                break
-            self._queue.put(data)
+        """
+        Generate chunks of audio from the file on demand. Regular files are
+        memory mapped and, when no conversion is needed, chunks are
+        memoryview slices of the mapping, so nothing is copied or read
+        ahead of the stream. Other file objects are read one chunk at a
+        time.
+        """
+        wav_format = self._read_format()
+        if wav_format is None or wav.is_pcm16_mono(wav_format):
+            convert = None
+            read_size = self.chunk_size
+        else:
+            convert = wav.to_pcm16_mono
+            # Read whole sample frames that convert to about chunk_size bytes.
+            read_size = max(1, self.chunk_size // 2) * wav_format.block_align
+        for data in self._read_chunks(read_size, wav_format):
+            if convert:
+                data = data[:len(data) - len(data) % wav_format.block_align]
+                if not len(data):
+                    continue
+                data = convert(data, wav_format)
+            yield data
 
     def audio_type(self):
-        return 'audio/pcm;bits=16;rate=16000'
+        return 'audio/pcm;bits=16;rate={}'.format(self._sample_rate())
+
+    def audio_digest(self):
+        """
+        A digest of the file's audio, for looking its query up in a result
+        cache. It covers the sample data and format, but not the rest of
+        the WAV header, so files holding the same audio share a digest.
+        The file is left positioned at the start of the sample data.
+        :return: The SHA-256 digest as a hex string.
+        """
+        wav_format = self._read_format()
+        digest = hashlib.sha256()
+        if wav_format is not None:
+            digest.update('{0.format_tag},{0.channels},{0.rate},{0.bits};'.format(wav_format).encode('utf-8'))
+        start = self.wav_file.tell()
+        try:
+            for data in self._read_chunks(1 << 16, wav_format):
+                digest.update(data)
+        finally:
+            self.wav_file.seek(start)
+        return digest.hexdigest()
+
+    def create_pacer(self):
+        """
+        Create the Pacer used to deliver this file's audio.
+        """
+        return Pacer(
+            bytes_per_second=2 * self._sample_rate(),
+            speed=self.playback_speed,
+            interval=self.time_between_chunks
+        )
+
+    def _sample_rate(self):
+        wav_format = self._read_format()
+        return wav_format.rate if wav_format else 16000
+
+    def _read_chunks(self, read_size, wav_format):
+        start = self.wav_file.tell()
+        if wav_format is not None and wav_format.data_size is not None:
+            end = wav_format.data_offset + wav_format.data_size
+        else:
+            end = None
+        if self._mapped_file is not None:
+            data = memoryview(self._mapped_file)
+            end = len(data) if end is None else min(end, len(data))
+            for offset in range(start, end, read_size):
+                yield data[offset:min(offset + read_size, end)]
+        else:
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                data = self.wav_file.read(read_size if remaining is None else min(read_size, remaining))
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def _read_format(self):
+        """
+        Parse the WAV header of the current file, once per file. This leaves
+        the file positioned at the start of the sample data.
+        """
+        if self._format_file is not self.wav_file:
+            self._wav_format = wav.read_wav_header(self.wav_file) if self.wav_file else None
+            self._format_file = self.wav_file
+        return self._wav_format
+
+    def _map_file(self):
+        # The mapping is released when the last slice of it is dropped,
+        # since it can't be closed while slices are still in use.
+        try:
+            return mmap.mmap(self.wav_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, ValueError, OSError):
+            return None
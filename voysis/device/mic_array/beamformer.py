@@ -0,0 +1,129 @@
+"""
+A streaming delay-and-sum beamformer, which combines the channels of a
+microphone array into one channel focused on the direction of a speaker.
+"""
+import math
+
+import numpy as np
+
+SOUND_SPEED = 343.2
+OUTPUT_RATE = 16000
+
+
+def circular_array(count, diameter, first_angle=0.0, clockwise=False):
+    """
+    The positions of +count+ microphones evenly spaced around a circle.
+    :param diameter: The diameter of the circle, in metres.
+    :param first_angle: The angle of the first microphone, in degrees.
+    :param clockwise: Number the microphones clockwise rather than
+                      anticlockwise.
+    :return: An array of (x, y) positions, one row per microphone.
+    """
+    step = -360.0 / count if clockwise else 360.0 / count
+    angles = np.radians(first_angle + np.arange(count) * step)
+    return diameter / 2.0 * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+
+class DelayAndSumBeamformer(object):
+    """
+    Delays each channel so that sound arriving from the steered direction
+    lines up across the array, then averages them. Sound from the steered
+    direction adds up while sound from elsewhere partly cancels.
+
+    Each channel is filtered with a windowed-sinc FIR that applies its
+    fractional delay and, for input above 16kHz, a low-pass filter so the
+    output can be decimated to 16kHz. Filtering is done by overlap-save
+    in the frequency domain, in blocks, into buffers allocated up front.
+    The output lags the input by half the filter length.
+    """
+
+    def __init__(self, positions, channels, input_channels=None, rate=OUTPUT_RATE, taps=64, fft_size=512):
+        """
+        :param positions: The (x, y) position of each microphone in metres,
+                          one row per microphone.
+        :param channels: The index of each microphone's channel in the
+                         interleaved input.
+        :param input_channels: The number of interleaved input channels.
+                               Defaults to one more than the highest index
+                               in +channels+.
+        :param rate: The input sample rate. Must be a multiple of 16kHz.
+        :param taps: The length of each channel's filter.
+        :param fft_size: The transform size. Each block yields up to
+                         fft_size - taps + 1 input samples of output.
+        """
+        if rate % OUTPUT_RATE:
+            raise ValueError('Beamformer input rate {} is not a multiple of {}'.format(rate, OUTPUT_RATE))
+        self.positions = np.asarray(positions, dtype=float)
+        self.channels = list(channels)
+        self.input_channels = input_channels if input_channels else max(self.channels) + 1
+        self.rate = rate
+        self._decimation = rate // OUTPUT_RATE
+        self._taps = taps
+        self._fft_size = fft_size
+        valid = fft_size - taps + 1
+        self._block_size = valid - valid % self._decimation
+        if self._block_size <= 0:
+            raise ValueError('Beamformer fft_size must exceed taps')
+        mics = len(self.channels)
+        # The most recent fft_size input samples of each microphone.
+        self._history = np.zeros((mics, fft_size))
+        # Input samples collected towards the next block.
+        self._pending = np.zeros((mics, self._block_size))
+        self._pending_count = 0
+        self._filters = None
+        self.azimuth = None
+        self.steer(0.0)
+
+    def steer(self, azimuth):
+        """
+        Focus on sound arriving from +azimuth+ degrees, in the plane of the
+        array. Does nothing if +azimuth+ is None.
+        """
+        if azimuth is None or azimuth == self.azimuth:
+            return
+        self.azimuth = azimuth
+        angle = math.radians(azimuth)
+        direction = np.array([math.cos(angle), math.sin(angle)])
+        # Sound from +direction+ reaches microphones nearer the source
+        # first, so they are delayed the most to line up with the rest.
+        delays = self.positions.dot(direction) / SOUND_SPEED * self.rate
+        delays -= delays.min()
+        centre = (self._taps - 1) / 2.0 - delays.max() / 2.0
+        cutoff = 1.0 / self._decimation
+        offsets = np.arange(self._taps)[np.newaxis, :] - centre - delays[:, np.newaxis]
+        filters = cutoff * np.sinc(cutoff * offsets) * np.blackman(self._taps)[np.newaxis, :]
+        filters /= filters.sum(axis=1, keepdims=True) * len(self.channels)
+        self._filters = np.fft.rfft(filters, n=self._fft_size)
+
+    def process(self, frames):
+        """
+        Beamform a chunk of interleaved samples.
+        :param frames: Interleaved int16 samples, as bytes or an array,
+                       holding whole sample frames of +input_channels+.
+        :return: The 16kHz mono output available so far, as int16 samples.
+        """
+        if not isinstance(frames, np.ndarray):
+            frames = np.frombuffer(frames, dtype='<i2')
+        samples = frames.reshape(-1, self.input_channels)[:, self.channels].T
+        outputs = []
+        offset = 0
+        while offset < samples.shape[1]:
+            count = min(self._block_size - self._pending_count, samples.shape[1] - offset)
+            self._pending[:, self._pending_count:self._pending_count + count] = samples[:, offset:offset + count]
+            self._pending_count += count
+            offset += count
+            if self._pending_count == self._block_size:
+                outputs.append(self._process_block())
+                self._pending_count = 0
+        if not outputs:
+            return np.zeros(0, dtype='<i2')
+        return np.concatenate(outputs) if len(outputs) > 1 else outputs[0]
+
+    def _process_block(self):
+        block = self._block_size
+        history = self._history
+        history[:, :-block] = history[:, block:]
+        history[:, -block:] = self._pending
+        spectrum = np.einsum('mk,mk->k', np.fft.rfft(history), self._filters)
+        output = np.fft.irfft(spectrum, n=self._fft_size)[-block:][::self._decimation]
+        return np.clip(np.round(output), -32768, 32767).astype('<i2')
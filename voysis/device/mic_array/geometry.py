@@ -0,0 +1,79 @@
+"""
+The layouts of the supported microphone arrays. The beamformer and the
+direction estimate are both derived from the same layout, so the
+direction steered to is always the direction the layout says the sound
+came from.
+"""
+import numpy as np
+
+from voysis.device.mic_array.beamformer import SOUND_SPEED
+from voysis.device.mic_array.beamformer import DelayAndSumBeamformer
+from voysis.device.mic_array.beamformer import circular_array
+from voysis.device.mic_array.gcc_phat import gcc_phat_multi
+
+MIC_DISTANCE_6P1 = 0.064
+MIC_DISTANCE_4 = 0.08127
+
+
+class ArrayGeometry(object):
+    """
+    The microphone positions of an array, the interleaved channel each
+    microphone is recorded on, and the pairs of microphones whose offsets
+    locate a speaker.
+    """
+
+    def __init__(self, positions, channels, pairs, input_channels):
+        """
+        :param positions: The (x, y) position of each microphone in metres,
+                          one row per microphone.
+        :param channels: The index of each microphone's channel in the
+                         interleaved input.
+        :param pairs: (microphone, reference microphone) index pairs, as
+                      rows of +positions+. At least two pairs must lie
+                      along different lines.
+        :param input_channels: The number of interleaved input channels.
+        """
+        self.positions = np.asarray(positions, dtype=float)
+        self.channels = list(channels)
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.input_channels = input_channels
+        self._channel_pairs = [(self.channels[mic], self.channels[ref]) for mic, ref in self.pairs]
+        # Sound from the unit vector u reaches a microphone at p after
+        # -p.u / c, so a pair's offset is (p_ref - p_mic).u / c. Solving
+        # those for u over every pair gives the direction of the source.
+        baselines = np.array([self.positions[ref] - self.positions[mic] for mic, ref in self.pairs])
+        self._solver = np.linalg.pinv(baselines) * SOUND_SPEED
+        self.max_tdoa = np.max(np.linalg.norm(baselines, axis=1)) / SOUND_SPEED
+
+    def create_beamformer(self, rate):
+        """
+        :param rate: The input sample rate.
+        :return: A DelayAndSumBeamformer for this array.
+        """
+        return DelayAndSumBeamformer(self.positions, self.channels, input_channels=self.input_channels, rate=rate)
+
+    def get_direction(self, block, rate):
+        """
+        Estimate the direction of the loudest source.
+        :param block: A 2-D array of samples, one column per input channel.
+        :param rate: The sample rate.
+        :return: The azimuth of the source in degrees, in [0, 360), in the
+                 same frame as the microphone positions.
+        """
+        tau, _ = gcc_phat_multi(block, self._channel_pairs, fs=rate, max_tau=self.max_tdoa)
+        x, y = self._solver.dot(tau)
+        return float(np.degrees(np.arctan2(y, x)) % 360)
+
+
+# Channels 1-6 of the 6+1 array are the ring of microphones, and each pair
+# is a microphone and the one opposite it.
+RESPEAKER_6P1 = ArrayGeometry(circular_array(6, MIC_DISTANCE_6P1, first_angle=30), range(1, 7),
+                              [(0, 3), (1, 4), (2, 5)], input_channels=8)
+RESPEAKER_4 = ArrayGeometry(circular_array(4, MIC_DISTANCE_4, first_angle=90, clockwise=True), range(4),
+                            [(0, 2), (1, 3)], input_channels=4)
+
+# The supported arrays, by their number of input channels.
+GEOMETRIES = {
+    8: RESPEAKER_6P1,
+    4: RESPEAKER_4,
+}
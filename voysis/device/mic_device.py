@@ -1,35 +1,71 @@
-import sys
 import threading
 
+import glog as log
 import pyaudio
 
 import voysis.config as config
+from voysis import metrics as metrics
+from voysis.device import ring_buffer as ring_buffer
 from voysis.device.device import Device
 
-is_py2 = sys.version[0] == '2'
-if is_py2:
-    import Queue as Queue
-else:
-    import queue as Queue
+RECORDINGS = metrics.counter('voysis_mic_recordings', 'Microphone recordings made.')
+BUFFER_OVERRUNS = metrics.counter('voysis_mic_buffer_overruns',
+                                  'Captured chunks that did not fit in the microphone buffer.')
+BUFFER_DROPPED_BYTES = metrics.counter('voysis_mic_buffer_dropped_bytes',
+                                       'Bytes of captured audio lost to microphone buffer overruns.')
+BUFFER_UNDERRUNS = metrics.counter('voysis_mic_buffer_underruns',
+                                   'Reads that waited for the microphone to capture more audio.')
 
 
 class MicDevice(Device):
+    """
+    Records from a microphone. The PyAudio callback copies captured audio
+    into a preallocated ring buffer holding up to +buffer_seconds+ of
+    audio, and generate_frames blocks on the buffer until a chunk is
+    available. If the consumer falls behind, the +overflow+ policy
+    decides whether the oldest audio (overwrite) or the newest (drop) is
+    lost.
+
+    With +continuous+ set, the stream is opened once by start_capture and
+    kept running between recordings, overwriting the oldest audio while
+    nothing is recording. start_recording then costs no device open and
+    starts +pre_roll+ seconds in the past, so the start of a query spoken
+    just before recording began isn't lost. close releases the device.
+    """
+
     def __init__(self, client):
         Device.__init__(self)
         self.pyaudio_instance = pyaudio.PyAudio()
-        self.queue = Queue.Queue()
         self.quit_event = threading.Event()
         self.channels = config.get_int(config.MIC, 'channels', 1)
         self.sample_rate = config.get_int(config.MIC, 'sample_rate', 16000)
         self.audio_format = config.get_int(config.MIC, 'audio_format', pyaudio.paInt16)
+        self.buffer_seconds = config.get_float(config.MIC, 'buffer_seconds', 10.0)
+        self.overflow = config.get(config.MIC, 'overflow', ring_buffer.OVERWRITE)
+        self.continuous = config.get_boolean(config.MIC, 'continuous', False)
+        self.pre_roll = config.get_float(config.MIC, 'pre_roll', 0.3)
         self.client = client
         self.device_index = None
+        self.stream = None
+        self.ring_buffer = None
 
     def _callback(self, in_data, frame_count, time_info, status):
-        self.queue.put(in_data)
+        if self.quit_event.is_set():
+            # Between recordings only the most recent audio is wanted.
+            self.ring_buffer.write(in_data, ring_buffer.OVERWRITE)
+        else:
+            self.ring_buffer.write(in_data)
         return None, pyaudio.paContinue
 
-    def start_recording(self):
+    def start_capture(self):
+        """
+        Open and start the stream if it isn't already running, without
+        starting a recording.
+        """
+        if self.stream is not None:
+            return
+        self.quit_event.set()
+        self._create_ring_buffer()
         self.stream = self.pyaudio_instance.open(
             input=True,
             start=False,
@@ -40,35 +76,78 @@ class MicDevice(Device):
             stream_callback=self._callback,
             input_device_index=self.device_index
         )
-        self.quit_event.clear()
-        self.queue.queue.clear()
         self.stream.start_stream()
 
+    def start_recording(self):
+        if self.continuous and self.stream is not None:
+            frame_bytes = self.channels * pyaudio.get_sample_size(self.audio_format)
+            pre_roll_frames = int(self.pre_roll * self.sample_rate)
+            self.ring_buffer.clear(keep=pre_roll_frames * frame_bytes)
+        else:
+            self.start_capture()
+        self.quit_event.clear()
+        RECORDINGS.inc()
+
     def stop_recording(self):
-        self.stream.stop_stream()
+        was_recording = self.is_recording()
+        self.quit_event.set()
+        if not self.continuous:
+            self.close()
+        if was_recording and self.ring_buffer:
+            # The buffer's counters cover this recording alone.
+            BUFFER_OVERRUNS.inc(self.ring_buffer.overruns)
+            BUFFER_DROPPED_BYTES.inc(self.ring_buffer.dropped_bytes)
+            BUFFER_UNDERRUNS.inc(self.ring_buffer.underruns)
+            if self.ring_buffer.overruns:
+                log.warning('Microphone buffer overran {} times, losing {} bytes of audio'.format(
+                    self.ring_buffer.overruns, self.ring_buffer.dropped_bytes))
+
+    def close(self):
+        """
+        Stop and close the stream, waking any blocked reader.
+        """
         self.quit_event.set()
+        stream = self.stream
+        self.stream = None
+        if stream:
+            stream.stop_stream()
+            stream.close()
+        if self.ring_buffer:
+            self.ring_buffer.close()
 
     def is_recording(self):
         return not(self.quit_event.is_set())
 
     def generate_frames(self):
         self.quit_event.clear()
-        try:
-            while not self.quit_event.is_set():
-                try:
-                    frames = self.queue.get(block=False)
-                    if not frames:
-                        break
-                    yield frames
-                except Queue.Empty:
-                    pass
-        except StopIteration:
-            self.stream.close()
-            self.pyaudio_instance.terminate()
-            raise
-        raise StopIteration()
+        while not self.quit_event.is_set():
+            frames = self.read_chunk()
+            if frames:
+                yield frames
+
+    def read_chunk(self, timeout=0.1):
+        """
+        Wait for the next chunk of captured audio.
+        :return: The chunk, or None if none arrived within +timeout+ seconds
+                 or recording has stopped.
+        """
+        return self.ring_buffer.read(self._chunk_bytes(), timeout) or None
 
     def audio_type(self):
         return "audio/pcm;bits={};rate={}".format(
             pyaudio.get_sample_size(self.audio_format) * 8,
             self.sample_rate)
+
+    def _chunk_bytes(self):
+        return self.chunk_size * self.channels * pyaudio.get_sample_size(self.audio_format)
+
+    def _create_ring_buffer(self):
+        bytes_per_second = self.sample_rate * self.channels * pyaudio.get_sample_size(self.audio_format)
+        # A whole number of chunks, so overwriting never splits a sample frame.
+        chunks = max(int(self.buffer_seconds * bytes_per_second) // self._chunk_bytes(), 2)
+        capacity = chunks * self._chunk_bytes()
+        if self.ring_buffer is None or self.ring_buffer.capacity != capacity or \
+                self.ring_buffer.overflow != self.overflow:
+            self.ring_buffer = ring_buffer.RingBuffer(capacity, self.overflow)
+        else:
+            self.ring_buffer.clear()
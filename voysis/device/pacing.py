@@ -0,0 +1,69 @@
+import time
+
+REAL_TIME = 1.0
+UNTHROTTLED = 0.0
+
+
+class Pacer(object):
+    """
+    Paces the delivery of audio chunks against a monotonic clock. Each
+    chunk's deadline is computed from the total audio delivered since the
+    first chunk, rather than from the previous chunk, so oversleeping on
+    one chunk is made up on the next and no drift accumulates.
+
+    In rate mode, a chunk is released when the audio it contains would
+    have finished being captured by a microphone running +speed+ times
+    faster than real time. In interval mode, chunks are released every
+    +interval+ seconds regardless of their length.
+    """
+
+    def __init__(self, bytes_per_second=32000, speed=REAL_TIME, interval=None, clock=None, sleep=None):
+        """
+        :param bytes_per_second: The byte rate of the audio at real time.
+        :param speed: A multiple of real time. UNTHROTTLED (0) sends as
+                      fast as possible.
+        :param interval: A fixed number of seconds between chunks. Takes
+                         precedence over +speed+ when set.
+        """
+        self.bytes_per_second = bytes_per_second
+        self.speed = speed
+        self.interval = interval
+        self._clock = clock if clock else time.monotonic
+        self._sleep = sleep if sleep else time.sleep
+        self._start = None
+        self._bytes = 0
+        self._chunks = 0
+
+    def wait(self, chunk_length):
+        """
+        Block until a chunk of +chunk_length+ bytes is due.
+        :return: The time the chunk was due, on the pacer's clock.
+        """
+        now = self._clock()
+        if self._start is None:
+            self._start = now
+        self._bytes += chunk_length
+        self._chunks += 1
+        if self.interval:
+            deadline = self._start + (self._chunks - 1) * self.interval
+        elif self.speed and self.speed > 0:
+            deadline = self._start + self._bytes / (self.bytes_per_second * self.speed)
+        else:
+            return now
+        delay = deadline - now
+        if delay > 0:
+            self._sleep(delay)
+        return deadline
+
+    def lag(self):
+        """
+        How far behind schedule delivery is, in seconds. Positive values
+        mean the consumer is slower than the pacing rate.
+        """
+        if self._start is None or not (self.interval or self.speed):
+            return 0.0
+        if self.interval:
+            due = self._start + (self._chunks - 1) * self.interval
+        else:
+            due = self._start + self._bytes / (self.bytes_per_second * self.speed)
+        return max(0.0, self._clock() - due)
@@ -0,0 +1,166 @@
+"""
+Offline preparation of recorded audio for replay. Leading and trailing
+silence is trimmed and levels are normalised, and the result is cached as
+a 16-bit mono WAV beside the source file, so a corpus is prepared once and
+every later replay streams only the audio that matters.
+
+Run this module to prepare every wav file under a folder:
+
+    python -m voysis.device.preprocess [--force] /path/to/wav/folder
+"""
+import argparse
+import os
+import stat
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import glog as log
+import numpy as np
+
+from voysis.device import wav as wav
+
+TRIMMED_SUFFIX = '.trimmed.wav'
+
+
+def trim_silence(samples, rate, frame_duration=0.02, threshold_db=15.0, min_level_db=-55.0, padding=0.2):
+    """
+    Remove the silence before the first and after the last loud frame.
+    A frame is loud if it is +threshold_db+ above the noise floor, taken
+    as the 10th percentile of frame levels, and above +min_level_db+ dBFS.
+    :param samples: A 1-D array of 16-bit samples.
+    :param rate: The sample rate.
+    :param padding: Seconds of audio to keep either side of the loud frames.
+    :return: The trimmed samples. Samples with no loud frame are returned
+             unchanged, rather than trimmed to nothing.
+    """
+    frame_samples = max(1, int(rate * frame_duration))
+    frame_count = len(samples) // frame_samples
+    if not frame_count:
+        return samples
+    frames = samples[:frame_count * frame_samples].reshape(frame_count, frame_samples) / 32768.0
+    levels = 10.0 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    noise_db = np.percentile(levels, 10)
+    loud = np.flatnonzero((levels > noise_db + threshold_db) & (levels > min_level_db))
+    if not len(loud):
+        return samples
+    pad = int(rate * padding)
+    start = max(0, loud[0] * frame_samples - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame_samples + pad)
+    return samples[start:end]
+
+
+def normalise(samples, peak_db=-1.0, max_gain_db=20.0):
+    """
+    Scale samples so that their peak is at +peak_db+ dBFS, boosting by no
+    more than +max_gain_db+ so that near-silent files keep their level.
+    :param samples: A 1-D array of 16-bit samples.
+    :return: The scaled samples as 16-bit integers.
+    """
+    peak = np.max(np.abs(samples.astype(np.int32))) if len(samples) else 0
+    if not peak:
+        return samples.astype('<i2')
+    gain = min(32767.0 * 10.0 ** (peak_db / 20.0) / peak, 10.0 ** (max_gain_db / 20.0))
+    return np.clip(np.round(samples * gain), -32768, 32767).astype('<i2')
+
+
+def trimmed_path(path):
+    """
+    The path at which the prepared copy of +path+ is cached.
+    """
+    root, _ = os.path.splitext(path)
+    return root + TRIMMED_SUFFIX
+
+
+def preprocess_file(path, force=False):
+    """
+    Trim and normalise a wav file, caching the result beside it. The cached
+    copy is reused until the source is modified.
+    :param path: The wav file to prepare.
+    :param force: Prepare the file even if a cached copy is up to date.
+    :return: The path of the prepared file.
+    """
+    output_path = trimmed_path(path)
+    if (not force and os.path.exists(output_path) and
+            os.path.getmtime(output_path) >= os.path.getmtime(path)):
+        return output_path
+    with open(path, 'rb') as wav_file:
+        wav_format = wav.read_wav_header(wav_file)
+        data = wav_file.read(wav_format.data_size if wav_format and wav_format.data_size is not None else -1)
+    if wav_format is None:
+        rate = 16000
+    else:
+        rate = wav_format.rate
+        data = data[:len(data) - len(data) % wav_format.block_align]
+        if not wav.is_pcm16_mono(wav_format):
+            data = wav.to_pcm16_mono(data, wav_format)
+    samples = np.frombuffer(data, dtype='<i2', count=len(data) // 2)
+    samples = normalise(trim_silence(samples, rate))
+    # Write to a temporary file first, so that an interrupted run never
+    # leaves a truncated file that looks up to date, and concurrent runs
+    # never write to the same file.
+    directory, name = os.path.split(output_path)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + name, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            wav_writer = wave.open(temp_file, 'wb')
+            try:
+                wav_writer.setnchannels(1)
+                wav_writer.setsampwidth(2)
+                wav_writer.setframerate(rate)
+                wav_writer.writeframes(samples.tobytes())
+            finally:
+                wav_writer.close()
+        os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        os.rename(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return output_path
+
+
+def preprocess_files(paths, processes=None, force=False):
+    """
+    Prepare many wav files in parallel on a pool of processes. Files that
+    can't be prepared are logged and used as they are.
+    :param paths: The wav files to prepare.
+    :param processes: The number of worker processes. Defaults to the
+                      number of CPUs.
+    :return: The paths to stream, in the same order as +paths+.
+    """
+    paths = list(paths)
+    if not paths:
+        return paths
+    prepared = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(preprocess_file, path, force) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                prepared.append(future.result())
+            except Exception as error:
+                log.warning('Could not preprocess {}: {}'.format(path, error))
+                prepared.append(path)
+    return prepared
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Trim and normalise every wav file under one or more folders.')
+    parser.add_argument("wav_dirs", nargs='+', metavar="DIR", help="The folders of wav files to prepare.")
+    parser.add_argument("--force", default=False, action='store_true',
+                        help="Prepare every file again, even if its cached copy is up to date.")
+    parser.add_argument("--processes", type=int, help="The number of worker processes. Defaults to the number "
+                                                      "of CPUs.")
+    return parser
+
+
+def main():
+    from voysis.cmd.batch import find_wav_files
+    args = create_parser().parse_args()
+    for wav_dir in args.wav_dirs:
+        paths = find_wav_files(wav_dir)
+        for path in preprocess_files(paths, processes=args.processes, force=args.force):
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
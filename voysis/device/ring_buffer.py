@@ -0,0 +1,136 @@
+"""
+A fixed-size byte ring buffer connecting an audio callback, which must
+never block, to a consumer that blocks until audio is available.
+"""
+import threading
+
+OVERWRITE = 'overwrite'
+DROP = 'drop'
+
+
+class RingBuffer(object):
+    """
+    A bounded FIFO of bytes, allocated once. Writes copy into the buffer
+    without allocating and never block. When a write doesn't fit, the
+    +overflow+ policy decides what is lost: OVERWRITE discards the oldest
+    unread bytes, so the reader skips ahead to recent audio, while DROP
+    discards the bytes that don't fit.
+
+    +overruns+ counts writes that didn't fit and +dropped_bytes+ the bytes
+    lost to them. +underruns+ counts reads that had to wait for data.
+    """
+
+    def __init__(self, capacity, overflow=OVERWRITE):
+        if overflow not in (OVERWRITE, DROP):
+            raise ValueError('Unsupported overflow policy {}'.format(overflow))
+        self.capacity = int(capacity)
+        self.overflow = overflow
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.underruns = 0
+        self._view = memoryview(bytearray(self.capacity))
+        self._condition = threading.Condition(threading.Lock())
+        # Total bytes ever written and read. Positions in the buffer are
+        # these modulo the capacity.
+        self._written = 0
+        self._read = 0
+        self._closed = False
+
+    def write(self, data, overflow=None):
+        """
+        Append +data+, applying the overflow policy if it doesn't fit.
+        :param overflow: Override the buffer's overflow policy for this
+                         write.
+        :return: The number of bytes written.
+        """
+        size = len(data)
+        with self._condition:
+            if self._closed or not size:
+                return 0
+            free = self.capacity - (self._written - self._read)
+            if size > free:
+                self.overruns += 1
+                if (overflow or self.overflow) == DROP:
+                    self.dropped_bytes += size - free
+                    size = free
+                else:
+                    if size > self.capacity:
+                        skipped = size - self.capacity
+                        data = memoryview(data)[skipped:]
+                        self._written += skipped
+                        size = self.capacity
+                    oldest = self._written + size - self.capacity
+                    if self._read < oldest:
+                        self.dropped_bytes += oldest - self._read
+                        self._read = oldest
+            if size:
+                self._copy_in(data, size)
+                self._written += size
+                self._condition.notify_all()
+            return size
+
+    def read(self, size, timeout=None):
+        """
+        Remove and return +size+ bytes, blocking until they are available.
+        :param timeout: The most seconds to wait, or None to wait forever.
+        :return: The bytes read. Fewer than +size+ bytes are returned once
+                 the buffer is closed, and None if the timeout expires.
+        """
+        with self._condition:
+            if self._written - self._read < size and not self._closed:
+                self.underruns += 1
+                if not self._condition.wait_for(
+                        lambda: self._written - self._read >= size or self._closed, timeout):
+                    return None
+            size = min(size, self._written - self._read)
+            data = self._copy_out(size)
+            self._read += size
+            return data
+
+    def available(self):
+        """
+        The number of unread bytes.
+        """
+        with self._condition:
+            return self._written - self._read
+
+    def clear(self, keep=0):
+        """
+        Discard all unread bytes and reset the counters, reopening the
+        buffer if it was closed.
+        :param keep: Instead leave the most recent +keep+ bytes to be read,
+                     rewinding into bytes already read if they are still
+                     held, so a reader can start from a moment in the past.
+        :return: The number of bytes left to read.
+        """
+        with self._condition:
+            self._read = self._written - min(keep, self._written, self.capacity)
+            self._closed = False
+            self.overruns = 0
+            self.dropped_bytes = 0
+            self.underruns = 0
+            return self._written - self._read
+
+    def close(self):
+        """
+        Wake any blocked reader. Later writes are ignored, and reads return
+        what is left without blocking.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _copy_in(self, data, size):
+        source = memoryview(data)
+        position = self._written % self.capacity
+        first = min(size, self.capacity - position)
+        self._view[position:position + first] = source[:first]
+        if first < size:
+            self._view[:size - first] = source[first:size]
+
+    def _copy_out(self, size):
+        position = self._read % self.capacity
+        first = min(size, self.capacity - position)
+        if first == size:
+            return self._view[position:position + size].tobytes()
+        return self._view[position:].tobytes() + self._view[:size - first].tobytes()
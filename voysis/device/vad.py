@@ -0,0 +1,122 @@
+"""
+Client-side voice activity detection, so that a query's audio can be
+finalised as soon as the speaker stops rather than when the server's VAD
+notices.
+"""
+import numpy as np
+
+CLIENT_VAD = 'client_vad'
+
+
+class EnergyVad(object):
+    """
+    Detects the end of speech in 16-bit mono PCM from the energy of short
+    frames, relative to an adaptive estimate of the background noise.
+
+    Speech starts after +speech_duration+ seconds of consecutive frames at
+    least +threshold_db+ louder than the noise floor (and louder than
+    +min_level_db+ dBFS), and ends after +silence_duration+ seconds of
+    consecutive quieter frames. The noise floor follows the quietest frame
+    seen, rising by at most +noise_rise_db+ per second.
+
+    Each chunk is processed with array operations over all of its frames,
+    so the cost per chunk barely depends on its length.
+    """
+
+    def __init__(self, rate=16000, frame_duration=0.02, threshold_db=12.0, min_level_db=-50.0,
+                 speech_duration=0.1, silence_duration=0.8, noise_rise_db=3.0):
+        self.rate = rate
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.noise_rise_db = noise_rise_db
+        self._frame_samples = max(1, int(rate * frame_duration))
+        self._frame_duration = self._frame_samples / float(rate)
+        self._speech_frames = max(1, int(round(speech_duration / self._frame_duration)))
+        self._silence_frames = max(1, int(round(silence_duration / self._frame_duration)))
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all state, ready for a new stream.
+        """
+        self.noise_db = None
+        self.speech_started = False
+        self.speech_ended = False
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._run = 0
+
+    def process(self, frame):
+        """
+        Add a chunk of audio.
+        :param frame: A bytes-like object of 16-bit little-endian samples.
+        :return: True if speech ended within this chunk.
+        """
+        if self.speech_ended:
+            return False
+        samples = np.frombuffer(frame, dtype='<i2', count=len(frame) // 2).astype(np.float32)
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        usable = len(samples) - len(samples) % self._frame_samples
+        self._pending = samples[usable:]
+        if not usable:
+            return False
+        levels = self._levels(samples[:usable].reshape(-1, self._frame_samples))
+        speech = self._is_speech(levels)
+        if not self.speech_started:
+            runs = _runs(speech, self._run)
+            started = np.flatnonzero(runs >= self._speech_frames)
+            if not len(started):
+                self._run = runs[-1] if speech[-1] else 0
+                return False
+            self.speech_started = True
+            speech = speech[started[0] + 1:]
+            self._run = 0
+            if not len(speech):
+                return False
+        runs = _runs(~speech, self._run)
+        self.speech_ended = bool(np.any(runs >= self._silence_frames))
+        self._run = 0 if speech[-1] else runs[-1]
+        return self.speech_ended
+
+    def filter_frames(self, frames_generator, on_speech_end=None):
+        """
+        Pass frames through until the end of speech is detected, then stop.
+        :param frames_generator: The frames to examine.
+        :param on_speech_end: A callable invoked when speech ends, before
+                              the generator stops.
+        """
+        self.reset()
+        try:
+            for frame in frames_generator:
+                yield frame
+                if self.process(frame):
+                    if on_speech_end:
+                        on_speech_end()
+                    return
+        finally:
+            close = getattr(frames_generator, 'close', None)
+            if close:
+                close()
+
+    def _levels(self, frames):
+        power = np.mean(np.square(frames / 32768.0), axis=1)
+        return 10.0 * np.log10(power + 1e-10)
+
+    def _is_speech(self, levels):
+        if self.noise_db is None:
+            self.noise_db = float(levels[0])
+        noise_db = self.noise_db
+        self.noise_db = min(noise_db + self.noise_rise_db * self._frame_duration * len(levels), float(levels.min()))
+        return (levels > noise_db + self.threshold_db) & (levels > self.min_level_db)
+
+
+def _runs(mask, carry):
+    """
+    The length of the run of True values ending at each position of +mask+,
+    where the first run continues one of length +carry+.
+    """
+    positions = np.arange(1, len(mask) + 1)
+    last_false = np.maximum.accumulate(np.where(mask, 0, positions))
+    runs = positions - last_false
+    runs[last_false == 0] += carry
+    return runs
@@ -0,0 +1,129 @@
+"""
+Streaming parsing and decoding of WAV (RIFF) files. Only the chunk headers
+are read up front; sample data is decoded a chunk at a time.
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+WavFormat = namedtuple('WavFormat', [
+    'format_tag', 'channels', 'rate', 'bits', 'block_align', 'data_offset', 'data_size'
+])
+
+
+class WavError(ValueError):
+    pass
+
+
+def read_wav_header(wav_file):
+    """
+    Read the RIFF header and the chunks preceding the sample data, leaving
+    +wav_file+ positioned at the first sample. Chunks other than 'fmt '
+    (such as LIST or fact metadata) are skipped.
+    :param wav_file: A binary file object positioned at the start of the file.
+    :return: A WavFormat, or None if the file is not a RIFF/WAVE file, in
+             which case the file position is left unchanged.
+    """
+    start = _tell(wav_file)
+    riff_header = wav_file.read(12)
+    if len(riff_header) < 12 or riff_header[0:4] != b'RIFF' or riff_header[8:12] != b'WAVE':
+        _rewind(wav_file, start)
+        return None
+    position = start + 12
+    fmt = None
+    while True:
+        chunk_header = wav_file.read(8)
+        if len(chunk_header) < 8:
+            raise WavError('No data chunk found in WAV file')
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        position += 8
+        if chunk_id == b'data':
+            if fmt is None:
+                raise WavError('WAV data chunk precedes its fmt chunk')
+            # A size of zero or 0xFFFFFFFF is written by recorders that
+            # stream the file; the data then runs to the end of the file.
+            data_size = None if chunk_size in (0, 0xFFFFFFFF) else chunk_size
+            return fmt._replace(data_offset=position, data_size=data_size)
+        padded_size = chunk_size + (chunk_size & 1)
+        if chunk_id == b'fmt ':
+            fmt = _parse_fmt(wav_file.read(padded_size)[:chunk_size])
+        else:
+            _skip(wav_file, padded_size)
+        position += padded_size
+
+
+def _parse_fmt(fmt_chunk):
+    if len(fmt_chunk) < 16:
+        raise WavError('WAV fmt chunk is too short')
+    format_tag, channels, rate, _, block_align, bits = struct.unpack('<HHIIHH', fmt_chunk[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 26:
+        # The real format tag is the first two bytes of the sub-format GUID.
+        format_tag = struct.unpack('<H', fmt_chunk[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise WavError('Unsupported WAV format tag 0x{:04x}'.format(format_tag))
+    if format_tag == WAVE_FORMAT_PCM and bits not in (8, 16, 24, 32):
+        raise WavError('Unsupported WAV sample size {}'.format(bits))
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits not in (32, 64):
+        raise WavError('Unsupported WAV float sample size {}'.format(bits))
+    if channels < 1 or block_align != channels * bits // 8:
+        raise WavError('Inconsistent WAV fmt chunk')
+    return WavFormat(format_tag, channels, rate, bits, block_align, None, None)
+
+
+def is_pcm16_mono(wav_format):
+    return wav_format.format_tag == WAVE_FORMAT_PCM and wav_format.bits == 16 and wav_format.channels == 1
+
+
+def to_pcm16_mono(data, wav_format):
+    """
+    Convert whole sample frames of +wav_format+ audio to 16-bit
+    little-endian mono PCM, mixing channels down by averaging.
+    :param data: A bytes-like object holding whole sample frames.
+    :return: The converted audio as bytes.
+    """
+    bits = wav_format.bits
+    if wav_format.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, dtype='<f{}'.format(bits // 8))
+        samples = np.clip(samples, -1.0, 1.0) * 32767.0
+    elif bits == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.int32) - 128) << 8
+    elif bits == 16:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.int32)
+    elif bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)) >> 16
+    else:
+        samples = np.frombuffer(data, dtype='<i4') >> 16
+    if wav_format.channels > 1:
+        samples = samples.reshape(-1, wav_format.channels).mean(axis=1)
+    return np.round(samples).astype('<i2').tobytes()
+
+
+def _tell(wav_file):
+    try:
+        return wav_file.tell()
+    except (AttributeError, IOError, OSError):
+        return 0
+
+
+def _rewind(wav_file, start):
+    try:
+        wav_file.seek(start)
+    except (AttributeError, IOError, OSError):
+        raise WavError('Cannot rewind a non-seekable file that is not a WAV file')
+
+
+def _skip(wav_file, size):
+    try:
+        wav_file.seek(size, 1)
+    except (AttributeError, IOError, OSError):
+        while size > 0:
+            skipped = len(wav_file.read(min(size, 65536)))
+            if not skipped:
+                break
+            size -= skipped
@@ -0,0 +1,328 @@
+"""
+A small metrics registry for processes that embed the client. Counters,
+gauges and histograms are updated by the clients and devices as they run,
+and exposed in the OpenMetrics text format by generate_openmetrics() or
+over HTTP by start_http_server().
+
+Metrics are registered once, at import, on the module's REGISTRY. Updating
+one takes a lock and an addition, so it is cheap enough for hot paths;
+where a value changes per audio frame, callers count locally and update
+the metric once per query.
+"""
+import bisect
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric(object):
+    """
+    A metric family. A family with +labelnames+ holds one child per set of
+    label values, returned by labels(). A family without labels is its own
+    only child.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self
+            self._init_value()
+
+    def labels(self, *values, **kwargs):
+        """
+        Get the child for a set of label values, given in order or by name.
+        Look children up once and keep them, rather than on every update.
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError('{} takes labels {}'.format(self.name, self.labelnames))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def samples(self):
+        """
+        :return: (suffix, labels, value) tuples for every child, where
+                 labels is a list of (name, value) pairs.
+        """
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            labels = list(zip(self.labelnames, values))
+            samples.extend(child._child_samples(labels))
+        return samples
+
+    def _new_child(self):
+        child = self.__class__.__new__(self.__class__)
+        child._lock = threading.Lock()
+        child._init_value()
+        return child
+
+    def _init_value(self):
+        raise NotImplementedError()
+
+    def _child_samples(self, labels):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """
+    A count that only goes up, such as the number of queries sent.
+    """
+
+    type_name = 'counter'
+
+    def _init_value(self):
+        self._value = 0.0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be increased')
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+    def _child_samples(self, labels):
+        return [('_total', labels, self._value)]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, such as the number of queries in
+    flight. set_function makes the gauge read its value from a callable
+    when collected, for values that are already tracked elsewhere.
+    """
+
+    type_name = 'gauge'
+
+    def _init_value(self):
+        self._value = 0.0
+        self._function = None
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = float(value)
+
+    def set_function(self, function):
+        self._function = function
+
+    def get(self):
+        return self._function() if self._function else self._value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def _child_samples(self, labels):
+        return [('', labels, self.get())]
+
+
+class Histogram(_Metric):
+    """
+    Counts observations, such as response latencies, into buckets by their
+    upper bound, with their total.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets if bucket != float('inf')))
+        _Metric.__init__(self, name, documentation, labelnames)
+
+    def _new_child(self):
+        child = self.__class__.__new__(self.__class__)
+        child._lock = threading.Lock()
+        child.buckets = self.buckets
+        child._init_value()
+        return child
+
+    def _init_value(self):
+        # One count per bucket plus one for +Inf, not cumulative.
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """
+        Observe the time taken by the body of a with statement, in seconds.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def _child_samples(self, labels):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append(('_bucket', labels + [('le', _format_value(bound))], cumulative))
+        samples.append(('_count', labels, cumulative))
+        samples.append(('_sum', labels, total))
+        return samples
+
+
+class Registry(object):
+    """
+    A set of metrics, keyed by name. Asking for a metric that is already
+    registered returns the existing one, provided it is of the same type.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def collect(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def _register(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+                raise ValueError('Metric {} is already registered differently'.format(name))
+            return metric
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def generate_openmetrics(registry=REGISTRY):
+    """
+    :return: The registry's metrics in the OpenMetrics text format.
+    """
+    lines = []
+    for metric in registry.collect():
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type_name))
+        lines.append('# HELP {} {}'.format(metric.name, _escape(metric.documentation)))
+        for suffix, labels, value in metric.samples():
+            if labels:
+                label_text = ','.join('{}="{}"'.format(name, _escape(label)) for name, label in labels)
+                lines.append('{}{}{{{}}} {}'.format(metric.name, suffix, label_text, _format_value(value)))
+            else:
+                lines.append('{}{} {}'.format(metric.name, suffix, _format_value(value)))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_openmetrics(path, registry=REGISTRY):
+    """
+    Dump the registry's metrics to a file, in the OpenMetrics text format.
+    """
+    with open(path, 'w') as metrics_file:
+        metrics_file.write(generate_openmetrics(registry))
+
+
+def start_http_server(port, host='', registry=REGISTRY):
+    """
+    Serve the registry's metrics at /metrics on a daemon thread.
+    :param port: The port to listen on, or 0 for any free port.
+    :return: The server. Its server_address gives the port in use, and
+             shutdown() stops it.
+    """
+
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = generate_openmetrics(registry).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class MetricsServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = MetricsServer((host, port), MetricsHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
@@ -0,0 +1 @@
+__all__ = ["frames", "server"]
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+The server side of the WebSocket framing protocol (RFC 6455), enough to
+speak to the Query API clients: the opening handshake, masked client
+frames, fragmented messages and the ping and close control frames.
+"""
+import base64
+import hashlib
+import struct
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+_HANDSHAKE_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    pass
+
+
+def accept_key(key):
+    """
+    The Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key.
+    """
+    digest = hashlib.sha1(key.strip().encode('ascii') + _HANDSHAKE_GUID).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def read_frame(rfile):
+    """
+    Read one frame from +rfile+.
+    :return: A (fin, opcode, payload) tuple, or None at the end of the stream.
+    """
+    header = _read_exactly(rfile, 2)
+    if header is None:
+        return None
+    first, second = struct.unpack('!BB', header)
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    masked = bool(second & 0x80)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', _read_required(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _read_required(rfile, 8))[0]
+    if length > _MAX_MESSAGE_SIZE:
+        raise FrameError('Frame of {} bytes is too large'.format(length))
+    mask = _read_required(rfile, 4) if masked else None
+    payload = _read_required(rfile, length) if length else b''
+    if mask:
+        payload = _unmask(payload, mask)
+    return fin, opcode, payload
+
+
+def read_message(rfile, on_control):
+    """
+    Read a complete message, joining fragmented frames. Control frames that
+    arrive between fragments are passed to +on_control+ as (opcode,
+    payload), and a close frame ends the message.
+    :return: An (opcode, payload) tuple, or None at the end of the stream.
+    """
+    opcode = None
+    fragments = []
+    size = 0
+    while True:
+        frame = read_frame(rfile)
+        if frame is None:
+            return None
+        fin, frame_opcode, payload = frame
+        if frame_opcode >= OPCODE_CLOSE:
+            if frame_opcode == OPCODE_CLOSE:
+                return frame_opcode, payload
+            on_control(frame_opcode, payload)
+            continue
+        if frame_opcode != OPCODE_CONTINUATION:
+            opcode = frame_opcode
+        elif opcode is None:
+            raise FrameError('Continuation frame without a message to continue')
+        fragments.append(payload)
+        size += len(payload)
+        if size > _MAX_MESSAGE_SIZE:
+            raise FrameError('Message is too large')
+        if fin:
+            return opcode, b''.join(fragments)
+
+
+def encode_frame(opcode, payload):
+    """
+    Encode a single unmasked frame, as sent by a server.
+    """
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 0x10000:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _unmask(payload, mask):
+    # XOR the whole payload at once as one big integer, rather than byte
+    # by byte.
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    unmasked = int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')
+    return unmasked.to_bytes(length, 'big')
+
+
+def _read_exactly(rfile, size):
+    data = rfile.read(size)
+    if not data:
+        return None
+    while len(data) < size:
+        more = rfile.read(size - len(data))
+        if not more:
+            raise FrameError('Connection closed mid-frame')
+        data += more
+    return data
+
+
+def _read_required(rfile, size):
+    data = _read_exactly(rfile, size)
+    if data is None:
+        raise FrameError('Connection closed mid-frame')
+    return data
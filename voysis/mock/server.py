@@ -0,0 +1,566 @@
+"""
+A local stand-in for the Query API, for exercising and benchmarking the
+clients without a live service. One port serves both the HTTP API and
+WebSocket connections, with no dependencies beyond those of the clients.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import socket
+import threading
+import uuid
+from datetime import datetime
+from datetime import timedelta
+
+import glog as log
+from dateutil.tz import tzutc
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from voysis import config as config
+from voysis.client import session_log as session_log
+from voysis.mock import frames as frames
+
+_FEEDBACK_URI = re.compile(r'^/queries/([^/]+)/feedback$')
+
+
+class MockQueryServer(object):
+    """
+    Serves the Query API protocol from memory. App tokens are issued for
+    any auth token, audio queries are answered with a canned result, and
+    feedback is accepted for any query.
+
+    Over WebSocket, a vad_stop notification is sent +vad_delay+ seconds
+    after +vad_after+ seconds of audio have been received (never if 0, or
+    if the client ignores VAD), and the query_complete notification
+    follows +completion_delay+ seconds after the audio ends. Every response is
+    delayed by +response_delay+ seconds. A fraction +error_rate+ of
+    requests fail with a 500 response, and a fraction +drop_rate+ have
+    their connection dropped without a response.
+
+    When +replay_session+ names a session log, WebSocket queries are
+    instead answered with the responses and notifications recorded in it,
+    at their recorded times after the query was created. Each new query
+    takes the next recorded query, cycling through them in order.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param host: The interface to listen on.
+        :param port: The port to listen on. 0 picks a free port, which is
+                     then available as +port+ once started.
+        """
+        self.host = host
+        self.port = port
+        self.response_delay = 0.0
+        self.vad_after = 0.0
+        self.vad_delay = 0.0
+        self.completion_delay = 0.0
+        self.error_rate = 0.0
+        self.drop_rate = 0.0
+        self.token_lifetime = 3600
+        self.seed = None
+        self.replay_session = ''
+        self.stats = {
+            'connections': 0,
+            'requests': 0,
+            'queries': 0,
+            'audioBytes': 0,
+            'errorsInjected': 0,
+            'connectionsDropped': 0
+        }
+        self._stats_lock = threading.Lock()
+        self._random = random.Random()
+        self._http_server = None
+        self._server_thread = None
+        self._sessions = set()
+        self._sessions_lock = threading.Lock()
+        self._recorded_queries = None
+        self._next_recorded_query = 0
+
+    def start(self):
+        """
+        Start serving on a background thread.
+        :return: This server.
+        """
+        self._bind()
+        self._server_thread = threading.Thread(target=self._http_server.serve_forever)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serve on the calling thread until stop() is called.
+        :return: None
+        """
+        self._bind()
+        try:
+            self._http_server.serve_forever()
+        finally:
+            self._http_server.server_close()
+
+    def stop(self):
+        """
+        Stop serving and drop every open WebSocket connection.
+        :return: None
+        """
+        http_server = self._http_server
+        if http_server is None:
+            return
+        self._http_server = None
+        http_server.shutdown()
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.drop()
+        http_server.server_close()
+        if self._server_thread:
+            self._server_thread.join()
+            self._server_thread = None
+
+    def url(self, scheme='ws'):
+        """
+        The URL clients should use to reach this server.
+        :param scheme: 'ws' for WSClient or 'http' for HTTPClient.
+        """
+        path = '/websocketapi' if scheme in ('ws', 'wss') else ''
+        return '{}://{}:{}{}'.format(scheme, self.host, self.port, path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def handle_request(self, method, uri, headers, entity):
+        """
+        Handle a Query API request, received over either transport.
+        :return: A (response_code, response_message, response_entity, query)
+                 tuple, where query is the MockQuery created by the request,
+                 if any.
+        """
+        self._count('requests')
+        if method == 'POST' and uri == '/tokens':
+            if not headers.get('Authorization'):
+                return 401, 'Unauthorized', {'message': 'No auth token provided'}, None
+            expires_at = datetime.now(tzutc()) + timedelta(seconds=self.token_lifetime)
+            return 200, 'OK', {'token': 'mock-' + str(uuid.uuid4()), 'expiresAt': expires_at.isoformat()}, None
+        if method == 'POST' and uri == '/queries':
+            query = MockQuery(entity or {}, str(headers.get('X-Voysis-Ignore-Vad')).lower() == 'true')
+            self._count('queries')
+            return 201, 'Created', query.to_entity(), query
+        feedback_match = _FEEDBACK_URI.match(uri)
+        if method == 'PATCH' and feedback_match:
+            feedback = dict(entity or {})
+            feedback['queryId'] = feedback_match.group(1)
+            return 200, 'OK', feedback, None
+        return 404, 'Not Found', {'message': 'No mock handler for {} {}'.format(method, uri)}, None
+
+    def choose_failure(self):
+        """
+        Decide whether to inject a failure into the next request.
+        :return: 'drop', 'error' or None.
+        """
+        roll = self._random.random()
+        if roll < self.drop_rate:
+            self._count('connectionsDropped')
+            return 'drop'
+        if roll < self.drop_rate + self.error_rate:
+            self._count('errorsInjected')
+            return 'error'
+        return None
+
+    def add_audio(self, query, data):
+        """
+        Record audio received for +query+.
+        :return: True if the audio triggers VAD.
+        """
+        self._count('audioBytes', len(data))
+        query.audio_bytes += len(data)
+        return (self.vad_after > 0 and not query.ignore_vad and
+                query.audio_bytes >= self.vad_after * query.bytes_per_second)
+
+    def next_recorded_query(self):
+        """
+        :return: The RecordedQuery to replay for the next query, or None if
+                 not replaying a session.
+        """
+        if not self._recorded_queries:
+            return None
+        with self._stats_lock:
+            recorded_query = self._recorded_queries[self._next_recorded_query % len(self._recorded_queries)]
+            self._next_recorded_query += 1
+        return recorded_query
+
+    def _bind(self):
+        self._random.seed(self.seed)
+        if self.replay_session:
+            self._recorded_queries = session_log.recorded_queries(self.replay_session)
+            self._next_recorded_query = 0
+            log.info('Replaying {} queries from {}'.format(len(self._recorded_queries), self.replay_session))
+        self._http_server = _HTTPServer((self.host, self.port), _MockRequestHandler)
+        self._http_server.mock = self
+        self.port = self._http_server.server_address[1]
+        log.info('Mock Query API listening on {}'.format(self.url('http')))
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self.stats[stat] += amount
+
+    def _add_session(self, session):
+        self._count('connections')
+        with self._sessions_lock:
+            self._sessions.add(session)
+
+    def _remove_session(self, session):
+        with self._sessions_lock:
+            self._sessions.discard(session)
+
+
+class MockQuery(object):
+    """
+    The state of an audio query on the mock server.
+    """
+
+    def __init__(self, entity, ignore_vad=False):
+        self.id = str(uuid.uuid4())
+        self.conversation_id = entity.get('conversationId') or str(uuid.uuid4())
+        self.locale = entity.get('locale', 'en-US')
+        self.context = entity.get('context') or {}
+        self.audio_type = (entity.get('audioQuery') or {}).get('mimeType', 'audio/pcm;bits=16;rate=16000')
+        self.bytes_per_second = _bytes_per_second(self.audio_type)
+        self.ignore_vad = ignore_vad
+        self.audio_bytes = 0
+        self.finished = False
+        self.replayed = False
+
+    def to_entity(self, completed=False):
+        entity = {
+            'id': self.id,
+            'conversationId': self.conversation_id,
+            'locale': self.locale,
+            'queryType': 'audio',
+            'audioQuery': {'mimeType': self.audio_type},
+            '_links': {
+                'self': {'href': '/queries/' + self.id},
+                'audio': {'href': '/queries/' + self.id + '/audio'}
+            }
+        }
+        if completed:
+            entity['textQuery'] = {'text': 'mock query'}
+            entity['intent'] = 'mock'
+            entity['reply'] = {'text': 'This is a mock response.'}
+            entity['entities'] = {}
+            context = dict(self.context)
+            context['audioBytes'] = self.audio_bytes
+            entity['context'] = context
+        return entity
+
+
+def _bytes_per_second(audio_type):
+    params = dict(part.strip().split('=', 1) for part in audio_type.split(';')[1:] if '=' in part)
+    rate = int(params.get('rate', 16000))
+    if audio_type.startswith('audio/pcmu'):
+        return rate
+    if audio_type.startswith('audio/pcm'):
+        return rate * int(params.get('bits', 16)) // 8 * int(params.get('channels', 1))
+    # Compressed audio: assume the usual 16-bit 16kHz source at about half size.
+    return 16000
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _MockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._upgrade()
+        else:
+            self._send_json(404, {'message': 'Not Found'})
+
+    def do_POST(self):
+        self._handle_http()
+
+    def do_PATCH(self):
+        self._handle_http()
+
+    def log_message(self, format, *args):
+        log.debug('Mock Query API: ' + format % args)
+
+    def _handle_http(self):
+        mock = self.server.mock
+        headers = dict(self.headers.items())
+        content_type = self.headers.get('Content-Type', '')
+        is_audio = self.path == '/queries' and content_type.startswith('audio/')
+        if is_audio:
+            entity = json.loads(base64.b64decode(self.headers.get('X-Voysis-Entity', 'e30=')).decode('utf-8'))
+            entity.setdefault('audioQuery', {})['mimeType'] = content_type
+        else:
+            body = b''.join(self._read_body())
+            entity = json.loads(body.decode('utf-8')) if body else None
+        failure = mock.choose_failure()
+        if failure == 'drop':
+            self._drop()
+            return
+        if failure == 'error':
+            for _ in self._read_body() if is_audio else ():
+                pass
+            self._send_json(500, {'message': 'Injected error'}, mock.response_delay)
+            return
+        response_code, _, response_entity, query = mock.handle_request(self.command, self.path, headers, entity)
+        if query and is_audio:
+            # The HTTP API has no notifications, so audio is read to the end
+            # and the completed query is the response.
+            for data in self._read_body():
+                mock.add_audio(query, data)
+            query.finished = True
+            self._send_json(200, query.to_entity(completed=True), mock.response_delay + mock.completion_delay)
+        else:
+            self._send_json(response_code, response_entity, mock.response_delay)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                yield self.rfile.read(length)
+
+    def _send_json(self, status, entity, delay=0):
+        if delay > 0:
+            threading.Event().wait(delay)
+        body = json.dumps(entity).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drop(self):
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+
+    def _upgrade(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key:
+            self._send_json(400, {'message': 'Missing Sec-WebSocket-Key'})
+            return
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', frames.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        _WebSocketSession(self.server.mock, self).run()
+
+
+class _WebSocketSession(object):
+    """
+    One WebSocket connection. Audio frames belong to the query most
+    recently created on the connection, as they do on the real service.
+    """
+
+    def __init__(self, mock, handler):
+        self._mock = mock
+        self._handler = handler
+        self._write_lock = threading.Lock()
+        self._streaming_query = None
+        self._closed = False
+
+    def run(self):
+        self._mock._add_session(self)
+        try:
+            while not self._closed:
+                message = frames.read_message(self._handler.rfile, self._on_control)
+                if message is None:
+                    break
+                opcode, payload = message
+                if opcode == frames.OPCODE_CLOSE:
+                    self._write(frames.OPCODE_CLOSE, payload[:2])
+                    break
+                if opcode == frames.OPCODE_TEXT:
+                    self._on_text(json.loads(payload.decode('utf-8')))
+                else:
+                    self._on_audio(payload)
+        except (frames.FrameError, ValueError, OSError, socket.error) as error:
+            if not self._closed:
+                log.info('Mock WebSocket connection failed: {}'.format(error))
+        finally:
+            self._closed = True
+            self._mock._remove_session(self)
+
+    def drop(self):
+        """
+        Close the connection abruptly, without a close frame.
+        """
+        self._closed = True
+        self._handler._drop()
+
+    def _on_control(self, opcode, payload):
+        if opcode == frames.OPCODE_PING:
+            self._write(frames.OPCODE_PONG, payload)
+
+    def _on_text(self, message):
+        if message.get('type') != 'request':
+            return
+        failure = self._mock.choose_failure()
+        if failure == 'drop':
+            self.drop()
+            return
+        request_id = message.get('requestId')
+        if failure == 'error':
+            self._respond(request_id, 500, 'Injected error', None)
+            return
+        response_code, response_message, entity, query = self._mock.handle_request(
+            message.get('method', 'POST'), message.get('restUri', ''), message.get('headers') or {},
+            message.get('entity')
+        )
+        if query:
+            self._streaming_query = query
+            recorded_query = self._mock.next_recorded_query()
+            if recorded_query:
+                self._replay(request_id, query, recorded_query)
+                return
+        self._respond(request_id, response_code, response_message, entity)
+
+    def _on_audio(self, data):
+        query = self._streaming_query
+        if query is None or query.finished:
+            return
+        if data == b'\x04':
+            if not query.replayed:
+                self._finish(query)
+        elif self._mock.add_audio(query, data) and not query.replayed:
+            # Later audio, until the next query, is ignored.
+            query.finished = True
+            self._later(self._mock.vad_delay, self._vad_stop, query)
+
+    def _vad_stop(self, query):
+        self._notify('vad_stop')
+        self._finish(query)
+
+    def _finish(self, query):
+        query.finished = True
+        self._later(self._mock.completion_delay, self._notify, 'query_complete', query.to_entity(completed=True))
+
+    def _replay(self, request_id, query, recorded_query):
+        """
+        Answer +query+ with the messages recorded for +recorded_query+, at
+        the same times after the creation request.
+        """
+        query.replayed = True
+        for offset, message in recorded_query.messages:
+            if message.get('type') == 'response':
+                message = dict(message, requestId=request_id)
+            self._later(offset, self._send_replayed, query, message)
+
+    def _send_replayed(self, query, message):
+        if message.get('type') == 'notification':
+            # The recorded query has stopped taking audio.
+            query.finished = True
+        self._send_json(message)
+
+    def _respond(self, request_id, response_code, response_message, entity):
+        response = {
+            'type': 'response',
+            'requestId': request_id,
+            'responseCode': response_code,
+            'responseMessage': response_message,
+            'entity': entity
+        }
+        self._later(self._mock.response_delay, self._send_json, response)
+
+    def _notify(self, notification_type, entity=None):
+        notification = {
+            'type': 'notification',
+            'notificationType': notification_type
+        }
+        if entity is not None:
+            notification['entity'] = entity
+        self._send_json(notification)
+
+    def _later(self, delay, function, *args):
+        if delay > 0:
+            timer = threading.Timer(delay, function, args)
+            timer.daemon = True
+            timer.start()
+        else:
+            function(*args)
+
+    def _send_json(self, message):
+        self._write(frames.OPCODE_TEXT, json.dumps(message))
+
+    def _write(self, opcode, payload):
+        if self._closed:
+            return
+        try:
+            with self._write_lock:
+                self._handler.wfile.write(frames.encode_frame(opcode, payload))
+        except (OSError, socket.error):
+            self._closed = True
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Serve a local mock of the Voysis Query API.')
+    parser.add_argument("-c",
+                        "--config",
+                        dest="config_file", metavar="str", type=str,
+                        help="A config file with a [mock_server] section.")
+    parser.add_argument("--host", help="The interface to listen on.")
+    parser.add_argument("-p", "--port", help="The port to listen on.", type=int)
+    parser.add_argument("--response-delay", dest="response_delay", type=float,
+                        help="Seconds to wait before sending each response.")
+    parser.add_argument("--vad-after", dest="vad_after", type=float,
+                        help="Send vad_stop after this many seconds of audio.")
+    parser.add_argument("--vad-delay", dest="vad_delay", type=float,
+                        help="Seconds between VAD triggering and sending vad_stop.")
+    parser.add_argument("--completion-delay", dest="completion_delay", type=float,
+                        help="Seconds between the end of the audio and query_complete.")
+    parser.add_argument("--error-rate", dest="error_rate", type=float,
+                        help="The fraction of requests to fail with a 500 response.")
+    parser.add_argument("--drop-rate", dest="drop_rate", type=float,
+                        help="The fraction of requests whose connection is dropped.")
+    parser.add_argument("--seed", type=int, help="Seed the failure injection, for repeatable runs.")
+    parser.add_argument("--replay", dest="replay_session", metavar="session_log",
+                        help="Answer WebSocket queries with the messages recorded in a session log, with their "
+                             "recorded timing.")
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    mock = MockQueryServer(port=8080)
+    if args.config_file:
+        config.load_config(args.config_file)
+        config.apply_config(mock, 'mock_server')
+    for name in ('host', 'port', 'response_delay', 'vad_after', 'vad_delay', 'completion_delay', 'error_rate',
+                 'drop_rate', 'seed', 'replay_session'):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(mock, name, value)
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()